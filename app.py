@@ -1,16 +1,20 @@
 #!/usr/bin/env python
 
 import streamlit as st
-from lib.common import Model
-from lib.app_utils import group_params, select_dict, NullContextManager
+from lib.common import EvaluationSession
+from lib.app_utils import group_params, select_dict, NullContextManager, bar_figure
 
 from lib.settings import settings, OUTFILE
-import plotly.express as px
 from tornado.web import RequestHandler
-from lib.api import setup_api_handler
+from lib.api import setup_api_handler, setup_api
+from lib.reload import ModelHolder
+from lib.sensitivity import uncertainty
 
 CSS_FILE = "static/style.css"
 
+# Number of Monte Carlo samples for uncertainty bands
+UNCERTAINTY_SAMPLES = 8192
+
 def init_app():
 
     st.set_page_config(
@@ -20,7 +24,13 @@ def init_app():
 
     @st.cache_resource()
     def load_model():
-        return Model.from_file(OUTFILE)
+        # Expressions are compiled on first use, or in background, default impact first.
+        # Symbolic trees are freed once compiled.
+        # The model is reloaded in background when the file changes, and swapped once compiled.
+        # Uncertainty bands of the previous version are dropped with it
+        holder = ModelHolder(OUTFILE, warmup=True, runtime=True, on_swap=lambda state: uncertainty_bands.clear())
+        holder.watch()
+        return holder
 
     # Load CSS within page
     with open(CSS_FILE, 'r') as f:
@@ -38,7 +48,14 @@ def init_app():
     setup_api_handler('/hello', HelloHandler)
 
     # Load model once
-    return load_model()
+    holder = load_model()
+
+    # JSON API, sharing the same model holder
+    setup_api(holder)
+
+    # Same model for the whole run, even if a new one is swapped in meanwhile : read model and version at once
+    state = holder.state
+    return state.model, state.version
 
 def display_settings(model):
 
@@ -51,14 +68,44 @@ def display_settings(model):
     fu_options = {key: "%s %s" % (key, "[%s]" % fu.unit if fu.unit else "") for key, fu in model.functional_units.items()}
     functional_unit = select_dict("Functional unit", options=fu_options)
 
-    return impact, functional_unit
+    sort_by_sensitivity = st.checkbox(
+        "Sort parameters by sensitivity",
+        help="Order parameters by the relative change of the total impact for a relative change of the parameter, at current values")
+
+    return impact, functional_unit, sort_by_sensitivity
+
+def sensitivity_order(model, impact, functional_unit):
+    """
+    Params sorted by decreasing absolute elasticity of the total impact, at current values of the widgets.
+    Enum params and params without effect come last.
+    :return: <List of params>, <Dict of param name => elasticity>
+    """
 
-def display_params(model):
+    # Widgets are not rendered yet : take their values of last run
+    values = {name: st.session_state.get(name, param.default) for name, param in model.params.items()}
+
+    elasticities = model.elasticities(impact, functional_unit, **values)
+
+    params = [model.params[name] for name in elasticities]
+    params += [param for param in model.params.values() if not param.name in elasticities]
+
+    return params, elasticities
+
+def display_params(model, impact, functional_unit, sort_by_sensitivity=False):
     """ Display params and return current values """
 
     st.header("Parameters")
 
-    param_groups = group_params(model.params.values())
+    # Params having an effect on selected impact : others are marked
+    active_params = model.affecting_params(impact, functional_unit)
+
+    if sort_by_sensitivity :
+        # Single list, without groups
+        params, elasticities = sensitivity_order(model, impact, functional_unit)
+        param_groups = {None: params}
+    else:
+        elasticities = dict()
+        param_groups = group_params(model.params.values())
 
     # Gather param values by name
     param_values = dict()
@@ -96,6 +143,16 @@ def display_params(model):
                         options=param.values,
                         index=default_index)
 
+                elif param.min == param.max :
+
+                    # Fixed value : sliders require min < max
+                    param_values[param.name] = st.number_input(
+                        key=param.name,
+                        label=param_label,
+                        help=param.label,
+                        value=float(param.min),
+                        disabled=True)
+
                 else:
                     param_values[param.name] = st.slider(
                         key=param.name,
@@ -104,6 +161,12 @@ def display_params(model):
                         min_value=float(param.min),
                         max_value=float(param.max),
                         value=param.default)
+
+                if not param.name in active_params :
+                    st.caption("No effect on *%s*" % impact)
+                elif param.name in elasticities :
+                    st.caption("Sensitivity : %+.2f %% of impact for +1 %%" % elasticities[param.name])
+
     return param_values
 
 
@@ -112,72 +175,118 @@ def display_header():
     with open("static/header.md", "r") as f:
         st.markdown(f.read())
 
-def display_results(model, impact, functional_unit, param_values):
+@st.cache_data(show_spinner="Computing uncertainty ...")
+def uncertainty_bands(_model, version, impact, n=UNCERTAINTY_SAMPLES):
+    """Percentiles of an impact, with all params varying within their ranges. Computed once per impact and version of the model,
+    and cleared when a new version is swapped in"""
+    return uncertainty(_model, n=n, impacts=[impact], percentiles=[5, 95])[impact]
+
+def evaluation_session(model):
+    """Evaluation session of the user, only recomputing expressions affected by changed params"""
+
+    session = st.session_state.get("evaluation_session", None)
+    if session is None or session.model is not model :
+        session = EvaluationSession(model)
+        st.session_state["evaluation_session"] = session
+    return session
+
+def display_results(model, version, impact, functional_unit, param_values):
 
     st.header("📊 Results")
 
-    val, unit = model.evaluate(
-            impact = impact,
+    # Compute total and all axes
+    vals_by_axis, unit = evaluation_session(model).evaluate(
+            impact=impact,
             functional_unit=functional_unit,
-            axis="total",
             **param_values)
 
-    # Total impacts
-    st.subheader("Total")
-    st.markdown("Total impact for *%s* by functional unit *%s*" % (impact, functional_unit))
-
-    st.metric(label=impact, value="%.3g [%s]" % (val, unit))
+    display_total(model, version, impact, functional_unit, vals_by_axis["total"], unit)
 
     # Impact by axes
     for axis in settings.axes:
         if axis is None :
             continue
+        display_axis(axis, impact, functional_unit, vals_by_axis[axis], unit)
 
-        st.subheader("Axis : %s" % axis)
+@st.fragment
+def display_total(model, version, impact, functional_unit, val, unit):
 
-        st.markdown("Impact for *%s* by functional unit *%s*, splitted by *%s*" % (impact, functional_unit, axis))
-        res, unit = model.evaluate(
-            impact=impact,
-            functional_unit=functional_unit,
-            axis=axis,
-            **param_values)
+    # Total impacts
+    st.subheader("Total")
+    st.markdown("Total impact for *%s* by functional unit *%s*" % (impact, functional_unit))
+
+    col_value, col_ranges = st.columns([1, 2])
+    col_value.metric(label=impact, value="%.3g [%s]" % (val, unit))
+
+    # Ranges of the impact : only computed when asked, as they compile and evaluate the expressions of the impact
+    if not col_ranges.checkbox(
+            "Show uncertainty range and bounds",
+            key="show_ranges",
+            help="Range of the impact and its guaranteed min and max, when all parameters vary within their bounds"):
+        return
+
+    bands = uncertainty_bands(model, version, impact)[functional_unit]["percentiles"]
+
+    # Guaranteed min and max, by interval arithmetic. Cached by the model
+    lower, upper = model.bounds(impact, functional_unit)[0]
 
-        # Cleanup
-        res = dict(sorted(res.items()))
-        for key in [None, "null"] :
-            if key in res:
-                del res[key]
+    col_bands, col_bounds = col_ranges.columns(2)
+    col_bands.metric(
+        label="Uncertainty range (5% - 95%)",
+        value="%.3g - %.3g" % (bands[5], bands[95]),
+        help="Range of the impact when all parameters vary uniformly within their bounds")
+    col_bounds.metric(
+        label="Bounds (min - max)",
+        value="%.3g - %.3g" % (lower, upper),
+        help="Guaranteed min and max of the impact when all parameters vary within their bounds. "
+             "The actual extremes may be closer to each other")
 
-        # Prepare for plotly
-        data = dict(
-            key=list(res.keys()),
-            val=list(res.values()))
+@st.fragment
+def display_axis(axis, impact, functional_unit, res, unit):
 
-        # Display chart
-        st.plotly_chart(px.bar(
-            data,
-            x="key",
-            y="val",
-            labels=dict(
-                key=axis,
-                val="%s [%s]" % (impact, unit)
-            )))
+    st.subheader("Axis : %s" % axis)
+
+    st.markdown("Impact for *%s* by functional unit *%s*, splitted by *%s*" % (impact, functional_unit, axis))
+
+    # Sorting of the bars : widget local to the fragment, only rerunning this axis
+    by_value = st.radio(
+        "Sort by",
+        ["Name", "Value"],
+        key="sort_%s" % axis,
+        horizontal=True,
+        label_visibility="collapsed") == "Value"
+
+    # Cleanup
+    res = dict(sorted(res.items(), key=(lambda item : -item[1]) if by_value else None))
+    for key in [None, "null"] :
+        if key in res:
+            del res[key]
+
+    # Display chart. Built once for each data
+    fig = bar_figure(
+        tuple(res.keys()),
+        tuple(res.values()),
+        x_label=axis,
+        y_label="%s [%s]" % (impact, unit))
+    st.plotly_chart(fig)
 
 
 
 def main():
 
-    model = init_app()
+    model, version = init_app()
 
     with st.sidebar:
 
-        impact, functional_unit = display_settings(model)
+        impact, functional_unit, sort_by_sensitivity = display_settings(model)
+
+        param_values = display_params(model, impact, functional_unit, sort_by_sensitivity)
 
-        param_values = display_params(model)
+        st.caption("Model version %s" % version)
 
     display_header()
 
-    display_results(model, impact, functional_unit, param_values)
+    display_results(model, version, impact, functional_unit, param_values)
 
 
 main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+
+# Add current dir to PATH
+sys.path.insert(0, os.getcwd())
+
+from lib.benchmark import run_benchmarks, save_run, load_history, compare, BENCHMARKS
+from lib.settings import OUTFILE, BENCHMARK_FILE
+
+
+def run(args):
+    results = run_benchmarks(args.model, args.filter)
+    if not args.no_save :
+        save_run(args.history, results, args.label)
+        print("Results appended to %s" % args.history)
+
+
+def compare_runs(args):
+    """Compare a run to a baseline run of the history. Exit with status 1 in case of regression"""
+
+    history = load_history(args.history)
+    if len(history) < 2 :
+        print("At least two runs are required in %s" % args.history)
+        sys.exit(1)
+
+    baseline = history[args.baseline]
+    current = history[args.current]
+    print("Baseline : %s (%s), current : %s (%s)" % (baseline["date"], baseline["commit"], current["date"], current["commit"]))
+
+    regressions = compare(baseline["results"], current["results"], args.threshold)
+
+    if len(regressions) > 0 :
+        print("%d regression(s) above %.0f %%" % (len(regressions), args.threshold * 100))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmarks of loading and evaluation of the model")
+    parser.add_argument("--history", default=BENCHMARK_FILE, help="History file of results. Default : %s" % BENCHMARK_FILE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run benchmarks and append results to history")
+    run_parser.add_argument("--model", default=OUTFILE, help="Model file. Default : %s" % OUTFILE)
+    run_parser.add_argument("--filter", nargs="*", help="Only run benchmarks starting with these names : %s" % list(BENCHMARKS.keys()))
+    run_parser.add_argument("--label", help="Label of the run, saved in history")
+    run_parser.add_argument("--no-save", action="store_true", help="Do not save results in history")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two runs of history. Fails in case of regression")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="Max relative increase of time and peak memory. Default : 0.2 (+20%%)")
+    compare_parser.add_argument("--baseline", type=int, default=-2, help="Index of baseline run in history. Default : -2 (previous run)")
+    compare_parser.add_argument("--current", type=int, default=-1, help="Index of compared run in history. Default : -1 (last run)")
+    compare_parser.set_defaults(func=compare_runs)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+import os
+import sys
+
+# Add current dir to PATH
+sys.path.insert(0, os.getcwd())
+
+from lib.common import build_compiled_cache, Model
+from lib.settings import OUTFILE
+from lib.utils import timer
+
+
+def compile():
+
+    with timer("Compile %s" % OUTFILE):
+        cache_file = build_compiled_cache(OUTFILE)
+
+    print("Compiled model saved to %s" % cache_file)
+
+    print_fast_path_report(Model.from_file(OUTFILE))
+
+
+def print_fast_path_report(model:Model):
+    """Print which expressions are polynomial, and which ones are evaluated by their polynomial table in batch evaluation"""
+
+    nb_fast = nb_lambdas = nb_poly = nb_keys = 0
+    for axis, impacts in model.fast_path_report().items():
+        for impact, report in impacts.items():
+            nb_lambdas += 1
+            nb_fast += report["fast"]
+            nb_poly += report["polynomial"]
+            nb_keys += report["total"]
+            if report["polynomial"] < report["total"] :
+                print("Axis %s, impact %s : %d / %d keys are not polynomial" % (axis, impact, report["total"] - report["polynomial"], report["total"]))
+
+    print("Polynomial expressions : %d / %d" % (nb_poly, nb_keys))
+    print("Polynomial fast path : %d / %d impacts x axes" % (nb_fast, nb_lambdas))
+
+    table = model.polynomial_table(list(model.impacts.keys()))
+    if table is not None :
+        print("Polynomial fast path for all impacts at once : %d monomials, %d coefficients" % (len(table.monomials), table.coefs.nnz))
+
+
+if __name__ == '__main__':
+    compile()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+
+# Add current dir to PATH
+sys.path.insert(0, os.getcwd())
+
+from lib.binary import json_to_binary, binary_to_json
+from lib.settings import OUTFILE, BINFILE
+from lib.utils import timer
+
+
+def convert(input, output, to_json=False):
+
+    with timer("Convert %s" % input):
+        if to_json :
+            binary_to_json(input, output)
+        else:
+            json_to_binary(input, output)
+
+    print("Model saved to %s (%d bytes)" % (output, os.path.getsize(output)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Convert the model between JSON and binary formats")
+    parser.add_argument("--to-json", action="store_true", help="Convert binary model back to JSON")
+    parser.add_argument("input", nargs="?", help="Input file. Default : %s (or %s with --to-json)" % (OUTFILE, BINFILE))
+    parser.add_argument("output", nargs="?", help="Output file. Default : %s (or %s with --to-json)" % (BINFILE, OUTFILE))
+    args = parser.parse_args()
+
+    default_input, default_output = (BINFILE, OUTFILE) if args.to_json else (OUTFILE, BINFILE)
+
+    convert(args.input or default_input, args.output or default_output, args.to_json)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+
+# Add current dir to PATH
+sys.path.insert(0, os.getcwd())
+
+from lib.common import Model
+from lib.parallel import ParallelEvaluator
+from lib.scenarios import read_scenarios, grid_scenarios, evaluate_scenarios, CHUNK_SIZE, FORMATS
+from lib.sensitivity import SAMPLING_METHODS
+from lib.settings import OUTFILE
+
+
+def evaluate(args):
+
+    model = Model.from_file(args.model)
+
+    if args.scenarios :
+        total, scenarios = read_scenarios(model, args.scenarios, args.chunk_size)
+    else:
+        total, scenarios = grid_scenarios(
+            model,
+            grid_params=args.grid,
+            sampled_params=args.sample,
+            samples=args.samples,
+            method=args.method,
+            seed=args.seed,
+            chunk_size=args.chunk_size)
+
+    evaluator = ParallelEvaluator(model, args.jobs, filename=args.model) if args.jobs > 1 else None
+
+    try:
+        evaluate_scenarios(
+            model,
+            scenarios,
+            args.output,
+            impacts=args.impacts,
+            functional_units=args.functional_units,
+            axes=args.axes,
+            total=total,
+            include_params=not args.no_params,
+            evaluator=evaluator)
+    finally:
+        if evaluator is not None :
+            evaluator.close()
+
+    print("Results saved to %s" % args.output)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description="Evaluate a set of scenarios, read from a file or generated as a grid, and stream the results to a file. "
+                    "Results have one column per impact, functional unit, axis and axis key, named '<impact>/<functional unit>/<axis>[/<axis key>]'")
+
+    parser.add_argument("output", help="Output file, with extension %s" % FORMATS)
+    parser.add_argument("--model", default=OUTFILE, help="Model file. Default : %s" % OUTFILE)
+    parser.add_argument("--scenarios", help="Input file of scenarios (%s), with one column per param. "
+                                            "Other columns are copied to the results. "
+                                            "Without it, scenarios are generated as a grid" % FORMATS)
+
+    parser.add_argument("--grid", nargs="*", help="Enum and bool params of the grid. Default : all")
+    parser.add_argument("--samples", type=int, default=0, help="Number of samples of float params, crossed with the grid. Default : 0 (default values)")
+    parser.add_argument("--sample", nargs="*", help="Float params to sample. Default : all")
+    parser.add_argument("--method", default="random", choices=SAMPLING_METHODS, help="Sampling method of float params. Default : random")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of sampling")
+
+    parser.add_argument("--impacts", nargs="*", help="Impacts to evaluate. Default : all")
+    parser.add_argument("--functional-units", nargs="*", help="Functional units. Default : all")
+    parser.add_argument("--axes", nargs="*", help="Axes. Default : all")
+    parser.add_argument("--no-params", action="store_true", help="Do not copy param values to the results")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes evaluating chunks in parallel. Default : 1")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Number of scenarios evaluated at once. Default : %d" % CHUNK_SIZE)
+
+    evaluate(parser.parse_args())
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import os
 import sys
+import argparse
 import dataclasses
 
 # Add current dir to PATH
@@ -9,10 +10,11 @@ sys.path.insert(0, os.getcwd())
 
 import lca_algebraic as agb
 from lib.export import export_lca
-from lib.settings import settings, OUTFILE
+from lib.settings import settings, OUTFILE, EXPORT_CACHE_DIR
+from lib.utils import timer
 
 
-def export():
+def export(jobs=1, cache=True, optimize=True):
 
     agb.initProject(settings.project)
     agb.loadParams()
@@ -30,17 +32,35 @@ def export():
 
     print(dict_settings)
 
-    model = export_lca(
-        system=system,
-        functional_units=dict_settings["functional_units"],
-        methods_dict=dict_settings["impacts"],
-        axes=settings.axes)
+    with timer("Export"):
+        model = export_lca(
+            system=system,
+            functional_units=dict_settings["functional_units"],
+            methods_dict=dict_settings["impacts"],
+            axes=settings.axes,
+            jobs=jobs,
+            cache_dir=EXPORT_CACHE_DIR if cache else None,
+            optimize=optimize)
 
-    model.to_file(OUTFILE)
+    with timer("Save"):
+        model.to_file(OUTFILE)
 
 
 if __name__ == '__main__':
-    export()
+
+    parser = argparse.ArgumentParser(description="Export the LCA model to %s" % OUTFILE)
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=1,
+        help="Number of processes computing axes and methods in parallel. The output is identical to the serial export")
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Recompute all axes and methods, without using nor updating the export cache (%s)" % EXPORT_CACHE_DIR)
+    parser.add_argument(
+        "--no-optimize", action="store_true",
+        help="Save expressions as computed, without dropping negligible terms, factoring nor extracting shared intermediates")
+    args = parser.parse_args()
+
+    export(jobs=args.jobs, cache=not args.no_cache, optimize=not args.no_optimize)
 
 
 
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import sys
+
+# Add current dir to PATH
+sys.path.insert(0, os.getcwd())
+
+from lib.loadtest import start_server, run_load, print_report
+
+
+def loadtest(args):
+
+    if args.url :
+        process, url = None, args.url.rstrip("/")
+    else:
+        process, url = start_server(args.port)
+
+    try:
+        report = run_load(
+            url,
+            app_users=args.app_users,
+            api_users=args.api_users,
+            duration=args.duration,
+            think_time=args.think_time,
+            ramp_up=args.ramp_up,
+            seed=args.seed,
+            server_pid=process.pid if process is not None else args.server_pid)
+    finally:
+        if process is not None :
+            process.terminate()
+            process.wait()
+
+    print_report(report)
+
+    if args.output :
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Report saved to %s" % args.output)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description="Load test of the web app and of its JSON API by concurrent simulated users. "
+                    "Starts a local headless server, unless --url is given")
+    parser.add_argument("--url", help="Url of a running server, for instance http://localhost:8501. Default : start a local server")
+    parser.add_argument("--port", type=int, help="Port of the local server. Default : a free port")
+    parser.add_argument("--server-pid", type=int, help="Pid of the server given by --url, to sample its CPU and RSS")
+    parser.add_argument("--app-users", type=int, default=10, help="Number of concurrent users of the web app. Default : 10")
+    parser.add_argument("--api-users", type=int, default=10, help="Number of concurrent clients of the JSON API. Default : 10")
+    parser.add_argument("--duration", type=float, default=60, help="Duration of the run once all users started, in seconds. Default : 60")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean pause between two actions of a user, in seconds. Default : 1")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="Users are started evenly during this time, in seconds. Default : 5")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random actions")
+    parser.add_argument("--output", help="Save the report to this JSON file")
+
+    loadtest(parser.parse_args())
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+
+# Add current dir to PATH
+sys.path.insert(0, os.getcwd())
+
+from lib.common import Model
+from lib.memory import memory_report, print_memory_report
+from lib.settings import OUTFILE
+
+
+def memory(filename, runtime=False, cache=True, gradients=False):
+    """Load the model, compile all its expressions and print the memory used by each component"""
+
+    model = Model.from_file(filename, cache=cache, runtime=runtime)
+    model.compile_all()
+    if gradients :
+        model.build_gradients()
+        model.compile_all()
+
+    print("Memory of %s (%s mode, %s)" % (
+        filename,
+        "runtime" if runtime else "default",
+        "compiled cache" if cache else "parsed"))
+    print_memory_report(memory_report(model))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Memory used by each component of the model, once all expressions are compiled")
+    parser.add_argument("model", nargs="?", default=OUTFILE, help="Model file. Default : %s" % OUTFILE)
+    parser.add_argument("--runtime", action="store_true", help="Low memory mode : free symbolic trees once compiled")
+    parser.add_argument("--no-cache", action="store_true", help="Parse the model instead of loading the compiled cache")
+    parser.add_argument("--gradients", action="store_true", help="Also build gradients")
+    args = parser.parse_args()
+
+    memory(args.model, args.runtime, not args.no_cache, args.gradients)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+
+# Add current dir to PATH
+sys.path.insert(0, os.getcwd())
+
+from lib.common import Model
+from lib.optimize import optimize_model, CHECK_SAMPLES
+from lib.settings import OUTFILE
+from lib.utils import timer
+
+
+def optimize(input, output, num_digits, samples):
+
+    model = Model.from_file(input, cache=False)
+    input_size = os.path.getsize(input)
+
+    with timer("Optimize %s" % input):
+        optimized = optimize_model(model, num_digits=num_digits, samples=samples)
+
+    optimized.to_file(output)
+    print("Optimized model saved to %s (%d => %d bytes)" % (output, input_size, os.path.getsize(output)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description="Optimize the expressions of an exported model : drop negligible terms, factor shared products "
+                    "and extract common sub expressions into shared intermediates. Done by default on export")
+    parser.add_argument("input", nargs="?", default=OUTFILE, help="Model file (JSON). Default : %s" % OUTFILE)
+    parser.add_argument("output", nargs="?", help="Output file (JSON). Default : overwrite the input file")
+    parser.add_argument("--num-digits", type=int, default=3, help="Number of digits of the rounding of the export. Default : 3")
+    parser.add_argument("--samples", type=int, default=CHECK_SAMPLES, help="Number of random scenarios checking results. Default : %d" % CHECK_SAMPLES)
+    args = parser.parse_args()
+
+    optimize(args.input, args.output or args.input, args.num_digits, args.samples)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import sys
+
+# Add current dir to PATH
+sys.path.insert(0, os.getcwd())
+
+from lib.common import Model, ParamType
+from lib.settings import OUTFILE
+from lib.utils import timer
+
+
+def parse_value(model:Model, name, value):
+    """Value of a param given as string"""
+    if not name in model.params or model.params[name].type == ParamType.ENUM :
+        return value
+    return json.loads(value)
+
+
+def specialize(model:Model, output, fixed_groups=None, fixed_values=None):
+    """
+    Export a model with some params fixed
+    :param fixed_groups: Groups of params fixed to their default values
+    :param fixed_values: Dict of param name => value
+    """
+
+    fixed_params = {
+        param.name: param.default
+        for param in model.params.values() if param.group in (fixed_groups or [])}
+    fixed_params.update(fixed_values or dict())
+
+    with timer("Specialize on %d params" % len(fixed_params)):
+        specialized = model.specialize(fixed_params)
+
+    specialized.to_file(output)
+
+    source_size = lambda model : sum(len(lambd.source) for impacts in model.expressions.values() for lambd in impacts.values())
+    print("Params : %d => %d" % (len(model.params), len(specialized.params)))
+    print("Size of compiled expressions : %d => %d characters" % (source_size(model), source_size(specialized)))
+    print("Specialized model saved to %s" % output)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Export a model specialized on fixed params : they are substituted in expressions, and removed from the model")
+    parser.add_argument("output", help="Output file (JSON)")
+    parser.add_argument("--model", default=OUTFILE, help="Model file. Default : %s" % OUTFILE)
+    parser.add_argument("--fix-groups", nargs="*", help="Groups of params fixed to their default values. For instance : 'priorite 2' 'priorite 3'")
+    parser.add_argument("--fix", nargs="*", default=[], metavar="NAME=VALUE", help="Values of fixed params")
+    args = parser.parse_args()
+
+    model = Model.from_file(args.model)
+    fixed_values = dict()
+    for item in args.fix :
+        name, value = item.split("=", 1)
+        fixed_values[name] = parse_value(model, name, value)
+
+    specialize(model, args.output, args.fix_groups, fixed_values)
@@ -1,17 +1,295 @@
+from concurrent.futures import ThreadPoolExecutor
 from tornado.web import Application, RequestHandler
 from tornado.routing import Rule, PathMatches
+from tornado.ioloop import IOLoop
+import numpy
+import json
+import math
+import hmac
 import gc
+import os
 import streamlit as st
 
+from lib.common import Model, ModelError, serialize_model
+from lib.reload import ModelHolder
+from lib.utils import metrics
+
+# Number of threads evaluating the model
+API_WORKERS = 4
+
+# Max number of evaluations running or waiting for a thread. Further requests are rejected with 503
+API_MAX_PENDING = 64
+
+# Token expected in header 'Authorization: Bearer <token>' by admin handlers. If not set, admin handlers are disabled
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Evaluations are run on this pool, never on the Tornado IOLoop
+_executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="api")
+
 
 @st.cache_resource()
-def setup_api_handler(uri, handler):
+def setup_api_handler(uri, handler, _kwargs=None):
+    """
+    Register a Tornado handler into the Streamlit server
+    :param _kwargs: Arguments passed to handler.initialize(). Not hashed by streamlit cache.
+    """
     print("Setup Tornado. Should be called only once")
 
     # Get instance of Tornado
     tornado_app = next(o for o in gc.get_referrers(Application) if o.__class__ is Application)
 
     # Setup custom handler
-    tornado_app.wildcard_router.rules.insert(0, Rule(PathMatches(uri), handler))
+    tornado_app.wildcard_router.rules.insert(0, Rule(PathMatches(uri), handler, _kwargs))
+
+
+def setup_api(holder:ModelHolder, prefixes=("/api", "/app/static/api")):
+    """Register all API handlers, sharing the same model holder : they serve the current model, after reloads"""
+
+    for prefix in prefixes:
+        setup_api_handler(prefix + "/health", HealthHandler, _kwargs=dict(holder=holder))
+        setup_api_handler(prefix + "/model", ModelHandler, _kwargs=dict(holder=holder))
+        setup_api_handler(prefix + "/evaluate", EvaluateHandler, _kwargs=dict(holder=holder))
+        setup_api_handler(prefix + "/bounds", BoundsHandler, _kwargs=dict(holder=holder))
+        setup_api_handler(prefix + "/metrics", MetricsHandler, _kwargs=dict(holder=holder))
+        setup_api_handler(prefix + "/admin/reload", ReloadHandler, _kwargs=dict(holder=holder))
+
+
+def _to_json(obj):
+    """Transform numpy arrays and scalars into JSON serializable values. Infinite values are null"""
+
+    if isinstance(obj, dict):
+        return {key: _to_json(val) for key, val in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_json(val) for val in obj]
+    if isinstance(obj, (numpy.ndarray, numpy.generic)):
+        # Python values, then checked as such
+        return _to_json(obj.tolist())
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    return obj
+
+
+def _axis_keys(lambdas_by_impact):
+    """Union of keys of an axis, over all impacts. None for 'total' axis"""
+    keys = dict()
+    for lambd in lambdas_by_impact.values():
+        if lambd.keys is None :
+            return None
+        keys.update(dict.fromkeys(lambd.keys))
+    return list(keys)
+
+
+class BaseHandler(RequestHandler):
+
+    # Number of evaluations running or queued. Only updated from the IOLoop thread
+    pending = 0
+
+    def initialize(self, holder:ModelHolder):
+        self.holder = holder
+
+    def prepare(self):
+        # Same model and version for the whole request, even if a new one is swapped in meanwhile
+        self.state = self.holder.state
+        self.model:Model = self.state.model
+
+    def check_xsrf_cookie(self):
+        # Streamlit enables XSRF cookies on the whole Tornado app. The API is called without cookies :
+        # evaluations have no side effect, and admin handlers are authenticated by a bearer token
+        pass
+
+    def error(self, status_code, message):
+        self.set_status(status_code)
+        self.write(dict(error=message))
+
+    def write_error(self, status_code, **kwargs):
+        self.write(dict(error=self._reason))
+
+    def on_finish(self):
+        metrics.observe(
+            "http_request_seconds",
+            self.request.request_time(),
+            handler=type(self).__name__,
+            status=self.get_status())
+
+
+class HealthHandler(BaseHandler):
+
+    def get(self):
+        self.write(dict(
+            status="ok",
+            pending=BaseHandler.pending,
+            max_pending=API_MAX_PENDING,
+            workers=API_WORKERS,
+            model=self.holder.status()))
+
+
+class ReloadHandler(BaseHandler):
+    """
+    Admin : reload the model file in background. The current model serves until the new one is compiled.
+    POST, with optional query argument 'force=1' to reload even if the file did not change. Returns 202 if a reload started.
+    GET returns the status of the model : version, load time and last reload error.
+    Requires header 'Authorization: Bearer <ADMIN_TOKEN>'.
+    """
+
+    def prepare(self):
+        super().prepare()
+        if ADMIN_TOKEN is None :
+            self.error(403, "Admin API disabled : set environment variable ADMIN_TOKEN")
+            self.finish()
+        elif not hmac.compare_digest(self.request.headers.get("Authorization", "").encode(), ("Bearer %s" % ADMIN_TOKEN).encode()) :
+            self.error(401, "Invalid admin token")
+            self.finish()
+
+    def get(self):
+        self.write(self.holder.status())
+
+    def post(self):
+        force = self.get_query_argument("force", "0") not in ("", "0")
+        started = self.holder.reload(force=force)
+        self.set_status(202 if started else 200)
+        self.write(dict(started=started, **self.holder.status()))
+
+
+class ModelHandler(BaseHandler):
+    """Description of the model : params, impacts, functional units and axes"""
+
+    def get(self):
+        model = self.model
+        self.write(dict(
+            params=serialize_model(model.params),
+            impacts=serialize_model(model.impacts),
+            functional_units={
+                key: dict(unit=fu.unit, params=fu.quantity.params)
+                for key, fu in model.functional_units.items()},
+            axes={axis: _axis_keys(impacts) for axis, impacts in model.expressions.items()}))
+
+
+class MetricsHandler(BaseHandler):
+    """Metrics in Prometheus text format. Latencies are only recorded when enabled with environment variable METRICS=1"""
+
+    def get(self):
+        stats = self.model.cache.stats()
+        extra_counters = [("model_cache_%s_total" % key, dict(), stats[key]) for key in ["hits", "misses", "evictions"]]
+        gauges = [("model_info", dict(version=self.state.version), 1)]
+
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(metrics.to_prometheus(extra_counters, gauges))
+
+
+class EvaluateHandler(BaseHandler):
+    """
+    Evaluate the model. Expects a JSON body with :
+    * impact : Impact name
+    * functional_unit : Functional unit name
+    * axis (optional) : Axis. If absent, total and all axes are returned
+    * params : Dict of param values for a single scenario, or list of dicts for a batch of scenarios (in that case, axis defaults to 'total')
+    """
+
+    async def post(self):
+
+        if BaseHandler.pending >= API_MAX_PENDING :
+            self.set_header("Retry-After", "1")
+            self.error(503, "Too many pending requests")
+            return
+
+        try:
+            request = json.loads(self.request.body)
+        except ValueError as e:
+            self.error(400, "Invalid JSON : %s" % e)
+            return
+
+        BaseHandler.pending += 1
+        try:
+            res = await IOLoop.current().run_in_executor(_executor, self.evaluate, self.model, request)
+        except ModelError as e:
+            self.error(400, str(e))
+            return
+        finally:
+            BaseHandler.pending -= 1
+
+        self.write(_to_json(res))
+
+    def evaluate(self, model:Model, request):
+        """Run in thread pool"""
+
+        if not isinstance(request, dict):
+            raise ModelError("Expected a JSON object")
+
+        for key in ["impact", "functional_unit"]:
+            if not key in request :
+                raise ModelError("Missing '%s'" % key)
+
+        impact = request["impact"]
+        functional_unit = request["functional_unit"]
+        params = request.get("params", dict())
+
+        # Batch of scenarios
+        if isinstance(params, list):
+
+            if len(params) == 0 :
+                raise ModelError("Empty list of scenarios")
+
+            for scenario in params:
+                if not isinstance(scenario, dict):
+                    raise ModelError("Each scenario should be a dict of param values")
+                for name, val in scenario.items():
+                    if isinstance(val, (list, dict)):
+                        raise ModelError("Param '%s' should be a single value in each scenario. Got %s" % (name, val))
+
+            names = set(name for scenario in params for name in scenario)
+            for name in names:
+                if not name in model.params:
+                    raise ModelError("Unknown param '%s'" % name)
+
+            values = {
+                name: numpy.array([scenario.get(name, model.params[name].default) for scenario in params])
+                for name in names}
+            model.validate_params(values)
+
+            vals, unit = model.evaluate_batch(impact, functional_unit, request.get("axis", "total"), values)
+
+        elif isinstance(params, dict):
+
+            model.validate_params(params, scalar=True)
+
+            if "axis" in request :
+                vals, unit = model.evaluate(impact, functional_unit, request["axis"], **params)
+            else:
+                vals, unit = model.evaluate_all(impact, functional_unit, **params)
+
+        else:
+            raise ModelError("'params' should be a dict or a list of dicts")
+
+        return dict(values=vals, unit=unit)
+
+
+class BoundsHandler(EvaluateHandler):
+    """
+    Guaranteed bounds of an impact, when params vary within their ranges (see Model.bounds()). Expects a JSON body with :
+    * impact : Impact name
+    * functional_unit : Functional unit name
+    * axis (optional) : Axis. If absent, total and all axes are returned
+    * params (optional) : Dict of fixed param values. Other params vary within their ranges
+    Bounds are [lower, upper], null if unbounded. They are cached : further requests are answered in microseconds
+    """
+
+    def evaluate(self, model:Model, request):
+        """Run in thread pool"""
+
+        if not isinstance(request, dict):
+            raise ModelError("Expected a JSON object")
+
+        for key in ["impact", "functional_unit"]:
+            if not key in request :
+                raise ModelError("Missing '%s'" % key)
+
+        params = request.get("params", dict())
+        if not isinstance(params, dict):
+            raise ModelError("'params' should be a dict")
 
+        if "axis" in request :
+            bounds, unit = model.bounds(request["impact"], request["functional_unit"], request["axis"], **params)
+        else:
+            bounds, unit = model.bounds_all(request["impact"], request["functional_unit"], **params)
 
+        return dict(bounds=bounds, unit=unit)
@@ -1,6 +1,20 @@
 from collections import defaultdict
 from typing import Dict, Union, List
 import streamlit as st
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from lib.utils import span
+
+# Max number of figures kept in cache, shared by all sessions
+FIGURE_CACHE_SIZE = 256
+
+# Template shared by all figures, instead of the full default one sent with each figure.
+# It keeps the colorway of the default (Streamlit) template : placeholders replaced by the colors of the theme in the browser
+FIGURE_TEMPLATE = go.layout.Template(layout=dict(
+    colorway=pio.templates[pio.templates.default].layout.colorway,
+    barmode="relative",
+    margin=dict(t=60)))
 
 def group_params(params) :
     groups = defaultdict(list)
@@ -19,14 +33,31 @@ def select_dict(label, options:Union[Dict, List], default=None, **kwargs) :
     keys = list(options.keys())
     default_index = keys.index(default) if default in keys else 0
 
-    res = st.selectbox(
+    return st.selectbox(
         label=label,
-        options=options.items(),
+        options=keys,
         index=default_index,
-        format_func = lambda x : x[1],
+        format_func = lambda key : options[key],
         **kwargs)
 
-    return res[0]
+
+@st.cache_resource(max_entries=FIGURE_CACHE_SIZE, show_spinner=False)
+def bar_figure(keys:tuple, values:tuple, x_label, y_label):
+    """
+    Bar chart with the shared template. Figures are cached by their data :
+    a rerun with unchanged data reuses the same figure, without building or copying it.
+    The figure is shared by all sessions and should not be modified : st.plotly_chart only serializes it
+    """
+    with span("figure", axis=x_label):
+        return go.Figure(
+            data=[go.Bar(
+                x=list(keys),
+                y=list(values),
+                hovertemplate="%s=%%{x}<br>%s=%%{y}<extra></extra>" % (x_label, y_label))],
+            layout=dict(
+                template=FIGURE_TEMPLATE,
+                xaxis_title=x_label,
+                yaxis_title=y_label))
 
 
 class NullContextManager(object):
@@ -0,0 +1,335 @@
+"""
+Benchmarks of loading and evaluation of the model, on the real model file.
+
+Each benchmark is a function registered with @benchmark, taking the model file and returning the function to time
+(or a dict of name suffix => function). Setup is done in the body of the benchmark, and is not timed.
+Benchmarks holding resources (worker pools) yield (name suffix, function) instead : each function is timed before
+the next one is set up, and resources are released when the generator resumes, or is closed.
+Each function is timed over several repeats (min and median time), and its peak memory is measured with tracemalloc, in a separate run.
+"""
+from typing import Dict
+from datetime import datetime
+from time import perf_counter
+import statistics
+import subprocess
+import tracemalloc
+import platform
+import json
+import os
+import numpy
+import sympy
+
+from lib.common import Model, Lambda, LRUCache, EvaluationSession, expand_param_names, unexpand_param_names, build_compiled_cache, _parse
+from lib.parallel import ParallelEvaluator, _shards
+from lib.scenarios import result_columns
+
+# Min duration of a repeat : fast functions are called several times per repeat
+MIN_REPEAT_TIME = 0.2
+
+# Number of scenarios of batch benchmarks
+BATCH_SIZE = 10000
+
+# Number of single param changes of the slider benchmark
+SLIDER_CHANGES = 200
+
+# Benchmarks evaluating BATCH_SIZE scenarios : their throughput is reported
+BATCH_BENCHMARKS = ["evaluate_batch", "evaluate_parallel"]
+
+# Metrics compared between runs
+TRACKED_METRICS = ["time", "peak_memory"]
+
+# Registered benchmarks : name => (function, number of repeats)
+BENCHMARKS = dict()
+
+
+def benchmark(name, repeat=5):
+    def decorator(func):
+        BENCHMARKS[name] = (func, repeat)
+        return func
+    return decorator
+
+
+def _uncached_model(filename):
+    model = Model.from_file(filename)
+    model.cache = LRUCache(0)
+    return model
+
+
+@benchmark("load_cold", repeat=3)
+def load_cold(filename):
+    """Parse and lambdify all expressions. Expressions compile lazily : compile them all, as before lazy compilation"""
+
+    def func():
+        model = Model.from_file(filename, cache=False)
+        model.compile_all()
+
+    return func
+
+
+@benchmark("load_warm")
+def load_warm(filename):
+    """Load from compiled cache"""
+    build_compiled_cache(filename)
+    return lambda: Model.from_file(filename)
+
+
+@benchmark("first_result")
+def first_result(filename):
+    """Load from compiled cache and evaluate all axes of the first impact : only the required expressions are compiled"""
+    build_compiled_cache(filename)
+    impact = next(iter(Model.from_file(filename).impacts))
+
+    def func():
+        model = Model.from_file(filename)
+        model.evaluate_all(impact, next(iter(model.functional_units)))
+
+    return func
+
+
+@benchmark("lambda_init")
+def lambda_init(filename):
+    """Lambdify the largest expression of the model"""
+
+    model = Model.from_file(filename)
+    lambd = max(
+        (lambd for impacts in model.expressions.values() for lambd in impacts.values()),
+        key=lambda lambd: len(lambd.source))
+    expr = _parse(lambd.expr)
+
+    return lambda: Lambda(expr, model.params).compile()
+
+
+@benchmark("expand_param_names")
+def expand_names(filename):
+    model = Model.from_file(filename)
+    names = list(model.params.keys())
+    return lambda: expand_param_names(model.params, names)
+
+
+@benchmark("unexpand_param_names")
+def unexpand_names(filename):
+    model = Model.from_file(filename)
+    names = expand_param_names(model.params, list(model.params.keys()))
+    return lambda: unexpand_param_names(model.params, names)
+
+
+@benchmark("evaluate")
+def evaluate(filename):
+    """Single scenario, per axis, without result cache"""
+
+    model = _uncached_model(filename)
+    impact = next(iter(model.impacts))
+    functional_unit = next(iter(model.functional_units))
+
+    return {
+        axis: (lambda axis=axis: model.evaluate(impact, functional_unit, axis))
+        for axis in model.expressions}
+
+
+@benchmark("evaluate_all")
+def evaluate_all(filename):
+    """Single scenario, all axes at once, without result cache"""
+
+    model = _uncached_model(filename)
+    impact = next(iter(model.impacts))
+    functional_unit = next(iter(model.functional_units))
+
+    return lambda: model.evaluate_all(impact, functional_unit)
+
+
+@benchmark("slider_changes")
+def slider_changes(filename):
+    """SLIDER_CHANGES changes of a single float param, as in the app : evaluation session against evaluate_all,
+    without result cache"""
+
+    model = _uncached_model(filename)
+    impact = next(iter(model.impacts))
+    functional_unit = next(iter(model.functional_units))
+
+    # Each scenario changes one param of the previous one
+    names = [name for name, param in model.params.items() if param.type == "float" and param.min < param.max]
+    values = _random_values(model, SLIDER_CHANGES)
+    scenarios = []
+    scenario = {name: model.params[name].default for name in names}
+    for i in range(SLIDER_CHANGES):
+        name = names[i % len(names)]
+        scenario = dict(scenario, **{name: float(values[name][i])})
+        scenarios.append(scenario)
+
+    def session():
+        evaluation_session = EvaluationSession(model)
+        for scenario in scenarios:
+            evaluation_session.evaluate(impact, functional_unit, **scenario)
+
+    def evaluate_all():
+        for scenario in scenarios:
+            model.evaluate_all(impact, functional_unit, **scenario)
+
+    return dict(session=session, evaluate_all=evaluate_all)
+
+
+def _random_values(model:Model, size):
+    """Random values of float params"""
+    rng = numpy.random.default_rng(0)
+    return {
+        param.name: param.min + rng.random(size) * (param.max - param.min)
+        for param in model.params.values() if param.type == "float"}
+
+
+@benchmark("evaluate_batch")
+def evaluate_batch(filename):
+    """BATCH_SIZE scenarios of random float params, total axis"""
+
+    model = _uncached_model(filename)
+    impact = next(iter(model.impacts))
+    functional_unit = next(iter(model.functional_units))
+
+    values = _random_values(model, BATCH_SIZE)
+
+    return lambda: model.evaluate_batch(impact, functional_unit, "total", values)
+
+
+@benchmark("evaluate_parallel", repeat=3)
+def evaluate_parallel(filename):
+    """BATCH_SIZE scenarios of random float params, all impacts, functional units and axes,
+    split between 1, 2, 4 ... worker processes, up to the number of CPUs"""
+
+    model = _uncached_model(filename)
+    columns = result_columns(model)
+    values = _random_values(model, BATCH_SIZE)
+
+    workers = 1
+    while workers <= os.cpu_count():
+        # One pool at a time, shut down once timed
+        with ParallelEvaluator(model, workers) as evaluator:
+            shard_size = -(-BATCH_SIZE // workers)
+            chunks = [(shard, len(next(iter(shard.values())))) for shard in _shards(values, BATCH_SIZE, shard_size)]
+            yield "%d_workers" % workers, lambda: list(evaluator.evaluate_chunks(chunks, columns))
+        workers *= 2
+
+
+def _measure(func, repeat):
+    """Time function : returns list of times (seconds per call), one per repeat"""
+
+    # Calibrate number of calls per repeat
+    start = perf_counter()
+    func()
+    elapsed = perf_counter() - start
+    number = max(1, int(MIN_REPEAT_TIME / elapsed)) if elapsed > 0 else 1000
+
+    times = []
+    for i in range(repeat):
+        start = perf_counter()
+        for j in range(number):
+            func()
+        times.append((perf_counter() - start) / number)
+    return times
+
+
+def _peak_memory(func):
+    """Peak of memory allocated by a single call, in bytes"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(filename, names=None):
+    """
+    Run benchmarks
+    :param filename: Model file
+    :param names: Optional list of benchmark names (or prefixes). All by default
+    :return: Dict of benchmark name => {time, median, repeat, peak_memory}. 'time' is the min time, in seconds
+    """
+
+    res = dict()
+    for name, (bench, repeat) in BENCHMARKS.items():
+
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+
+        funcs = bench(filename)
+        if callable(funcs):
+            funcs = {None: funcs}
+        items = iter(funcs.items()) if isinstance(funcs, dict) else funcs
+
+        try:
+            for suffix, func in items:
+                full_name = name if suffix is None else "%s.%s" % (name, suffix)
+                times = _measure(func, repeat)
+                res[full_name] = dict(
+                    time=min(times),
+                    median=statistics.median(times),
+                    repeat=repeat,
+                    peak_memory=_peak_memory(func))
+
+                if name in BATCH_BENCHMARKS :
+                    res[full_name]["throughput"] = BATCH_SIZE / min(times)
+
+                print("%-30s %12.6f s   %10.1f KB" % (full_name, res[full_name]["time"], res[full_name]["peak_memory"] / 1024))
+        finally:
+            # Generators release their resources (worker pools) when closed
+            if hasattr(items, "close"):
+                items.close()
+
+    return res
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def load_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file, "r") as f:
+        return json.load(f)
+
+
+def save_run(history_file, results:Dict, label=None):
+    """Append results to history file, with date, commit and versions"""
+
+    history = load_history(history_file)
+    history.append(dict(
+        date=datetime.now().isoformat(timespec="seconds"),
+        commit=_git_commit(),
+        label=label,
+        python=platform.python_version(),
+        numpy=numpy.__version__,
+        sympy=sympy.__version__,
+        results=results))
+
+    with open(history_file, "w") as f:
+        json.dump(history, f, indent=2)
+
+
+def compare(baseline:Dict, current:Dict, threshold):
+    """
+    Compare results of two runs
+    :param threshold: Max relative increase of tracked metrics (0.1 = +10%)
+    :return: List of regressions (benchmark name, metric, baseline value, current value)
+    """
+
+    regressions = []
+    for name, result in current.items():
+
+        if not name in baseline :
+            print("%-30s new" % name)
+            continue
+
+        for metric in TRACKED_METRICS:
+            before = baseline[name][metric]
+            after = result[metric]
+            ratio = after / before if before > 0 else 1.0
+            regression = ratio > 1 + threshold
+            if regression:
+                regressions.append((name, metric, before, after))
+            print("%-30s %-12s %12.6g -> %12.6g  %+7.1f %%%s" % (
+                name, metric, before, after, (ratio - 1) * 100, "  REGRESSION" if regression else ""))
+
+    return regressions
@@ -0,0 +1,481 @@
+"""
+Compact binary format of the model, openable with mmap.
+
+Layout of the file :
+* Magic string, format version and length of the header
+* JSON header : descriptions of params, lambdas, impacts, and table of arrays
+* Arrays, aligned on 64 bytes : numeric columns of params, and expressions encoded in postfix notation (op codes, arguments and constants)
+
+Expressions are compiled to numpy functions directly from their postfix form, without sympy.
+Several processes opening the same file share the same memory pages.
+
+Conversion back to JSON is value-preserving, not byte for byte : numbers keep their value and precision,
+but not their formatting (2.32e+3 is written 2320.0).
+"""
+from typing import Dict
+import json
+import mmap
+import struct
+import numpy
+
+from lib.polynomial import PolynomialTable, NotPolynomial, try_polynomial, \
+    poly_symbol, poly_const, poly_add, poly_mul, poly_pow, poly_exponent
+from lib.common import Model, Lambda, Param, FunctionalUnit, Impact, ParamType, \
+    expand_param_names, serialize_model, _parse, _compile_source, LAMBDIFY_FUNC_NAME
+
+MAGIC = b"LCAMODEL"
+BINARY_VERSION = 1
+ALIGNMENT = 64
+
+# Magic, version, reserved, header length
+_PREAMBLE = struct.Struct("<8sIIQ")
+
+# Op codes
+OP_SYMBOL = 0    # Push symbol number <arg>
+OP_FLOAT = 1     # Push float constant number <arg>
+OP_INT = 2       # Push integer constant number <arg>
+OP_RATIONAL = 3  # Push rational made of integer constants number <arg> and <arg> + 1
+OP_ADD = 4       # Pop <arg> operands and push their sum
+OP_MUL = 5       # Pop <arg> operands and push their product
+OP_POW = 6       # Pop base and exponent, and push power
+OP_FUNC = 7      # Pop operands and push result of function number <arg>
+
+# Numpy equivalent of supported sympy functions
+NUMPY_FUNCTIONS = dict(exp="exp", log="log", Abs="abs", sin="sin", cos="cos", Max="maximum", Min="minimum")
+
+# Numeric attributes of params, stored as columns
+PARAM_NUMERIC_FIELDS = ["default", "min", "max"]
+PARAM_FIELDS = ["name", "label", "type", "default", "unit", "group", "description"]
+
+
+class _Encoder:
+    """Encodes sympy expressions into postfix arrays"""
+
+    def __init__(self):
+        self.ops = []
+        self.args = []
+        self.floats = []
+        self.float_precs = []
+        self.ints = []
+        self.symbols = dict()
+        self.functions = dict()
+        self.offsets = [0]
+
+    def add(self, expr):
+        """Encode expression and return its index"""
+        from sympy import sympify
+        self._encode(sympify(expr))
+        self.offsets.append(len(self.ops))
+        return len(self.offsets) - 2
+
+    def _push(self, op, arg):
+        self.ops.append(op)
+        self.args.append(arg)
+
+    def _encode(self, expr):
+        from sympy import Add, Mul, Pow, Symbol, Float, Integer, Rational, Function
+
+        if isinstance(expr, Symbol):
+            self._push(OP_SYMBOL, self.symbols.setdefault(expr.name, len(self.symbols)))
+
+        elif isinstance(expr, Float):
+            self._push(OP_FLOAT, len(self.floats))
+            self.floats.append(float(expr))
+            self.float_precs.append(expr._prec)
+
+        elif isinstance(expr, Integer):
+            self._push(OP_INT, len(self.ints))
+            self.ints.append(int(expr))
+
+        elif isinstance(expr, Rational):
+            self._push(OP_RATIONAL, len(self.ints))
+            self.ints.extend([expr.p, expr.q])
+
+        elif isinstance(expr, (Add, Mul, Pow)):
+            for arg in expr.args:
+                self._encode(arg)
+            op = OP_ADD if isinstance(expr, Add) else OP_MUL if isinstance(expr, Mul) else OP_POW
+            self._push(op, len(expr.args))
+
+        elif isinstance(expr, Function) and expr.func.__name__ in NUMPY_FUNCTIONS:
+            for arg in expr.args:
+                self._encode(arg)
+            key = (expr.func.__name__, len(expr.args))
+            self._push(OP_FUNC, self.functions.setdefault(key, len(self.functions)))
+
+        else:
+            raise Exception("Unsupported expression in binary format : %s (%s)" % (expr, type(expr)))
+
+
+class _Decoder:
+    """Decodes postfix arrays into Python source code or sympy expressions"""
+
+    def __init__(self, arrays, symbols, functions):
+        self.ops = arrays["ops"]
+        self.args = arrays["args"]
+        self.offsets = arrays["offsets"]
+        self.floats = arrays["floats"]
+        self.float_precs = arrays["float_precs"]
+        self.ints = arrays["ints"]
+        self.symbols = symbols
+        self.functions = functions
+
+    def _code(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return zip(self.ops[start:end].tolist(), self.args[start:end].tolist())
+
+    def free_symbols(self, index):
+        return sorted(set(self.symbols[arg] for op, arg in self._code(index) if op == OP_SYMBOL))
+
+    def source(self, index):
+        """Python (numpy) source code of expression"""
+
+        stack = []
+        for op, arg in self._code(index):
+            if op == OP_SYMBOL:
+                stack.append(self.symbols[arg])
+            elif op == OP_FLOAT:
+                stack.append(repr(float(self.floats[arg])))
+            elif op == OP_INT:
+                stack.append(str(int(self.ints[arg])))
+            elif op == OP_RATIONAL:
+                stack.append("(%d/%d)" % (self.ints[arg], self.ints[arg + 1]))
+            elif op == OP_FUNC:
+                name, nargs = self.functions[arg]
+                operands = _pop(stack, nargs)
+                if nargs > 2 or name in ["Max", "Min"]:
+                    stack.append("reduce(%s, [%s])" % (NUMPY_FUNCTIONS[name], ", ".join(operands)))
+                else:
+                    stack.append("%s(%s)" % (NUMPY_FUNCTIONS[name], ", ".join(operands)))
+            elif op == OP_POW:
+                base, exp = _pop(stack, 2)
+                # -2**x is -(2**x) in Python
+                if base.startswith("-"):
+                    base = "(%s)" % base
+                stack.append("(%s**%s)" % (base, exp))
+            else:
+                sep = " + " if op == OP_ADD else "*"
+                stack.append("(%s)" % sep.join(_pop(stack, arg)))
+
+        return stack[0]
+
+    def polynomial(self, index):
+        """Polynomial form of expression (see lib.polynomial). Raises NotPolynomial"""
+
+        stack = []
+        for op, arg in self._code(index):
+            if op == OP_SYMBOL:
+                stack.append(poly_symbol(self.symbols[arg]))
+            elif op == OP_FLOAT:
+                stack.append(poly_const(self.floats[arg]))
+            elif op == OP_INT:
+                stack.append(poly_const(self.ints[arg]))
+            elif op == OP_RATIONAL:
+                stack.append(poly_const(self.ints[arg] / self.ints[arg + 1]))
+            elif op == OP_ADD:
+                stack.append(poly_add(*_pop(stack, arg)))
+            elif op == OP_MUL:
+                stack.append(poly_mul(*_pop(stack, arg)))
+            elif op == OP_POW:
+                base, exp = _pop(stack, 2)
+                stack.append(poly_pow(base, poly_exponent(exp)))
+            else:
+                raise NotPolynomial("Function %s" % self.functions[arg][0])
+
+        return stack[0]
+
+    def to_sympy(self, index):
+        import sympy
+        from sympy import Add, Mul, Pow, Symbol, Float, Integer, Rational
+
+        stack = []
+        for op, arg in self._code(index):
+            if op == OP_SYMBOL:
+                stack.append(Symbol(self.symbols[arg]))
+            elif op == OP_FLOAT:
+                stack.append(Float(float(self.floats[arg]), precision=int(self.float_precs[arg])))
+            elif op == OP_INT:
+                stack.append(Integer(int(self.ints[arg])))
+            elif op == OP_RATIONAL:
+                stack.append(Rational(int(self.ints[arg]), int(self.ints[arg + 1])))
+            elif op == OP_FUNC:
+                name, nargs = self.functions[arg]
+                stack.append(getattr(sympy, name)(*_pop(stack, nargs)))
+            else:
+                cls = Add if op == OP_ADD else Mul if op == OP_MUL else Pow
+                stack.append(cls(*_pop(stack, arg)))
+
+        return stack[0]
+
+
+def _pop(stack, n):
+    res = stack[-n:]
+    del stack[-n:]
+    return res
+
+
+class PostfixExpr:
+    """Expression kept in postfix form. Only transformed into sympy when needed (serialization, symbolic processing)"""
+
+    def __init__(self, decoder, index):
+        self.decoder = decoder
+        self.index = index
+
+    def to_sympy(self):
+        return self.decoder.to_sympy(self.index)
+
+    def __str__(self):
+        return str(self.to_sympy())
+
+
+def _model_dict(model:Model):
+    """Model as a dict, expressions being kept as they are (sympy or strings)"""
+
+    def lambda_dict(lambd):
+        return dict(params=lambd.params, expr=lambd.expr)
+
+    return dict(
+        params=serialize_model(model.params),
+        expressions={
+            axis: {impact: lambda_dict(lambd) for impact, lambd in impacts.items()}
+            for axis, impacts in model.expressions.items()},
+        functional_units={
+            key: dict(quantity=lambda_dict(fu.quantity), unit=fu.unit)
+            for key, fu in model.functional_units.items()},
+        impacts=serialize_model(model.impacts),
+        fixed_params=model.fixed_params)
+
+
+def _encode_params(params:Dict):
+    """Columnar params : dict of header lists and dict of numpy arrays"""
+
+    header = {field: [param[field] for param in params.values()] for field in PARAM_FIELDS}
+    header["values"] = [param.get("values", None) for param in params.values()]
+
+    # Enum defaults are strings : keep them in header
+    header["default"] = [param["default"] if isinstance(param["default"], str) else None for param in params.values()]
+
+    # Keep track of integers and missing values, to restore exact same JSON
+    header["ints"] = [
+        [field for field in PARAM_NUMERIC_FIELDS if isinstance(param.get(field), int) and not isinstance(param.get(field), bool)]
+        for param in params.values()]
+
+    arrays = dict()
+    for field in PARAM_NUMERIC_FIELDS:
+        arrays["param_" + field] = numpy.array([
+            float(param[field]) if isinstance(param.get(field), (int, float)) else numpy.nan
+            for param in params.values()])
+
+    return header, arrays
+
+
+def _decode_params(header, arrays):
+
+    params = dict()
+    for i, name in enumerate(header["name"]):
+
+        kwargs = {field: header[field][i] for field in PARAM_FIELDS}
+
+        for field in PARAM_NUMERIC_FIELDS:
+            if field == "default" and header["default"][i] is not None:
+                continue
+            val = arrays["param_" + field][i]
+            kwargs[field] = None if numpy.isnan(val) else int(val) if field in header["ints"][i] else float(val)
+
+        if header["values"][i] is not None :
+            kwargs["values"] = header["values"][i]
+            del kwargs["min"]
+            del kwargs["max"]
+
+        params[name] = Param(**kwargs)
+
+    return params
+
+
+def save_binary(model, filename):
+    """
+    Save model into binary format
+    :param model: Model, or dict as read from JSON file
+    """
+
+    js = model if isinstance(model, dict) else _model_dict(model)
+
+    encoder = _Encoder()
+
+    def encode_lambda(lambd):
+        expr = _parse(lambd["expr"])
+        if isinstance(expr, dict):
+            keys = list(expr.keys())
+            indices = [encoder.add(expr[key]) for key in keys]
+        else:
+            keys = None
+            indices = [encoder.add(expr)]
+        return dict(params=lambd["params"], keys=keys, first=indices[0], count=len(indices))
+
+    lambdas = dict(
+        expressions={
+            axis: {impact: encode_lambda(lambd) for impact, lambd in impacts.items()}
+            for axis, impacts in js["expressions"].items()},
+        functional_units={
+            key: dict(quantity=encode_lambda(fu["quantity"]), unit=fu["unit"])
+            for key, fu in js["functional_units"].items()})
+
+    params_header, arrays = _encode_params(js["params"])
+
+    arrays.update(
+        ops=numpy.array(encoder.ops, dtype=numpy.uint8),
+        args=numpy.array(encoder.args, dtype=numpy.int32),
+        offsets=numpy.array(encoder.offsets, dtype=numpy.int64),
+        floats=numpy.array(encoder.floats, dtype=numpy.float64),
+        float_precs=numpy.array(encoder.float_precs, dtype=numpy.int32),
+        ints=numpy.array(encoder.ints, dtype=numpy.int64))
+
+    # Compute offsets of arrays, after header
+    header = dict(
+        params=params_header,
+        symbols=list(encoder.symbols.keys()),
+        functions=[list(key) for key in encoder.functions.keys()],
+        lambdas=lambdas,
+        impacts=js["impacts"],
+        fixed_params=js.get("fixed_params", dict()),
+        arrays=dict())
+
+    def header_bytes():
+        return json.dumps(header).encode()
+
+    # Offsets are relative to the end of the header, which is padded
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = dict(dtype=array.dtype.str, shape=list(array.shape), offset=offset)
+        offset = _align(offset + array.nbytes)
+
+    header_data = header_bytes()
+    data_start = _align(_PREAMBLE.size + len(header_data))
+
+    with open(filename, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, BINARY_VERSION, 0, len(header_data)))
+        f.write(header_data)
+        for name, array in arrays.items():
+            f.seek(data_start + header["arrays"][name]["offset"])
+            f.write(array.tobytes())
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _open(filename):
+    """Map file in memory and return header and arrays (read only views on the mapped file)"""
+
+    with open(filename, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, _, header_len = _PREAMBLE.unpack_from(data)
+    if magic != MAGIC :
+        raise Exception("'%s' is not a binary model file" % filename)
+    if version != BINARY_VERSION :
+        raise Exception("Unsupported version of binary model : %d. Expected %d" % (version, BINARY_VERSION))
+
+    header = json.loads(data[_PREAMBLE.size:_PREAMBLE.size + header_len])
+    data_start = _align(_PREAMBLE.size + header_len)
+
+    arrays = dict()
+    for name, desc in header["arrays"].items():
+        dtype = numpy.dtype(desc["dtype"])
+        arrays[name] = numpy.frombuffer(
+            data,
+            dtype=dtype,
+            count=int(numpy.prod(desc["shape"])),
+            offset=data_start + desc["offset"]).reshape(desc["shape"])
+
+    return header, arrays
+
+
+def _function_source(args, exprs_source, is_list):
+    body = "[%s]" % ", ".join(exprs_source) if is_list else exprs_source[0]
+    return "def %s(%s):\n    return %s\n" % (LAMBDIFY_FUNC_NAME, ", ".join(args), body)
+
+
+def _build_lambda(desc, decoder, all_params, keys=None):
+    """
+    Build lambda from its description in header. Custom keys can be provided for fused lambdas (with several expression ranges) :
+    they have no polynomial table, as for Model._new_lambda()
+    """
+    fused = keys is not None
+
+    indices = desc["indices"] if "indices" in desc else list(range(desc["first"], desc["first"] + desc["count"]))
+    keys = keys or desc["keys"]
+    expanded_params = expand_param_names(all_params, desc["params"])
+    source = _function_source(expanded_params, [decoder.source(index) for index in indices], keys is not None)
+
+    exprs = [PostfixExpr(decoder, index) for index in indices]
+    symbols = [decoder.free_symbols(index) for index in indices]
+
+    lambd = Lambda.from_compiled(dict(
+        params=desc["params"],
+        expanded_params=expanded_params,
+        keys=keys,
+        symbols=dict(zip(keys, symbols)) if keys is not None else {None: symbols[0]},
+        expr=dict(zip(keys, exprs)) if keys is not None else exprs[0],
+        source=source,
+        has_poly=not fused),
+        init_poly=None if fused else lambda: PolynomialTable.from_polys(
+            [try_polynomial(decoder.polynomial, index) for index in indices],
+            expanded_params))
+
+    return lambd
+
+
+def load_binary(filename):
+    """Load model from binary file, without sympy : expressions are compiled from their postfix form"""
+
+    header, arrays = _open(filename)
+
+    all_params = _decode_params(header["params"], arrays)
+    decoder = _Decoder(arrays, header["symbols"], header["functions"])
+    lambdas = header["lambdas"]
+
+    expressions = {
+        axis: {impact: _build_lambda(desc, decoder, all_params) for impact, desc in impacts.items()}
+        for axis, impacts in lambdas["expressions"].items()}
+
+    functional_units = {
+        key: FunctionalUnit(quantity=_build_lambda(fu["quantity"], decoder, all_params), unit=fu["unit"])
+        for key, fu in lambdas["functional_units"].items()}
+
+    impacts = {key: Impact(impact["name"], impact["unit"]) for key, impact in header["impacts"].items()}
+
+    model = Model(all_params, expressions, functional_units, impacts)
+    model.fixed_params = header.get("fixed_params", dict())
+
+    # Fused lambdas (total and all axes of an impact) : built from postfix, without common sub expressions
+    for impact in impacts:
+        params = dict()
+        keys = []
+        indices = []
+        for axis, impacts_desc in lambdas["expressions"].items():
+            desc = impacts_desc[impact]
+            params.update(dict.fromkeys(desc["params"]))
+            keys += [(axis, key) for key in desc["keys"]] if desc["keys"] is not None else [(axis, None)]
+            indices += list(range(desc["first"], desc["first"] + desc["count"]))
+
+        model.fused[impact] = _build_lambda(dict(params=list(params), indices=indices), decoder, all_params, keys=keys)
+        model.fused[impact].name = "fused/%s" % impact
+
+    return model
+
+
+def json_to_binary(json_file, binary_file):
+    """
+    Convert model from JSON to binary format, without compiling it.
+    Shared intermediates (see Model.intermediates) are inlined : the binary format has no equivalent
+    """
+    with open(json_file, "r") as f:
+        js = json.load(f)
+    if js.get("intermediates") :
+        js = _model_dict(Model.from_json(js))
+    save_binary(js, binary_file)
+
+
+def binary_to_json(binary_file, json_file):
+    load_binary(binary_file).to_file(json_file)
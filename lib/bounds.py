@@ -0,0 +1,224 @@
+"""
+Guaranteed bounds of expressions over boxes of params, by interval arithmetic.
+
+Expressions are evaluated on intervals of their variables, together with the intervals of their partial derivatives (forward mode).
+A derivative of constant sign over the box proves the expression monotonic in that variable : for the upper bound,
+the variable is fixed at the end maximizing the expression (and conversely for the lower bound), which removes it from
+the over-estimation of interval arithmetic. This is repeated while new monotonic variables are found.
+When all variables are monotonic, bounds are exact.
+
+Intervals are tuples (lo, hi). Final bounds are widened by a relative margin covering floating point rounding.
+"""
+from typing import Dict
+from math import exp, log, inf
+from sympy import Add, Mul, Pow, Symbol, Basic, exp as sym_exp, log as sym_log
+
+# Max number of passes fixing monotonic variables
+MAX_ITERATIONS = 4
+
+# Relative widening of final bounds, covering rounding errors of floating point operations
+ROUNDING_MARGIN = 1e-9
+
+ZERO = (0.0, 0.0)
+ONE = (1.0, 1.0)
+FULL = (-inf, inf)
+
+
+class NotBounded(Exception):
+    pass
+
+
+def i_add(a, b):
+    return (a[0] + b[0], a[1] + b[1])
+
+
+def i_mul(a, b):
+    # 0 * inf is nan : it is 0 here, as infinite ends are never reached
+    products = [x * y if x != 0 and y != 0 else 0.0 for x in a for y in b]
+    return (min(products), max(products))
+
+
+def i_inv(a):
+    lo, hi = a
+    if lo > 0 or hi < 0 :
+        return (1 / hi, 1 / lo)
+    if lo == 0 and hi > 0 :
+        return (1 / hi, inf)
+    if hi == 0 and lo < 0 :
+        return (-inf, 1 / lo)
+    return FULL
+
+
+def i_pow(a, exponent):
+    """Power by a constant exponent"""
+
+    lo, hi = a
+
+    if exponent == int(exponent) :
+        n = int(exponent)
+        if n == 0 :
+            return ONE
+        if n < 0 :
+            return i_pow(i_inv(a), -n)
+        if n % 2 == 1 or lo >= 0 :
+            return (lo ** n, hi ** n)
+        if hi <= 0 :
+            return (hi ** n, lo ** n)
+        return (0.0, max(lo ** n, hi ** n))
+
+    # Real exponent : defined for positive values only
+    if hi < 0 :
+        raise NotBounded("Real power of a negative interval")
+    lo = max(lo, 0.0)
+    if exponent > 0 :
+        return (lo ** exponent, hi ** exponent)
+    return (hi ** exponent, lo ** exponent if lo > 0 else inf)
+
+
+def i_exp(a):
+    return (exp(a[0]) if a[0] > -inf else 0.0, exp(a[1]) if a[1] < inf else inf)
+
+
+def i_log(a):
+    if a[1] <= 0 :
+        raise NotBounded("Logarithm of a non positive interval")
+    return (log(a[0]) if a[0] > 0 else -inf, log(a[1]) if a[1] < inf else inf)
+
+
+def _add_grads(res, grad, factor=None):
+    """res += grad * factor, for dicts of variable => interval"""
+    for name, val in grad.items():
+        if factor is not None :
+            val = i_mul(val, factor)
+        res[name] = i_add(res[name], val) if name in res else val
+
+
+def _evaluate(expr, box, memo):
+    """
+    Interval of an expression over a box, with intervals of its partial derivatives
+    :param box: Dict of variable name => interval. Variables with degenerate intervals are constants
+    :param memo: Dict of sub expression => result, shared by the sub expressions of a tree
+    :return: <interval>, <Dict of variable name => interval of partial derivative>
+    """
+
+    if expr in memo :
+        return memo[expr]
+
+    if not isinstance(expr, Basic) or expr.is_number :
+        try:
+            val = float(expr)
+        except TypeError:
+            raise NotBounded("Non real number : %s" % expr)
+        res = (val, val), dict()
+
+    elif isinstance(expr, Symbol):
+        if not expr.name in box :
+            raise NotBounded("No interval for '%s'" % expr.name)
+        val = box[expr.name]
+        res = val, {expr.name: ONE} if val[0] != val[1] else dict()
+
+    elif isinstance(expr, Add):
+        val, grad = ZERO, dict()
+        for arg in expr.args:
+            arg_val, arg_grad = _evaluate(arg, box, memo)
+            val = i_add(val, arg_val)
+            _add_grads(grad, arg_grad)
+        res = val, grad
+
+    elif isinstance(expr, Mul):
+        args = [_evaluate(arg, box, memo) for arg in expr.args]
+        val = ONE
+        for arg_val, _ in args:
+            val = i_mul(val, arg_val)
+
+        # d(a.b.c) = da.b.c + a.db.c + a.b.dc
+        grad = dict()
+        for i, (_, arg_grad) in enumerate(args):
+            if len(arg_grad) == 0 :
+                continue
+            others = ONE
+            for j, (other_val, _) in enumerate(args):
+                if j != i :
+                    others = i_mul(others, other_val)
+            _add_grads(grad, arg_grad, others)
+        res = val, grad
+
+    elif isinstance(expr, Pow) and expr.exp.is_number :
+        exponent = float(expr.exp)
+        base_val, base_grad = _evaluate(expr.base, box, memo)
+        val = i_pow(base_val, exponent)
+        grad = dict()
+        if len(base_grad) > 0 :
+            _add_grads(grad, base_grad, i_mul((exponent, exponent), i_pow(base_val, exponent - 1)))
+        res = val, grad
+
+    elif isinstance(expr, sym_exp):
+        arg_val, arg_grad = _evaluate(expr.args[0], box, memo)
+        val = i_exp(arg_val)
+        grad = dict()
+        _add_grads(grad, arg_grad, val)
+        res = val, grad
+
+    elif isinstance(expr, sym_log):
+        arg_val, arg_grad = _evaluate(expr.args[0], box, memo)
+        val = i_log(arg_val)
+        grad = dict()
+        _add_grads(grad, arg_grad, i_inv(arg_val))
+        res = val, grad
+
+    else:
+        raise NotBounded("Unsupported expression : %s" % type(expr).__name__)
+
+    memo[expr] = res
+    return res
+
+
+def _bound(expr, box, upper):
+    """Upper or lower bound of an expression, fixing monotonic variables at their best end"""
+
+    box = dict(box)
+
+    for i in range(MAX_ITERATIONS):
+        val, grad = _evaluate(expr, box, dict())
+
+        monotonic = dict()
+        for name, (lo, hi) in grad.items():
+            if lo >= 0 or hi <= 0 :
+                increasing = lo >= 0
+                end = box[name][1] if increasing == upper else box[name][0]
+                monotonic[name] = (end, end)
+
+        if len(monotonic) == 0 :
+            break
+        box.update(monotonic)
+    else:
+        val, _ = _evaluate(expr, box, dict())
+
+    bound = val[1] if upper else val[0]
+    margin = abs(bound) * ROUNDING_MARGIN
+    return bound + margin if upper else bound - margin
+
+
+def bounds(expr, box:Dict):
+    """
+    Guaranteed bounds of an expression over a box
+    :param expr: Sympy expression
+    :param box: Dict of variable name => interval (lo, hi), for all free symbols of the expression
+    :return: (lower bound, upper bound). Infinite if unbounded. Raises NotBounded for unsupported expressions
+    """
+    return (_bound(expr, box, upper=False), _bound(expr, box, upper=True))
+
+
+def interval(expr, box:Dict, memo=None):
+    """
+    Interval enclosing an expression over a box, by plain interval arithmetic : looser than bounds(), but much cheaper
+    :param memo: Dict shared by calls on expressions with common sub expressions, over the same box
+    :return: (lo, hi). Raises NotBounded for unsupported expressions
+    """
+    return _evaluate(expr, box, memo if memo is not None else dict())[0]
+
+
+def union(intervals):
+    """Smallest interval containing all intervals"""
+    intervals = list(intervals)
+    return (min(lo for lo, hi in intervals), max(hi for lo, hi in intervals))
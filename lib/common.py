@@ -1,74 +1,387 @@
 from enum import Enum
 from typing import Dict
-from sympy import Expr, Float, parse_expr, lambdify, Basic
+from importlib import metadata
+import numpy
 import json
+import os
+import sys
+import glob
+import pickle
+import hashlib
+import inspect
+import threading
+import atexit
+from time import perf_counter
+from collections import OrderedDict
+from itertools import product
+from math import inf, prod
 from typing import Literal, List
 
+from lib.utils import span
+from lib.polynomial import PolynomialTable, from_sympy, try_polynomial, source_cost
+
+# Sympy is only imported when expressions are parsed, lambdified or processed symbolically :
+# a model loaded from its compiled cache (warm start) never imports it
+
+# Version of the compiled cache format. Increment it to invalidate existing caches
+COMPILED_VERSION = 6
+
+# Folder of compiled cache, relative to the model file
+CACHE_DIR = ".cache"
+
+# Default max number of results kept in the cache of each model
+RESULT_CACHE_SIZE = 4096
+
+# Max number of specialized models kept by each model. See Model.specialize()
+SPECIALIZATION_CACHE_SIZE = 16
+
+# Max number of bounds kept by each model. See Model.bounds()
+BOUNDS_CACHE_SIZE = 256
+
+# Max number of combinations of enum and bool values enumerated to compute bounds.
+# Beyond, their expanded params vary independently within [0, 1] : bounds are looser, but still guaranteed
+MAX_BOUNDS_COMBINATIONS = 64
+
+# Imports and function name of the source generated by lambdify(..., 'numpy')
+NUMPY_IMPORTS = "import numpy; from numpy import *; from numpy.linalg import *; from functools import reduce; I = 1j"
+LAMBDIFY_FUNC_NAME = "_lambdifygenerated"
+
+class ModelError(Exception):
+    """Error due to invalid input : unknown impact, axis, functional unit or param, or invalid param value"""
+    pass
+
 class ParamType(str, Enum) :
     BOOLEAN = "bool"
     ENUM = "enum"
     FLOAT = "float"
 
 def is_expr(exp):
-    return isinstance(exp, Basic)
+    # Without sympy imported, there is no sympy expression
+    sympy = sys.modules.get("sympy")
+    return sympy is not None and isinstance(exp, sympy.Basic)
+
+def _slots_dict(obj):
+    """Dict of attributes of an object with __slots__. Unset attributes are skipped"""
+    return {name: getattr(obj, name) for name in obj.__slots__ if hasattr(obj, name)}
 
 class FunctionalUnit :
 
+    __slots__ = ("quantity", "unit")
+
     def __init__(self, quantity, unit):
         self.quantity = quantity
         self.unit = unit
 
-def _lambdify(expr, expanded_params):
+def _lambdify(expr, expanded_params, cse=False):
+    """
+    Lambdify an expression (or a list of expressions) with numpy.
+    :param cse: If True, extract common sub expressions
+    :return: <compiled function>, <generated source code>
+    """
+    from sympy import lambdify
+    func = lambdify(expanded_params, expr, 'numpy', cse=cse)
+    return func, inspect.getsource(func)
+
+def _free_symbols(expr):
+    """Sorted list of names of free symbols (expanded params) of an expression"""
+    if not is_expr(expr):
+        return []
+    return sorted(str(symbol) for symbol in expr.free_symbols)
+
+class _Differentiator:
+    """
+    Symbolic partial derivatives of expressions, sharing the free symbols of sub expressions between calls.
+    Much faster than sympy.diff() on large trees, which recomputes them at each level
+    """
+
+    def __init__(self):
+        # id of sub expression => (set of free symbol names, sub expression). The expression is kept to keep its id valid
+        self.free = dict()
+
+    def free_symbols(self, expr):
+        from sympy import Symbol
+        key = id(expr)
+        if not key in self.free :
+            if isinstance(expr, Symbol):
+                symbols = frozenset([expr.name])
+            else:
+                symbols = frozenset().union(*[self.free_symbols(arg) for arg in expr.args])
+            self.free[key] = (symbols, expr)
+        return self.free[key][0]
+
+    def diff(self, expr, name):
+        """Derivative of expression with respect to symbol 'name'"""
+
+        import sympy
+
+        if not is_expr(expr) or not name in self.free_symbols(expr) :
+            return sympy.S.Zero
+
+        if isinstance(expr, sympy.Symbol):
+            return sympy.S.One
+
+        if isinstance(expr, sympy.Add):
+            return sympy.Add(*[self.diff(arg, name) for arg in expr.args])
+
+        if isinstance(expr, sympy.Mul):
+            args = expr.args
+            terms = []
+            for i, arg in enumerate(args):
+                derivative = self.diff(arg, name)
+                if derivative != 0 :
+                    terms.append(sympy.Mul(*(args[:i] + (derivative,) + args[i + 1:])))
+            return sympy.Add(*terms)
+
+        if isinstance(expr, sympy.Pow) and not name in self.free_symbols(expr.exp):
+            return expr.exp * sympy.Pow(expr.base, expr.exp - 1) * self.diff(expr.base, name)
+
+        return sympy.diff(expr, sympy.Symbol(name))
+
+
+def _parse(expr):
+    """Parse expression (or dict of expressions) if kept as string"""
+    if isinstance(expr, dict):
+        return {key: _parse(sub_expr) for key, sub_expr in expr.items()}
+    if isinstance(expr, str):
+        from sympy import parse_expr
+        return parse_expr(expr)
+    if hasattr(expr, "to_sympy"):
+        # Lazy expression, loaded from binary format
+        return expr.to_sympy()
+    return expr
+
+def _substitute(expr, substitutions):
+    """Replace symbols by values. Constant parts of the expression are folded"""
+    return expr.xreplace(substitutions) if is_expr(expr) else expr
+
+def _to_str(expr):
+    """String form of a sympy expression. Lazy expressions (binary format) are kept as is"""
+    return str(expr) if is_expr(expr) else expr
+
+def _expr_to_str(expr):
+    """String form of an expression, or dict of expressions"""
+    if isinstance(expr, dict):
+        return {key: _to_str(sub_expr) for key, sub_expr in expr.items()}
+    return _to_str(expr)
+
+def _expr_json(expr):
+    """Serialized form of an expression, or dict of expressions"""
+    if isinstance(expr, dict):
+        return {key: str(sub_expr) for key, sub_expr in expr.items()}
+    return str(expr)
+
+def _all_free_symbols(expr):
+    """Free symbols of an expression, or of all expressions of a dict"""
+    if isinstance(expr, dict):
+        return set().union(*(_all_free_symbols(sub_expr) for sub_expr in expr.values()))
+    return expr.free_symbols if is_expr(expr) else set()
+
+def _inline(expr, intermediates):
+    """Replace symbols of shared intermediates by their expressions, in an expression or dict of expressions"""
+    if isinstance(expr, dict):
+        return {key: _substitute(sub_expr, intermediates) for key, sub_expr in expr.items()}
+    return _substitute(expr, intermediates)
+
+def inline_intermediates(intermediates:Dict[str, str]):
+    """
+    Parse shared intermediates of a model file, each one possibly using the previous ones
+    :return: Dict of symbol => expression using params only
+    """
+    from sympy import Symbol, parse_expr
+    res = dict()
+    for name, expr in intermediates.items():
+        res[Symbol(name)] = _substitute(parse_expr(expr), res)
+    return res
+
+def _broadcast(val, size):
+    return numpy.broadcast_to(numpy.asarray(val, dtype=float), (size,))
+
+# Globals of compiled functions : numpy functions. Shared by all of them, instead of a copy per function
+_NUMPY_NAMESPACE = dict()
+exec(NUMPY_IMPORTS, _NUMPY_NAMESPACE)
 
-    if isinstance(expr, Expr):
-        return lambdify(expanded_params, expr, 'numpy')
-    else:
-        # Not an expression : return statis func
-        def static_func(*args, **kargs):
-            return expr
-        return static_func
+def _compile_source(source):
+    """Compile source code generated by lambdify, without sympy"""
+    namespace = dict()
+    exec(source, _NUMPY_NAMESPACE, namespace)
+    return namespace[LAMBDIFY_FUNC_NAME]
 
 class Lambda:
     """
-    This class represents a compiled (lambdified) expression together with the list of requirement parameters and the source expression
+    This class represents a compiled (lambdified) expression together with the list of requirement parameters and the source expression.
+    The expression is compiled on first use (see compile()) : a model only compiles the expressions it evaluates
     """
-    def __init__(self, expr, all_params):
+
+    __slots__ = (
+        "symbols", "params", "keys", "expanded_params", "expr", "reduced", "cse", "name", "runtime",
+        "_source", "_init_poly", "_lambd", "_poly", "_fast", "_compiled", "_lock")
+    def __init__(self, expr, all_params, cse=False, reduced=None, poly=True):
+        """
+        :param expr: Expression, or dict of expressions
+        :param all_params: Dict of all params
+        :param cse: If True, common sub expressions are extracted and computed once. Useful for dict of expressions
+        :param reduced: Same expression(s), using shared intermediates of the model (see Model.intermediates).
+            Only used for serialization, instead of expr. None if the expression does not use intermediates
+        :param poly: If False, no polynomial table is ever built : batch evaluation uses the compiled function
+        """
 
         if isinstance(expr, dict):
 
-            self.lambd = dict()
+            # Expanded params used by each key
+            self.symbols = {key: _free_symbols(sub_expr) for key, sub_expr in expr.items()}
 
             # First, gather all expanded parameters
             all_expanded_params = set()
-            for key, sub_expr in expr.items():
-                if not is_expr(sub_expr) :
-                    continue
-                expanded_params = list(str(symbol) for symbol in sub_expr.free_symbols)
-                all_expanded_params.update(expanded_params)
+            for symbols in self.symbols.values():
+                all_expanded_params.update(symbols)
 
-            all_expanded_params = list(all_expanded_params)
+            all_expanded_params = sorted(all_expanded_params)
 
             # Transform them into list of params
             self.params = unexpand_param_names(all_params, all_expanded_params)
-            reexpanded_params = expand_param_names(all_params, self.params)
-
-            # Lambdify with all expanded params
-            for key, sub_expr in expr.items():
-                self.lambd[key] = _lambdify(sub_expr, reexpanded_params)
+            self.keys = list(expr.keys())
 
         else:
+            from sympy import Expr, Float
             if not isinstance(expr, Expr):
                 expr = Float(expr)
 
-            expanded_params = list(str(symbol) for symbol in expr.free_symbols)
+            expanded_params = _free_symbols(expr)
+            self.symbols = {None: expanded_params}
             self.params = unexpand_param_names(all_params, expanded_params)
+            self.keys = None
 
-            # Reexpend symbols, to ensure all enum values are present as a parameter
-            reexpanded_params = expand_param_names(all_params, self.params)
-
-            self.lambd = _lambdify(expr, reexpanded_params)
+        # Reexpend symbols, to ensure all enum values are present as a parameter
+        self.expanded_params = expand_param_names(all_params, self.params)
 
         self.expr = expr
+        self.reduced = reduced
+        self.cse = cse
+
+        # Name used in metrics. Set by the model
+        self.name = None
+
+        # If True, symbolic trees are replaced by their string form once compiled. See compact()
+        self.runtime = False
+
+        # Sparse polynomial form of expressions, for batch evaluation
+        self._init_lazy(source=None, init_poly=self._expr_poly if poly else None)
+
+    def _init_lazy(self, source, init_poly, fast=None):
+        """
+        Setup lazy compilation
+        :param source: Generated source code, or None to lambdify the expressions
+        :param init_poly: Function returning the polynomial table (or None), or None if the lambda has no polynomial table
+        :param fast: Whether batch evaluation uses the polynomial table, if already known. See fast
+        """
+        self._source = source
+        self._init_poly = init_poly
+        self._lambd = None
+        self._poly = None
+        self._fast = fast if init_poly is not None else False
+        self._compiled = False
+        self._lock = threading.Lock()
+
+    def _expr_poly(self):
+        """Polynomial table built from the expressions"""
+        return PolynomialTable.from_polys(
+            [try_polynomial(from_sympy, sub_expr) for sub_expr in self._sub_exprs()],
+            self.expanded_params)
+
+    def _sub_exprs(self):
+        """List of expressions, in order of keys"""
+        expr = _parse(self.expr)
+        if self.keys is None :
+            return [expr]
+        return [expr[key] for key in self.keys]
+
+    @property
+    def is_compiled(self):
+        return self._compiled
+
+    def compile(self):
+        """
+        Lambdify the expressions (or compile the cached source code), once. The polynomial table is built on demand (see fast).
+        Thread safe : concurrent callers wait for the first one to complete.
+        """
+        if self._compiled :
+            return self
+
+        with self._lock:
+            if not self._compiled :
+                with span("lambda_compile", expression=self.name):
+                    if self._source is None :
+                        sub_exprs = self._sub_exprs()
+                        # Lambdify all keys at once, into a single function returning a list
+                        _, self._source = _lambdify(
+                            sub_exprs if self.keys is not None else sub_exprs[0],
+                            self.expanded_params, cse=self.cse)
+
+                    # Compile the source in the shared namespace
+                    self._lambd = _compile_source(self._source)
+                self._compiled = True
+
+                if self.runtime :
+                    self.compact()
+
+        return self
+
+    def compact(self):
+        """
+        Free symbolic trees of a compiled lambda, keeping their string form : it is only used for serialization,
+        and parsed again to build fused lambdas or gradients
+        """
+        if not self._compiled :
+            return
+        self.expr = _expr_to_str(self.expr)
+        if self.reduced is not None :
+            self.reduced = _expr_to_str(self.reduced)
+
+    @property
+    def lambd(self):
+        """Compiled function"""
+        return self._lambd if self._compiled else self.compile()._lambd
+
+    @property
+    def source(self):
+        """Source code of compiled function"""
+        if self._source is None :
+            self.compile()
+        return self._source
+
+    @property
+    def poly(self):
+        """
+        Polynomial table, or None. It is only kept when used for batch evaluation (see fast) :
+        otherwise, it is built again on each call
+        """
+        if self.fast :
+            return self._poly
+        return self._init_poly() if self._init_poly is not None else None
+
+    @property
+    def fast(self):
+        """
+        True if batch evaluation uses the polynomial table. The table is built on first call, and only kept if used
+        """
+        if self._fast is None :
+            source = self.source
+            with self._lock:
+                if self._fast is None :
+                    self._set_poly(self._init_poly(), source)
+        return self._fast
+
+    def _set_poly(self, poly:PolynomialTable, source):
+        """
+        Set polynomial table. It is used for batch evaluation (fast path) if all expressions are polynomial,
+        and it requires less operations than the compiled function. Otherwise, the compiled function is used.
+        """
+        self._poly = poly
+        self._fast = poly is not None \
+            and len(poly.fallback) == 0 \
+            and poly.cost() < source_cost(source)
+        if not self._fast :
+            self._poly = None
 
     def evaluate(self, all_params, param_values):
 
@@ -84,37 +397,144 @@ class Lambda:
             param = all_params[param_name]
             expanded_values.update(param.expand_values(val))
 
+        with span("lambda", expression=self.name):
+            res = self.lambd(**expanded_values)
 
-        if isinstance(self.lambd, dict) :
-            return {key: lambd(**expanded_values) for key, lambd in self.lambd.items()}
+        if self.keys is None :
+            return res
         else:
-            return self.lambd(**expanded_values)
+            return dict(zip(self.keys, res))
 
+    def evaluate_expanded(self, expanded_values):
+        """Evaluate with expanded values of all params, as returned by Model.expand_values()"""
 
-    def __json__(self):
+        with span("lambda", expression=self.name):
+            res = self.lambd(*(expanded_values[name] for name in self.expanded_params))
+
+        if self.keys is None :
+            return res
+        else:
+            return dict(zip(self.keys, res))
 
-        if isinstance(self.expr, dict):
-            expr = {key: str(expr) for key, expr in self.expr.items()}
+    def evaluate_batch(self, all_params, param_values, size):
+        """
+        Vectorized evaluation over several scenarios, with a single call to the compiled function.
+        :param param_values: Dict of param name => array of values (of length 'size'). Missing params take their default value
+        :param size: Number of scenarios
+        :return: Array of values, or dict of arrays in case of dict expression
+        """
+
+        # Expand params, using default values for missing ones
+        expanded_values = dict()
+        for param_name in self.params:
+            param = all_params[param_name]
+            val = param_values[param_name] if param_name in param_values else param.default
+            expanded_values.update(param.expand_array_values(val))
+
+        with span("lambda_batch", expression=self.name):
+            res = self.evaluate_columns([expanded_values[name] for name in self.expanded_params], size)
+
+        if self.keys is None :
+            return res[0]
         else:
-            expr = str(self.expr)
+            return dict(zip(self.keys, res))
+
+    def evaluate_columns(self, columns, size):
+        """
+        Batch evaluation, with the polynomial table (fast path) or the compiled function.
+        :param columns: Values of expanded params, in the order of self.expanded_params : scalars or arrays of length 'size'
+        :return: List of arrays, one per key (a single one for scalar expression)
+        """
+
+        if self.fast :
+            return list(self._poly.evaluate(columns, size).T)
 
+        res = self.lambd(*columns)
+        if self.keys is None :
+            res = [res]
+
+        # Static expressions return scalars : broadcast them
+        return [_broadcast(val, size) for val in res]
+
+    def polynomial_keys(self, poly=None):
+        """
+        List of keys (None for scalar expression) having a polynomial form
+        :param poly: Polynomial table of the lambda, if already built
+        """
+        if poly is None :
+            poly = self.poly
+        if poly is None :
+            return []
+        keys = self.keys or [None]
+        return [keys[i] for i in poly.outputs]
+
+
+    def __json__(self):
         return dict(
             params=self.params,
-            expr=expr)
+            expr=_expr_json(self.reduced if self.reduced is not None else self.expr))
+
+    def __compiled__(self):
+        """Plain data used to store the compiled lambda in cache"""
+        return dict(
+            params=self.params,
+            expr=_expr_json(self.expr),
+            reduced=_expr_json(self.reduced) if self.reduced is not None else None,
+            expanded_params=self.expanded_params,
+            keys=self.keys,
+            symbols=self.symbols,
+            source=self.source,
+            has_poly=self._init_poly is not None,
+            fast=self.fast,
+            poly=self._poly.__compiled__() if self.fast else None)
 
     @classmethod
-    def from_json(cls, js, all_params):
-        expr = js["expr"]
-        if isinstance(expr, dict):
-            expr = {key:parse_expr(expr) for key, expr in expr.items()}
-        else:
-            expr = parse_expr(expr)
+    def from_json(cls, js, all_params, intermediates=None):
+        """
+        :param intermediates: Dict of symbol => inlined expression of shared intermediates of the model (see Model.intermediates).
+            They are substituted in the expression, whose original form is kept for serialization
+        """
+        expr = _parse(js["expr"])
+
+        if not intermediates or not any(symbol in intermediates for symbol in _all_free_symbols(expr)) :
+            return cls(expr=expr, all_params=all_params)
+
+        # Shared intermediates are computed once by the compiled function
+        return cls(expr=_inline(expr, intermediates), all_params=all_params, cse=True, reduced=expr)
 
-        return cls(expr=expr, all_params=all_params)
+    @classmethod
+    def from_compiled(cls, data, init_poly=None):
+        """Build Lambda from cached compiled data, without parsing nor lambdifying.
+        The expressions are kept as strings : they are only used for serialization.
+        The source code is compiled on first use.
+        :param init_poly: Optional function returning the polynomial table. By default, it is read from data when used
+            for batch evaluation, or built from the expressions otherwise
+        """
+        lambd = cls.__new__(cls)
+        lambd.params = data["params"]
+        lambd.expanded_params = data["expanded_params"]
+        lambd.keys = data["keys"]
+        lambd.symbols = data["symbols"]
+        lambd.expr = data["expr"]
+        lambd.reduced = data.get("reduced")
+        lambd.cse = False
+        lambd.name = None
+        lambd.runtime = False
+
+        fast = data.get("fast")
+        if init_poly is None and data.get("has_poly", True) :
+            poly = data.get("poly")
+            init_poly = (lambda: PolynomialTable.from_compiled(poly)) if poly else lambd._expr_poly
+
+        lambd._init_lazy(data["source"], init_poly, fast)
+        return lambd
 
 
 class Param:
 
+    # Enum params have 'values', other ones 'min' and 'max'
+    __slots__ = ("name", "label", "type", "default", "unit", "group", "description", "values", "min", "max")
+
     def __init__(
             self, name, type:ParamType, unit:str, default:float,
             values:List[str]=None,
@@ -126,7 +546,7 @@ class Param:
         self.name: str = name
         self.label: str = label
         self.type: ParamType = type
-        self.default: Float  = default
+        self.default: float = default
         self.unit: str = unit
         self.group : str = group
         self.description: str = description
@@ -149,6 +569,19 @@ class Param:
         # Enum ? generate individual boolean param values
         return {"%s_%s" % (self.name, enum): 1 if value == enum else 0 for enum in self.values}
 
+    def expand_array_values(self, values):
+        """Vectorized version of expand_values, for an array of values.
+        Numeric values of enum params are considered as indices in the list of possible values"""
+
+        if self.type != ParamType.ENUM :
+            return {self.name:values}
+
+        values = numpy.asarray(values)
+        if values.dtype.kind in "iuf" :
+            values = numpy.asarray(self.values, dtype=object)[values.astype(int)]
+
+        return {"%s_%s" % (self.name, enum): (values == enum).astype(float) for enum in self.values}
+
     def expand_names(self):
 
         if self.type != ParamType.ENUM :
@@ -158,7 +591,7 @@ class Param:
         return ["%s_%s" % (self.name, enum) for enum in self.values]
 
     def __json__(self):
-        return self.__dict__
+        return _slots_dict(self)
 
 
 def expand_param_names(all_params, param_names):
@@ -170,17 +603,72 @@ def expand_param_names(all_params, param_names):
 
 
 def unexpand_param_names(all_params, expanded_param_names):
-    """Build a dict of expended_param => param"""
+    """Build a dict of expended_param => param. Params are returned in order of first appearance, so that output is deterministic"""
     expanded_params_to_params = {name:param.name for param in all_params.values() for name in param.expand_names() }
-    return list(set(expanded_params_to_params[name] for name in expanded_param_names))
+    return list(dict.fromkeys(expanded_params_to_params[name] for name in expanded_param_names))
 
 
 class Impact() :
+
+    __slots__ = ("name", "unit")
+
     def __init__(self, name, unit):
-        self.name = name,
+        self.name = name
         self.unit = unit
 
 
+class LRUCache:
+    """Thread safe LRU cache, with counters of hits, misses and evictions"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return cached value, or None"""
+        with self.lock:
+            if key in self.data :
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            if self.maxsize <= 0 :
+                return
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize :
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                size=len(self.data),
+                maxsize=self.maxsize,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions)
+
+
+def _copy_result(vals):
+    """Copy dicts of results, so that callers can not alter cached values"""
+    if isinstance(vals, dict):
+        return {key: _copy_result(val) for key, val in vals.items()}
+    return vals
+
+
 class Model :
 
     def __init__(
@@ -188,40 +676,533 @@ class Model :
             params:Dict,
             expressions:Dict[str, Dict[str, Lambda]],
             functional_units:Dict[str, FunctionalUnit],
-            impacts:Dict[str, Impact]) :
+            impacts:Dict[str, Impact],
+            cache_size=RESULT_CACHE_SIZE) :
         """
         :param params: List of all parameters
         :param expressions: Dict of Dict {axis => {method => Lamba}}
         :param functional_units: Dict of function unit name => formula
         :param impacts : Dict of impacts with their units
+        :param cache_size : Max number of results kept in cache by evaluate() and evaluate_all(). 0 to disable it
         """
         self.params : Dict[str, Param] = params
         self.expressions : Dict[str, Dict[str, Lambda]]= expressions
         self.functional_units : Dict[str, FunctionalUnit] = functional_units
         self.impacts: Dict[str, Impact] = impacts
 
+        # Fused lambdas, by impact, computing total and all axes at once. Built on first use
+        self.fused: Dict[str, Lambda] = dict()
+
+        # Lambdas computing partial derivatives, by impact and by functional unit. Built on first use
+        self.gradients: Dict[str, Lambda] = dict()
+        self.fu_gradients: Dict[str, Lambda] = dict()
+
+        # Polynomial tables shared by several impacts, by (impacts, axis). Built on first use
+        self.tables: Dict = dict()
+
+        # Lock for building fused lambdas, gradients and tables once, when evaluated from several threads
+        self.lock = threading.RLock()
+
+        # Background thread compiling all lambdas. See start_warmup()
+        self.warmup_thread = None
+
+        # Low memory mode. See set_runtime()
+        self.runtime = False
+
+        # Values of params fixed by specialization, not present anymore in the model. See specialize()
+        self.fixed_params = dict()
+
+        # Shared intermediates of expressions, by name, in order of definition : each one may use the previous ones.
+        # Only used for serialization : expressions of lambdas are inlined, their 'reduced' form uses intermediates. See lib.optimize
+        self.intermediates: Dict[str, str] = dict()
+
+        # Specialized models, by fixed param values
+        self.specializations = LRUCache(SPECIALIZATION_CACHE_SIZE)
+
+        # Bounds of impacts, by impact, functional unit, axis and fixed param values. See bounds()
+        self.bounds_cache = LRUCache(BOUNDS_CACHE_SIZE)
+
+        # Cache of results, bound to this instance : a reloaded model starts with an empty cache
+        self.cache = LRUCache(cache_size)
+
+        # Reverse index of dependencies : param names (and expanded param names) => expressions
+        self.dependencies, self.fu_dependencies = self._build_dependencies()
+
+        for axis, impacts in expressions.items():
+            for impact, lambd in impacts.items():
+                lambd.name = "%s/%s" % (axis, impact)
+        for name, functional_unit in functional_units.items():
+            functional_unit.quantity.name = "functional_unit/%s" % name
+
+    def _build_dependencies(self):
+        """
+        :return:
+            <Dict of param name => Dict of (axis, impact) => list of axis keys depending on it (None for total)>,
+            <Dict of param name => list of functional units depending on it>
+            Both are indexed by param names and expanded param names (for enums)
+        """
+
+        expanded_to_params = {name: param.name for param in self.params.values() for name in param.expand_names()}
+
+        dependencies = dict()
+        for axis, impacts in self.expressions.items():
+            for impact, lambd in impacts.items():
+                for key, symbols in lambd.symbols.items():
+                    for symbol in symbols:
+                        for name in {symbol, expanded_to_params[symbol]}:
+                            keys = dependencies.setdefault(name, dict()).setdefault((axis, impact), [])
+                            if not key in keys :
+                                keys.append(key)
+
+        fu_dependencies = dict()
+        for fu_name, fu in self.functional_units.items():
+            for symbol in fu.quantity.symbols[None]:
+                for name in {symbol, expanded_to_params[symbol]}:
+                    fu_dependencies.setdefault(name, []).append(fu_name)
+
+        return dependencies, fu_dependencies
+
+    def affecting_params(self, impact, functional_unit):
+        """Set of params having an effect on an impact (on any axis) or on the functional unit"""
+
+        return set(
+            name for name in self.params
+            if any(dep_impact == impact for _, dep_impact in self.dependencies.get(name, dict()))
+            or functional_unit in self.fu_dependencies.get(name, []))
+
+    def _cache_key(self, impact, functional_unit, axis, param_values):
+        """Key of result cache : canonical values of all params, with default values"""
+
+        values = tuple(
+            param_values.get(name, param.default) if param.type == ParamType.ENUM else float(param_values.get(name, param.default))
+            for name, param in self.params.items())
+
+        return impact, functional_unit, axis, values
+
+    def clear_cache(self):
+        self.cache.clear()
+
     def __json__(self):
-        return self.__dict__
+        res = dict(params=self.params)
+        if self.intermediates :
+            res["intermediates"] = self.intermediates
+        res.update(
+            expressions=self.expressions,
+            functional_units=self.functional_units,
+            impacts=self.impacts)
+        if self.fixed_params :
+            res["fixed_params"] = self.fixed_params
+        return res
+
+    def specialize(self, fixed_params:Dict):
+        """
+        Partial evaluation : model with some params fixed, exposing only the other ones.
+        Fixed values are substituted in all expressions (enum values collapse their expanded params)
+        and constant parts are folded, before compilation. Specialized models are cached by fixed values.
+        :param fixed_params: Dict of param name => value
+        :return: Model
+        """
 
-    def evaluate(self, impact, functional_unit, axis="total", **param_values):
+        self.validate_params(fixed_params, scalar=True)
+
+        key = self._fixed_key(fixed_params)
+        model = self.specializations.get(key)
+        if model is None :
+            model = self._specialize(fixed_params)
+            self.specializations.put(key, model)
+        return model
+
+    def _fixed_key(self, fixed_params):
+        """Canonical key of fixed param values"""
+        return tuple(
+            (name, value if self.params[name].type == ParamType.ENUM else float(value))
+            for name, value in sorted(fixed_params.items()))
+
+    def _specialize(self, fixed_params):
+        import sympy
+
+        substitutions = dict()
+        for name, value in fixed_params.items():
+            for expanded_name, expanded_value in self.params[name].expand_values(value).items():
+                substitutions[sympy.Symbol(expanded_name)] = \
+                    sympy.Integer(expanded_value) if isinstance(expanded_value, (bool, int)) else sympy.Float(expanded_value)
+
+        params = {
+            name: Param.from_json(dict(param.__json__()))
+            for name, param in self.params.items() if not name in fixed_params}
+
+        def specialize(lambd):
+            expr = _parse(lambd.expr)
+            if isinstance(expr, dict):
+                expr = {key: _substitute(sub_expr, substitutions) for key, sub_expr in expr.items()}
+            else:
+                expr = _substitute(expr, substitutions)
+            return Lambda(expr, params)
+
+        expressions = {
+            axis: {impact: specialize(lambd) for impact, lambd in impacts.items()}
+            for axis, impacts in self.expressions.items()}
+
+        functional_units = {
+            key: FunctionalUnit(quantity=specialize(fu.quantity), unit=fu.unit)
+            for key, fu in self.functional_units.items()}
+
+        impacts = {key: Impact(impact.name, impact.unit) for key, impact in self.impacts.items()}
+
+        model = Model(params, expressions, functional_units, impacts, cache_size=self.cache.maxsize)
+        model.fixed_params = dict(self.fixed_params, **fixed_params)
+        model.set_runtime(self.runtime)
+        return model
+
+    def _new_lambda(self, exprs, name):
+        """Lambda built from dict of expressions, with common sub expressions. It is never evaluated in batch : no polynomial table"""
+        lambd = Lambda(exprs, self.params, cse=True, poly=False)
+        lambd.name = name
+        lambd.runtime = self.runtime
+        return lambd
+
+    def lambdas(self):
+        """Generator of all lambdas of the model : expressions, functional units, fused lambdas and gradients"""
+        for impacts in self.expressions.values():
+            yield from impacts.values()
+        for functional_unit in self.functional_units.values():
+            yield functional_unit.quantity
+        yield from self.fused.values()
+        yield from self.gradients.values()
+        yield from self.fu_gradients.values()
+
+    def set_runtime(self, runtime=True):
+        """
+        Low memory mode : symbolic trees are freed once compiled, and only their string form is kept (see Lambda.compact()).
+        Useful when each worker process holds its own copy of the model. Applied to compiled lambdas immediately
+        """
+        with self.lock:
+            self.runtime = runtime
+            for lambd in self.lambdas():
+                lambd.runtime = runtime
+                if runtime :
+                    lambd.compact()
+
+    def _fused_lambda(self, impact):
+        """Single lambda computing total and all axes of an impact, with common sub expressions shared.
+        Its keys are tuples (axis, axis key), with axis key being None for 'total'"""
+
+        with self.lock:
+            if not impact in self.fused :
+
+                exprs = dict()
+                for axis, impacts in self.expressions.items():
+                    lambd = impacts[impact]
+                    expr = _parse(lambd.expr)
+                    if lambd.keys is None :
+                        exprs[(axis, None)] = expr
+                    else:
+                        exprs.update({(axis, key): expr[key] for key in lambd.keys})
+
+                self.fused[impact] = self._new_lambda(exprs, "fused/%s" % impact)
+
+        return self.fused[impact]
+
+    def _derivatives(self, differentiator, expr, key=()):
+        """Dict of key + (param name,) => partial derivative of expression, for all non enum params it depends on"""
+        return {
+            key + (symbol,): differentiator.diff(expr, symbol)
+            for symbol in _free_symbols(expr)
+            if symbol in self.params and self.params[symbol].type != ParamType.ENUM}
+
+    def _gradient_lambda(self, impact):
+        """Single lambda computing the partial derivatives of total and all axes of an impact, with respect to all non enum params.
+        Its keys are tuples (axis, axis key, param name), with axis key being None for 'total'"""
+
+        with self.lock:
+            if not impact in self.gradients :
+
+                differentiator = _Differentiator()
+                exprs = dict()
+                for axis, impacts in self.expressions.items():
+                    lambd = impacts[impact]
+                    expr = _parse(lambd.expr)
+                    if lambd.keys is None :
+                        exprs.update(self._derivatives(differentiator, expr, (axis, None)))
+                    else:
+                        for key in lambd.keys:
+                            exprs.update(self._derivatives(differentiator, expr[key], (axis, key)))
+
+                self.gradients[impact] = self._new_lambda(exprs, "gradient/%s" % impact)
+
+        return self.gradients[impact]
+
+    def _fu_gradient_lambda(self, functional_unit):
+        """Lambda computing the partial derivatives of a functional unit. Its keys are param names"""
+
+        with self.lock:
+            if not functional_unit in self.fu_gradients :
+                expr = _parse(self.functional_units[functional_unit].quantity.expr)
+                exprs = {key[0]: val for key, val in self._derivatives(_Differentiator(), expr).items()}
+                self.fu_gradients[functional_unit] = self._new_lambda(exprs, "functional_unit_gradient/%s" % functional_unit)
+
+        return self.fu_gradients[functional_unit]
+
+    def build_gradients(self):
+        """Build derivatives of all impacts and functional units, so that they are saved in compiled cache"""
+        for impact in self.impacts:
+            self._gradient_lambda(impact)
+        for functional_unit in self.functional_units:
+            self._fu_gradient_lambda(functional_unit)
+
+    def _warmup_lambdas(self, impacts=None):
         """
+        Generator of all lambdas, in order of priority : functional units,
+        then for each impact (given ones first) : all axes, fused lambda and gradients (if already built)
+        """
+        for functional_unit in self.functional_units.values():
+            yield functional_unit.quantity
+
+        impacts = list(impacts or []) + [impact for impact in self.impacts if not impact in (impacts or [])]
+        for impact in impacts:
+            for lambdas in self.expressions.values():
+                yield lambdas[impact]
+            yield self._fused_lambda(impact)
+            if impact in self.gradients :
+                yield self.gradients[impact]
+
+        yield from self.fu_gradients.values()
+
+    def compile_all(self, impacts=None):
+        """
+        Compile all lambdas, in order of priority
+        :param impacts: Impacts to compile first
+        :return: Number of lambdas compiled by this call
+        """
+        nb_compiled = 0
+        for lambd in self._warmup_lambdas(impacts):
+            if not lambd.is_compiled :
+                lambd.compile()
+                nb_compiled += 1
+        return nb_compiled
+
+    def start_warmup(self, impacts=None, on_done=None):
+        """
+        Compile all lambdas in a background (daemon) thread, in order of priority. Lambdas are otherwise compiled on first use.
+        :param impacts: Impacts to compile first. By default, in order of self.impacts : the first one is the default impact of the app
+        :param on_done: Optional function called in the thread, once all lambdas are compiled
+        :return: Thread
+        """
+
+        def warmup():
+            start = perf_counter()
+            try:
+                nb_compiled = self.compile_all(impacts)
+                print("Model warm up : %d expressions compiled in %.2f s" % (nb_compiled, perf_counter() - start))
+                if on_done is not None :
+                    on_done()
+            except Exception as e:
+                print("Model warm up failed : %s" % e)
+
+        self.warmup_thread = threading.Thread(target=warmup, name="model-warmup", daemon=True)
+        self.warmup_thread.start()
+        return self.warmup_thread
+
+    def gradient(self, impact, functional_unit, axis="total", **param_values):
+        """
+        Partial derivatives of an impact, divided by the functional unit, with respect to all non enum params.
+        Derivatives are computed by compiled symbolic expressions : a single call computes them all.
         :param axis: Axis to consider
         :param impact: Impact to consider
         :param functional_unit: Function unit
         :param param_values: List of parameters
-        :return: <Value of impact, or dict of values, in case one axis is used>, <unit>
+        :return: <Dict of param name => derivative, or dict of axis key => dict of derivatives, in case one axis is used>, <unit of impact>.
+            Params without effect are not present.
+        """
+
+        with span("gradient", impact=impact, axis=axis):
+
+            key = self._cache_key(impact, functional_unit, ("gradient", axis), param_values)
+            res = self.cache.get(key)
+
+            if res is None :
+                res = self._gradient(impact, functional_unit, axis, param_values)
+                self.cache.put(key, res)
+
+        vals, unit = res
+        return _copy_result(vals), unit
+
+    def _gradient(self, impact, functional_unit, axis, param_values):
+
+        lambd = self._get_lambda(impact, axis)
+        unit = self._unit(impact, functional_unit)
+
+        expanded_values = self.expand_values(param_values)
+        fu_val = self.functional_units[functional_unit].quantity.evaluate_expanded(expanded_values)
+        fu_grad = self._fu_gradient_lambda(functional_unit).evaluate_expanded(expanded_values)
+        impacts = self._fused_lambda(impact).evaluate_expanded(expanded_values)
+        grads = self._gradient_lambda(impact).evaluate_expanded(expanded_values)
+
+        # Derivative of impact / functional unit : d(impact)/fu - impact * d(fu) / fu²
+        keys = [None] if lambd.keys is None else lambd.keys
+        vals = {key: {param: -impacts[(axis, key)] * val / fu_val ** 2 for param, val in fu_grad.items()} for key in keys}
+        for (grad_axis, key, param), val in grads.items():
+            if grad_axis == axis :
+                vals[key][param] = vals[key].get(param, 0.0) + val / fu_val
+
+        if lambd.keys is None :
+            return vals[None], unit
+
+        # Filter out "null"=zero axis
+        return {key: val for key, val in vals.items() if not (key == "null" and impacts[(axis, key)] == 0.0)}, unit
+
+    def elasticities(self, impact, functional_unit, **param_values):
         """
+        Normalized sensitivity of the total impact (divided by the functional unit) to each non enum param :
+        relative change of impact for a relative change of the param, (d impact / d param) * param / impact.
+        :return: Dict of param name => elasticity, sorted by decreasing absolute value. Params without effect are not present
+        """
+
+        grad, _ = self.gradient(impact, functional_unit, "total", **param_values)
+        val, _ = self.evaluate(impact, functional_unit, "total", **param_values)
+
+        res = {
+            param: (derivative * param_values.get(param, self.params[param].default) / val) if val != 0 else 0.0
+            for param, derivative in grad.items()}
+
+        return dict(sorted(res.items(), key=lambda item: -abs(item[1])))
+
+    def polynomial_table(self, impacts:List[str], axis="total"):
+        """
+        Single polynomial table computing the given axis of several impacts, sharing their monomials.
+        Outputs are in order of impacts (and axis keys).
+        :return: PolynomialTable, or None if some expressions are not polynomial,
+            or if the table requires more operations than the compiled functions
+        """
+        key = (tuple(impacts), axis)
+        with self.lock:
+            if not key in self.tables :
+                lambdas = [self._get_lambda(impact, axis) for impact in impacts]
+                table = None
+                polys = [lambd.poly for lambd in lambdas]
+                if all(poly is not None and len(poly.fallback) == 0 for poly in polys) :
+                    table = PolynomialTable.concat(polys)
+                    if table.cost() >= sum(min(poly.cost(), source_cost(lambd.source)) for poly, lambd in zip(polys, lambdas)) :
+                        table = None
+                self.tables[key] = table
+        return self.tables[key]
+
+    def fast_path_report(self):
+        """
+        Report of expressions evaluated by their polynomial table in batch evaluation.
+        :return: Dict of axis => impact => {fast, polynomial, total, monomials} :
+            whether the fast path is used, number of polynomial keys, total number of keys and number of monomials
+        """
+        res = dict()
+        for axis, impacts in self.expressions.items():
+            for impact, lambd in impacts.items():
+                poly = lambd.poly
+                res.setdefault(axis, dict())[impact] = dict(
+                    fast=lambd.fast,
+                    polynomial=len(lambd.polynomial_keys(poly)),
+                    total=len(lambd.keys or [None]),
+                    monomials=len(poly.monomials) if poly is not None else 0)
+        return res
+
+    def validate_params(self, param_values, scalar=False):
+        """
+        Check param names and values : float params should be within [min, max], bool params 0 or 1, enum params one of their values.
+        :param param_values: Dict of param name => value, or array of values
+        :param scalar: If True, values should be single values, not arrays
+        :raises ModelError: for the first invalid param
+        """
+
+        for name, val in param_values.items():
+
+            if not name in self.params :
+                raise ModelError("Unknown param '%s'" % name)
+
+            param = self.params[name]
+            if isinstance(val, dict) or (scalar and isinstance(val, (list, tuple, numpy.ndarray))) :
+                raise ModelError("Param '%s' should be a single value. Got %s" % (name, val))
+
+            try:
+                vals = numpy.asarray(val)
+            except ValueError:
+                raise ModelError("Invalid values for param '%s' : %s" % (name, val))
+
+            if param.type == ParamType.ENUM :
+                invalid = [val for val in numpy.unique(vals) if not val in param.values]
+                if len(invalid) > 0:
+                    raise ModelError("Invalid value(s) %s for param '%s'. Expected one of %s" % (invalid, name, param.values))
+
+            elif vals.dtype.kind not in "biuf" :
+                raise ModelError("Param '%s' should be numeric. Got %s" % (name, val))
+
+            elif param.type == ParamType.BOOLEAN :
+                if not numpy.isin(vals, [0, 1]).all() :
+                    raise ModelError("Param '%s' should be a boolean. Got %s" % (name, val))
+
+            elif not ((vals >= param.min) & (vals <= param.max)).all() :
+                raise ModelError("Param '%s' should be within [%s, %s]. Got %s" % (name, param.min, param.max, val))
+
+    def expand_values(self, param_values):
+        """Values of all params (default values overridden by param_values), expanded with one value per enum value"""
+
+        with span("expand_params"):
+            expanded_values = dict()
+            for name, param in self.params.items():
+                expanded_values.update(param.expand_values(param_values.get(name, param.default)))
+        return expanded_values
+
+    def _get_lambda(self, impact, axis):
 
         if not axis in self.expressions :
-            raise Exception("Wrong axis '%s'. Expected one of %s" % (axis, list(self.expressions.keys())))
+            raise ModelError("Wrong axis '%s'. Expected one of %s" % (axis, list(self.expressions.keys())))
 
         expressions_by_impact = self.expressions[axis]
 
         if not impact in expressions_by_impact:
-            raise Exception("Wrong impact '%s'. Expected one of %s" % (impact, list(expressions_by_impact.keys())))
+            raise ModelError("Wrong impact '%s'. Expected one of %s" % (impact, list(expressions_by_impact.keys())))
+
+        return expressions_by_impact[impact]
+
+    def _unit(self, impact, functional_unit):
+
+        if not impact in self.impacts:
+            raise ModelError("Wrong impact '%s'. Expected one of %s" % (impact, list(self.impacts.keys())))
+
+        if not functional_unit in self.functional_units:
+            raise ModelError("Wrong functional unit '%s'. Expected one of %s" % (functional_unit, list(self.functional_units.keys())))
+
+        unit = self.impacts[impact].unit
+        functional_unit = self.functional_units[functional_unit]
+
+        if functional_unit.unit is not None :
+            unit += "/" + functional_unit.unit
+
+        return unit
+
+    def evaluate(self, impact, functional_unit, axis="total", **param_values):
+        """
+        :param axis: Axis to consider
+        :param impact: Impact to consider
+        :param functional_unit: Function unit
+        :param param_values: List of parameters
+        :return: <Value of impact, or dict of values, in case one axis is used>, <unit>
+        """
+
+        with span("evaluate", impact=impact, axis=axis):
+
+            key = self._cache_key(impact, functional_unit, axis, param_values)
+            res = self.cache.get(key)
 
-        lambd = expressions_by_impact[impact]
-        impact_obj = self.impacts[impact]
+            if res is None :
+                res = self._evaluate(impact, functional_unit, axis, param_values)
+                self.cache.put(key, res)
+
+        vals, unit = res
+        return _copy_result(vals), unit
+
+    def _evaluate(self, impact, functional_unit, axis, param_values):
+
+        lambd = self._get_lambda(impact, axis)
+        unit = self._unit(impact, functional_unit)
         functional_unit = self.functional_units[functional_unit]
 
         # Compute value of functional unit
@@ -230,63 +1211,543 @@ class Model :
         # Compute value of impacts
         impacts = lambd.evaluate(self.params, param_values)
 
+        return self._divide(impacts, fu_val), unit
+
+    @staticmethod
+    def _divide(impacts, fu_val):
+        """Divide impacts (value or dict of values by axis key) by the value of the functional unit"""
+
+        if isinstance(impacts, dict) :
+
+            # Filter out "null"=zero axis
+            impacts = {key:val for key, val in impacts.items() if not (key == "null" and val == 0.0)}
+
+            return {key: val / fu_val for key, val in impacts.items()}
+        else:
+            return impacts / fu_val
+
+    def _evaluate_fused(self, impact, expanded_values, fu_val):
+
+        res = self._fused_lambda(impact).evaluate_expanded(expanded_values)
+
+        vals = {axis: (None if impacts[impact].keys is None else dict()) for axis, impacts in self.expressions.items()}
+        for (axis, key), val in res.items():
+            if key is None :
+                vals[axis] = val / fu_val
+
+            # Filter out "null"=zero axis
+            elif not (key == "null" and val == 0.0):
+                vals[axis][key] = val / fu_val
+
+        return vals
+
+    def evaluate_all(self, impact, functional_unit, **param_values):
+        """
+        Evaluate total and all axes of an impact at once.
+        Params are expanded once, the functional unit is computed once and all axes are computed by a single function.
+        :param impact: Impact to consider
+        :param functional_unit: Function unit
+        :param param_values: List of parameters
+        :return: <Dict of axis => value for "total", or dict of values for other axes>, <unit>
+        """
+
+        # All axes are cached under axis=None
+        with span("evaluate", impact=impact, axis="all"):
+
+            key = self._cache_key(impact, functional_unit, None, param_values)
+            res = self.cache.get(key)
+
+            if res is None :
+                res = self._evaluate_all(impact, functional_unit, param_values)
+                self.cache.put(key, res)
+
+        vals, unit = res
+        return _copy_result(vals), unit
+
+    def _evaluate_all(self, impact, functional_unit, param_values):
+
+        self._get_lambda(impact, "total")
+        unit = self._unit(impact, functional_unit)
+
+        expanded_values = self.expand_values(param_values)
+        fu_val = self.functional_units[functional_unit].quantity.evaluate_expanded(expanded_values)
+
+        return self._evaluate_fused(impact, expanded_values, fu_val), unit
+
+    def evaluate_all_impacts(self, functional_unit, **param_values):
+        """
+        Evaluate total and all axes of all impacts at once.
+        :return: Dict of impact => (<Dict of axis => value or dict of values>, <unit>)
+        """
+
+        units = {impact: self._unit(impact, functional_unit) for impact in self.impacts}
+        expanded_values = self.expand_values(param_values)
+        fu_val = self.functional_units[functional_unit].quantity.evaluate_expanded(expanded_values)
+
+        return {
+            impact: (self._evaluate_fused(impact, expanded_values, fu_val), units[impact])
+            for impact in self.impacts}
+
+    def bounds(self, impact, functional_unit, axis="total", **fixed_params):
+        """
+        Guaranteed lower and upper bounds of an impact, when params vary within their ranges.
+        Computed by interval arithmetic on the expression trees, tightened by detection of monotonic params (see lib.bounds),
+        and cached by impact, functional unit, axis and fixed params.
+        :param fixed_params: Params fixed to a value. Others vary within [min, max], or over all their values for enum and bool params
+        :return: <(lower, upper), or dict of axis key => (lower, upper)>, <unit>
+        """
+
+        lambd = self._get_lambda(impact, axis)
+        unit = self._unit(impact, functional_unit)
+        self.validate_params(fixed_params, scalar=True)
+
+        key = (impact, functional_unit, axis, self._fixed_key(fixed_params))
+        res = self.bounds_cache.get(key)
+
+        if res is None :
+            with span("bounds", impact=impact, axis=axis):
+                res = self._bounds(lambd, functional_unit, fixed_params)
+            self.bounds_cache.put(key, res)
+
+        return _copy_result(res), unit
+
+    def bounds_all(self, impact, functional_unit, **fixed_params):
+        """
+        Bounds of total and all axes of an impact. See bounds()
+        :return: <Dict of axis => (lower, upper) for "total", or dict of axis key => (lower, upper) for other axes>, <unit>
+        """
+        unit = self._unit(impact, functional_unit)
+        return {axis: self.bounds(impact, functional_unit, axis, **fixed_params)[0] for axis in self.expressions}, unit
+
+    def _bounds(self, lambd, functional_unit, fixed_params):
+        import sympy
+        from lib.bounds import bounds as interval_bounds, union, NotBounded
+
+        quantity = self.functional_units[functional_unit].quantity
+        quantity_expr = _parse(quantity.expr)
+
+        # Impact by functional unit as a single expression : params shared by both are not counted twice
+        exprs = {
+            key: sympy.Mul(sub_expr, sympy.Pow(quantity_expr, -1), evaluate=False)
+            for key, sub_expr in zip(lambd.keys or [None], lambd._sub_exprs())}
+
+        boxes = self._bounds_boxes(list(dict.fromkeys(lambd.params + quantity.params)), fixed_params)
+
+        res = dict()
+        for key, expr in exprs.items():
+            try:
+                res[key] = union(interval_bounds(expr, box) for box in boxes)
+            except NotBounded as e:
+                print("No bounds for %s : %s" % (lambd.name, e))
+                res[key] = (-inf, inf)
+
+        if lambd.keys is None :
+            return res[None]
+
         # Filter out "null"=zero axis
+        return {key: val for key, val in res.items() if not (key == "null" and val == (0.0, 0.0))}
 
-        unit = impact_obj.unit
+    def _bounds_boxes(self, params, fixed_params):
+        """
+        Boxes of expanded params covering the ranges of params : one per combination of values of enum and bool params
+        :param params: Names of params
+        :return: List of dict of expanded param name => interval (lo, hi)
+        """
 
-        if functional_unit.unit is not None :
-            unit += "/" + functional_unit.unit
+        def fixed(param, value):
+            return {name: (float(val), float(val)) for name, val in param.expand_values(value).items()}
+
+        box = dict()
+        discrete = []
+        for name in params:
+            param = self.params[name]
+            if name in fixed_params :
+                box.update(fixed(param, fixed_params[name]))
+            elif param.type == ParamType.FLOAT :
+                box[name] = (
+                    float(param.min) if param.min is not None else -inf,
+                    float(param.max) if param.max is not None else inf)
+            else:
+                discrete.append(param)
+
+        values = [param.values if param.type == ParamType.ENUM else [0, 1] for param in discrete]
+
+        if prod(len(vals) for vals in values) > MAX_BOUNDS_COMBINATIONS :
+            for param in discrete:
+                box.update({name: (0.0, 1.0) for name in param.expand_names()})
+            return [box]
+
+        boxes = []
+        for combination in product(*values):
+            combination_box = dict(box)
+            for param, value in zip(discrete, combination):
+                combination_box.update(fixed(param, value))
+            boxes.append(combination_box)
+        return boxes
+
+    def batch_values(self, values):
+        """
+        Normalize columnar parameter values for batch evaluation
+        :param values: Dict (or DataFrame) of param name => array of values, or 2D array with one column per param (in order of self.params)
+        :return: <Dict of param name => 1D array>, <number of scenarios>
+        """
+
+        if hasattr(values, "items") :
+            values = {key: numpy.asarray(val) for key, val in values.items()}
+            unknown = [key for key in values if not key in self.params]
+            if len(unknown) > 0 :
+                raise ModelError("Unknown params %s" % unknown)
+        else:
+            values = numpy.asarray(values)
+            if values.ndim != 2 or values.shape[1] != len(self.params) :
+                raise ModelError("Expected 2D array with %d columns (one per param), got shape %s" % (len(self.params), values.shape))
+            values = {name: values[:, i] for i, name in enumerate(self.params)}
+
+        sizes = set(len(val) for val in values.values())
+        if len(sizes) > 1 :
+            raise ModelError("All param arrays should have the same length. Got %s" % sizes)
+
+        size = sizes.pop() if sizes else 1
+
+        return values, size
+
+    def evaluate_batch(self, impact, functional_unit, axis="total", values=None):
+        """
+        Vectorized version of evaluate(), for N scenarios at once.
+        :param axis: Axis to consider
+        :param impact: Impact to consider
+        :param functional_unit: Function unit
+        :param values: Dict (or DataFrame) of param name => array of values, or 2D array with one column per param (in order of self.params).
+            Missing params take their default values.
+        :return: <Array of N values of impact, or dict of arrays, in case one axis is used>, <unit>
+        """
+
+        lambd = self._get_lambda(impact, axis)
+        unit = self._unit(impact, functional_unit)
+        functional_unit = self.functional_units[functional_unit]
+
+        with span("evaluate_batch", impact=impact, axis=axis):
+            return self._evaluate_batch(lambd, functional_unit, unit, values)
+
+    def _evaluate_batch(self, lambd, functional_unit, unit, values):
+
+        values, size = self.batch_values(values if values is not None else dict())
+
+        fu_vals = functional_unit.quantity.evaluate_batch(self.params, values, size)
+        impacts = lambd.evaluate_batch(self.params, values, size)
 
-        # Divide the two
         if isinstance(impacts, dict) :
 
             # Filter out "null"=zero axis
-            impacts = {key:val for key, val in impacts.items() if not (key == "null" and val == 0.0)}
+            impacts = {key:val for key, val in impacts.items() if not (key == "null" and not val.any())}
 
-            vals = {key: val / fu_val for key, val in impacts.items()}
+            vals = {key: val / fu_vals for key, val in impacts.items()}
         else:
-            vals = impacts / fu_val
+            vals = impacts / fu_vals
 
         return vals, unit
 
-
     @classmethod
     def from_json(cls, js) :
 
         all_params = {key: Param.from_json(val) for key, val in js["params"].items()}
+        intermediates = inline_intermediates(js.get("intermediates", dict()))
 
         expressions = {
             axis : {
-                method: Lambda.from_json(lambd, all_params)
+                method: Lambda.from_json(lambd, all_params, intermediates)
                 for method, lambd in impacts.items()}
             for axis, impacts in js["expressions"].items()}
 
         functional_units = {
             key: FunctionalUnit(
-                quantity=Lambda.from_json(fu["quantity"], all_params),
+                quantity=Lambda.from_json(fu["quantity"], all_params, intermediates),
                 unit=fu["unit"])
 
             for key, fu in js["functional_units"].items()}
 
         impacts = {key: Impact(impact["name"], impact["unit"]) for key, impact in js["impacts"].items()}
 
-        return cls(all_params, expressions, functional_units, impacts)
+        model = cls(all_params, expressions, functional_units, impacts)
+        model.fixed_params = js.get("fixed_params", dict())
+        model.intermediates = js.get("intermediates", dict())
+        return model
+
+    def __compiled__(self):
+        """Plain data (no sympy) of compiled model, stored in cache"""
+        return dict(
+            params=serialize_model(self.params),
+            expressions={
+                axis: {method: lambd.__compiled__() for method, lambd in impacts.items()}
+                for axis, impacts in self.expressions.items()},
+            functional_units={
+                key: dict(quantity=fu.quantity.__compiled__(), unit=fu.unit)
+                for key, fu in self.functional_units.items()},
+            impacts=serialize_model(self.impacts),
+            fused={impact: self._fused_lambda(impact).__compiled__() for impact in self.impacts},
+            gradients={impact: lambd.__compiled__() for impact, lambd in self.gradients.items()},
+            fu_gradients={fu: lambd.__compiled__() for fu, lambd in self.fu_gradients.items()},
+            fixed_params=self.fixed_params,
+            intermediates=self.intermediates)
+
+    @classmethod
+    def from_compiled(cls, data):
+
+        all_params = {key: Param.from_json(val) for key, val in data["params"].items()}
+
+        expressions = {
+            axis: {method: Lambda.from_compiled(lambd) for method, lambd in impacts.items()}
+            for axis, impacts in data["expressions"].items()}
+
+        functional_units = {
+            key: FunctionalUnit(
+                quantity=Lambda.from_compiled(fu["quantity"]),
+                unit=fu["unit"])
+            for key, fu in data["functional_units"].items()}
+
+        impacts = {key: Impact(impact["name"], impact["unit"]) for key, impact in data["impacts"].items()}
+
+        model = cls(all_params, expressions, functional_units, impacts)
+        model.fixed_params = data.get("fixed_params", dict())
+        model.intermediates = data.get("intermediates", dict())
+        model.fused = {impact: Lambda.from_compiled(lambd) for impact, lambd in data["fused"].items()}
+        model.gradients = {impact: Lambda.from_compiled(lambd) for impact, lambd in data["gradients"].items()}
+        model.fu_gradients = {fu: Lambda.from_compiled(lambd) for fu, lambd in data["fu_gradients"].items()}
+
+        for prefix, lambdas in [("fused", model.fused), ("gradient", model.gradients), ("functional_unit_gradient", model.fu_gradients)]:
+            for key, lambd in lambdas.items():
+                lambd.name = "%s/%s" % (prefix, key)
+
+        return model
 
     def to_file(self, filename):
 
         js = serialize_model(self)
 
-        with open(filename, "w") as f:
+        # Write to temp file and rename : a server watching the file never reads it partially written
+        tmp_file = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmp_file, "w") as f:
             json.dump(js, f, indent=4)
+        os.replace(tmp_file, filename)
 
     @classmethod
-    def from_file(cls, filename):
+    def from_file(cls, filename, cache=True, warmup=False, runtime=False):
+        """
+        Load model from JSON file, or from binary file (see lib.binary).
+        Expressions are compiled on first use.
+        :param cache: If True, use the compiled cache (built on first load), avoiding to parse and lambdify expressions.
+            Not used for binary files, which load without parsing.
+        :param warmup: If True, compile all expressions in a background thread (see start_warmup()).
+            If the compiled cache has to be built, it is saved by this thread. Otherwise, it is saved at exit of the process :
+            saving compiles everything, while expressions should compile on first use.
+        :param runtime: If True, free symbolic trees once compiled (see set_runtime())
+        """
+        model, cache_file = cls._from_file(filename, cache)
+
+        if runtime :
+            model.set_runtime()
+
+        # Compiled cache to build
+        if cache_file is not None :
+            if warmup :
+                model.start_warmup(on_done=lambda: save_compiled_cache(model, filename, cache_file))
+            else:
+                _caches_to_save[os.path.abspath(filename)] = (model, cache_file)
+
+        elif warmup :
+            model.start_warmup()
+
+        return model
+
+    @classmethod
+    def _from_file(cls, filename, cache):
+        """:return: <Model>, <compiled cache file to build, or None>"""
+
+        with span("model_load", phase="read"):
+            with open(filename, "rb") as f:
+                content = f.read()
+
+        # Binary format : import here to avoid circular import
+        from lib.binary import MAGIC, load_binary
+        if content.startswith(MAGIC):
+            with span("model_load", phase="binary"):
+                return load_binary(filename), None
+
+        if not cache :
+            with span("model_load", phase="parse"):
+                return Model.from_json(json.loads(content)), None
+
+        cache_file = compiled_cache_file(filename, content)
+
+        if os.path.exists(cache_file):
+            try:
+                with span("model_load", phase="compiled_cache"):
+                    with open(cache_file, "rb") as f:
+                        return Model.from_compiled(pickle.load(f)), None
+            except Exception as e:
+                print("Failed to load compiled cache '%s' : %s. Rebuilding it" % (cache_file, e))
+
+        with span("model_load", phase="parse"):
+            return Model.from_json(json.loads(content)), cache_file
+
 
-        with open(filename, "r") as f:
-            js = json.load(f)
-            return Model.from_json(js)
+class EvaluationSession:
+    """
+    Stateful evaluation, keeping the last raw result of each expression.
+    On each call, only the expressions depending on params whose values changed are recomputed,
+    using the dependency index of the model. When several axes are to recompute, they are computed at once by the
+    fused lambda of the impact, as in Model.evaluate_all()
+    """
+
+    def __init__(self, model:Model):
+        self.model = model
+
+        # Values of all params, for last evaluation
+        self.values = None
+
+        # Last results of impact expressions : (axis, impact) => value or dict of values
+        self.impacts = dict()
+
+        # Last values of functional units
+        self.fu_vals = dict()
+
+        # Number of expressions computed
+        self.nb_computed = 0
+
+    def _update_values(self, param_values):
+        """Update param values and drop results depending on changed params"""
+
+        model = self.model
+        values = {name: param_values.get(name, param.default) for name, param in model.params.items()}
+
+        if self.values is not None :
+            for name, val in values.items():
+                if val == self.values[name] :
+                    continue
+                for key in model.dependencies.get(name, dict()):
+                    self.impacts.pop(key, None)
+                for fu in model.fu_dependencies.get(name, []):
+                    self.fu_vals.pop(fu, None)
+
+        self.values = values
+
+    def evaluate(self, impact, functional_unit, **param_values):
+        """
+        Evaluate total and all axes of an impact. Same as Model.evaluate_all(), results being shared with the cache of the model.
+        :return: <Dict of axis => value for "total", or dict of values for other axes>, <unit>
+        """
+        with span("session_evaluate", impact=impact):
+            return self._evaluate(impact, functional_unit, param_values)
+
+    def _evaluate(self, impact, functional_unit, param_values):
+
+        model = self.model
+        model._get_lambda(impact, "total")
+        unit = model._unit(impact, functional_unit)
+
+        self._update_values(param_values)
+
+        cache_key = model._cache_key(impact, functional_unit, None, self.values)
+        res = model.cache.get(cache_key)
+        if res is not None :
+            vals, unit = res
+            return _copy_result(vals), unit
+
+        # Params are expanded once for all expressions to compute
+        expanded_values = None
+        axes = [axis for axis in model.expressions if not (axis, impact) in self.impacts]
+
+        if axes or not functional_unit in self.fu_vals :
+            expanded_values = model.expand_values(self.values)
+
+        if not functional_unit in self.fu_vals :
+            self.fu_vals[functional_unit] = model.functional_units[functional_unit].quantity.evaluate_expanded(expanded_values)
+            self.nb_computed += 1
 
+        if len(axes) > 1 :
+            # Several expressions to compute : the fused lambda computes all axes at once, sharing common sub expressions
+            for axis, impacts in model.expressions.items():
+                self.impacts[(axis, impact)] = None if impacts[impact].keys is None else dict()
+            for (axis, key), val in model._fused_lambda(impact).evaluate_expanded(expanded_values).items():
+                if key is None :
+                    self.impacts[(axis, impact)] = val
+                else:
+                    self.impacts[(axis, impact)][key] = val
+            self.nb_computed += 1
 
+        elif axes :
+            axis = axes[0]
+            self.impacts[(axis, impact)] = model.expressions[axis][impact].evaluate_expanded(expanded_values)
+            self.nb_computed += 1
+
+        vals = {
+            axis: model._divide(self.impacts[(axis, impact)], self.fu_vals[functional_unit])
+            for axis in model.expressions}
+
+        model.cache.put(cache_key, (vals, unit))
+
+        return _copy_result(vals), unit
+
+
+def compiled_cache_key(content:bytes):
+    """Hash of model file content and versions of the libraries producing the compiled code"""
+    sha = hashlib.sha256(content)
+    sha.update(("%s|%s|%s|%s" % (COMPILED_VERSION, metadata.version("sympy"), numpy.__version__, sys.version)).encode())
+    return sha.hexdigest()
+
+
+def compiled_cache_file(filename, content:bytes):
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    return os.path.join(dirname, CACHE_DIR, "%s.%s.compiled" % (basename, compiled_cache_key(content)[:16]))
+
+
+def save_compiled_cache(model, filename, cache_file):
+    """Save compiled model to cache file and remove stale caches of the same model file"""
+
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+    for stale_file in glob.glob(os.path.join(os.path.dirname(cache_file), "%s.*.compiled" % os.path.basename(filename))):
+        if stale_file != cache_file :
+            try:
+                os.remove(stale_file)
+            except FileNotFoundError:
+                # Removed by a concurrent save
+                pass
+
+    # Write to temp file and rename, so that concurrent workers never read partial files.
+    # Several threads of a process may save at once (warm up and hot reload)
+    tmp_file = "%s.%d.%d.tmp" % (cache_file, os.getpid(), threading.get_ident())
+    with open(tmp_file, "wb") as f:
+        pickle.dump(model.__compiled__(), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+
+
+# Compiled caches to save at exit : model file => (model, cache file). Only the last model loaded from each file is kept
+_caches_to_save = dict()
+
+
+@atexit.register
+def _save_caches_at_exit():
+    for filename, (model, cache_file) in list(_caches_to_save.items()):
+        try:
+            with span("model_load", phase="save_cache"):
+                save_compiled_cache(model, filename, cache_file)
+        except Exception as e:
+            print("Failed to save compiled cache '%s' : %s" % (cache_file, e))
+    _caches_to_save.clear()
+
+
+def build_compiled_cache(filename):
+    """Parse and compile model file, and save it to the compiled cache. Returns the cache file."""
+
+    with open(filename, "rb") as f:
+        content = f.read()
+
+    cache_file = compiled_cache_file(filename, content)
+    model = Model.from_json(json.loads(content))
+    model.build_gradients()
+    save_compiled_cache(model, filename, cache_file)
+    return cache_file
 
 
 def serialize_model(obj) :
@@ -299,6 +1760,9 @@ def serialize_model(obj) :
     if hasattr(obj, "__dict__") :
         return serialize_model(obj.__dict__)
 
+    if hasattr(obj, "__slots__") :
+        return serialize_model(_slots_dict(obj))
+
     return obj
 
 
@@ -1,12 +1,31 @@
-
 from typing import Dict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import hashlib
+import pickle
+import json
+import os
+import numpy
+import sympy
+import brightway2 as bw
+import lca_algebraic as agb
 from lca_algebraic import SymDict, ParamDef
 from lca_algebraic.base_utils import _method_unit
 from lca_algebraic.lca import _preMultiLCAAlgebric
 from lca_algebraic.params import _param_registry
 from lca_algebraic.stats import _round_expr
 
-from lib.common import FunctionalUnit, Lambda, Impact, Model, Param, is_expr, ParamType
+from lib.common import FunctionalUnit, Lambda, Impact, Model, Param, is_expr, ParamType, serialize_model, COMPILED_VERSION
+from lib.sensitivity import sampler, scale_samples
+from lib.optimize import optimize_model, rounding_rtol
+from lib.utils import timer
+
+# Version of the export cache. Increment it to invalidate existing entries.
+# Entries also depend on the format of compiled lambdas (COMPILED_VERSION), part of the fingerprint
+EXPORT_CACHE_VERSION = 1
+
+# Number of random scenarios on which the sums of axes are checked against the total
+CHECK_SAMPLES = 100
 
 
 def round_expr(exp_or_dict, num_digits):
@@ -36,18 +55,298 @@ def paramDef_to_param(paramDef:ParamDef):
         max=paramDef.max,
         description=paramDef.description)
 
+
+def _db_fingerprint(db_name):
+    """List of (database, last modification) for a database and all the databases it depends on"""
+
+    res = dict()
+    todo = [db_name]
+    while len(todo) > 0 :
+        name = todo.pop()
+        if name in res :
+            continue
+        meta = bw.databases[name]
+        res[name] = meta.get("modified")
+        todo.extend(meta.get("depends", []))
+
+    return sorted(res.items())
+
+
+class ExportCache:
+    """
+    On disk cache of the compiled expression of each (axis, method).
+    Entries are keyed by a fingerprint of the method and axis, the number of digits, the param registry, the state of the databases
+    and the format of compiled lambdas.
+    Each entry is saved as soon as it is computed : an interrupted export resumes where it stopped.
+    """
+
+    def __init__(self, cache_dir, system, all_params, num_digits):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.fingerprint = json.dumps(dict(
+            version=EXPORT_CACHE_VERSION,
+            compiled_version=COMPILED_VERSION,
+            sympy=sympy.__version__,
+            system=list(system.key),
+            databases=_db_fingerprint(system.key[0]),
+            params=serialize_model(all_params),
+            num_digits=num_digits), sort_keys=True, default=str)
+
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, axis, method):
+        sha = hashlib.sha256(self.fingerprint.encode())
+        sha.update(json.dumps([axis, list(method)]).encode())
+        return os.path.join(self.cache_dir, "%s.pickle" % sha.hexdigest())
+
+    def get(self, axis, method):
+        """Return cached Lambda or None"""
+
+        filename = self._file(axis, method)
+
+        if not os.path.exists(filename) :
+            self.misses += 1
+            return None
+
+        with open(filename, "rb") as f:
+            self.hits += 1
+            return Lambda.from_compiled(pickle.load(f))
+
+    def put(self, axis, method, compiled):
+        """Save compiled data of a Lambda"""
+
+        filename = self._file(axis, method)
+
+        # Write to temp file and rename, so that an interrupted export never leaves partial entries
+        tmp_file = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmp_file, "wb") as f:
+            pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, filename)
+
+
+def _axis_exprs(system, methods, axis):
+    """Compute symbolic expressions of all methods for one axis (None for total)"""
+
+    with timer("Axis %s : LCA" % axis):
+        lambdas = _preMultiLCAAlgebric(system, methods, axis=axis)
+
+    exprs = []
+    for lambd in lambdas:
+        expr = lambd.expr
+        if isinstance(expr, SymDict):
+            expr = expr.dict
+        exprs.append(expr)
+
+    return exprs
+
+
+def _axis_total(expr):
+    """Total of an expression split by axis : sum of its values, including the 'null' one"""
+    if isinstance(expr, dict):
+        return sympy.Add(*expr.values())
+    return expr
+
+
+def _plan(methods_dict, axes, lambdas):
+    """
+    Methods to compute for each axis, those not found in cache.
+    When there is an axis other than the total, the total is not computed by a traversal of its own :
+    it is the sum of the first axis (split axis), which also computes the methods missing for the total.
+    :param lambdas: Dict of axis => method name => cached Lambda
+    :return: <Dict of axis => method names to compute>, <Dict of axis => missing method names>, <split axis or None>
+    """
+
+    split = next((axis for axis in axes if axis is not None), None)
+    missing = {axis: [name for name in methods_dict if not name in lambdas[axis]] for axis in axes}
+
+    plan = {axis: names for axis, names in missing.items() if axis is not None or split is None}
+    if split is not None and None in missing :
+        plan[split] = [name for name in methods_dict if name in missing[split] or name in missing[None]]
+
+    return {axis: names for axis, names in plan.items() if len(names) > 0}, missing, split
+
+
+def _to_compile(axis, names, exprs, missing, split):
+    """
+    Expressions to compile, from the ones computed for an axis : the missing ones, and the derived totals for the split axis
+    :return: List of (axis, method name, expression)
+    """
+
+    res = [(axis, name, expr) for name, expr in zip(names, exprs) if name in missing[axis]]
+    if axis is not None and axis == split and None in missing :
+        res += [(None, name, _axis_total(expr)) for name, expr in zip(names, exprs) if name in missing[None]]
+    return res
+
+
+def _compile_expr(expr, all_params, num_digits):
+    """Round expression and lambdify it. Returns compiled data of the Lambda, that can be sent across processes"""
+    return Lambda(round_expr(expr, num_digits), all_params).__compiled__()
+
+
+# Root activity of the export, loaded once in each worker process
+_worker_system = None
+
+def _init_worker(project, db_name, code):
+    global _worker_system
+    agb.initProject(project)
+    agb.loadParams()
+    _worker_system = agb.findActivity(code=code, db_name=db_name)
+
+def _worker_axis_exprs(methods, axis):
+    return _axis_exprs(_worker_system, methods, axis)
+
+
+def _cached_lambdas(cache, methods_dict, axis):
+    """Dict of method name => cached Lambda, for the methods found in cache"""
+
+    if cache is None :
+        return dict()
+
+    res = dict()
+    for method_name, method in methods_dict.items():
+        lambd = cache.get(axis, method)
+        if lambd is not None :
+            res[method_name] = lambd
+    return res
+
+
+def _export_axes(system, methods_dict, axes, all_params, num_digits, cache=None):
+    """Serial export : Dict of axis => method => Lambda"""
+
+    lambdas = {axis: _cached_lambdas(cache, methods_dict, axis) for axis in axes}
+    plan, missing, split = _plan(methods_dict, axes, lambdas)
+
+    for axis, names in plan.items() :
+        print("Processing axis %s" % axis)
+
+        exprs = _axis_exprs(system, [methods_dict[name] for name in names], axis)
+
+        with timer("Axis %s : rounding and compilation" % axis):
+            for target_axis, method_name, expr in _to_compile(axis, names, exprs, missing, split):
+                lambd = Lambda(round_expr(expr, num_digits=num_digits), all_params)
+                if cache is not None :
+                    cache.put(target_axis, methods_dict[method_name], lambd.__compiled__())
+                lambdas[target_axis][method_name] = lambd
+
+    # Keep order of axes and methods
+    return {
+        axis or "total": {method_name: lambdas[axis][method_name] for method_name in methods_dict.keys()}
+        for axis in axes}
+
+
+def _export_axes_parallel(system, methods_dict, axes, all_params, num_digits, jobs, cache=None):
+    """
+    Parallel export, on a pool of processes : each worker loads the project and computes the expressions of whole axes,
+    then rounding and lambdification of each (axis, method) are spread on the pool.
+    :return: Dict of axis => method => Lambda
+    """
+
+    lambdas = {axis: _cached_lambdas(cache, methods_dict, axis) for axis in axes}
+    plan, missing, split = _plan(methods_dict, axes, lambdas)
+
+    # Gather results in the same order as the serial export
+    def result():
+        return {
+            axis or "total": {method_name: lambdas[axis][method_name] for method_name in methods_dict.keys()}
+            for axis in axes}
+
+    # Everything found in cache
+    if len(plan) == 0 :
+        return result()
+
+    # Spawn fresh processes rather than forking the connections to Brightway databases
+    context = multiprocessing.get_context("spawn")
+
+    with ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(bw.projects.current, system.key[0], system.key[1])) as pool :
+
+        axis_futures = {
+            pool.submit(_worker_axis_exprs, [methods_dict[name] for name in names], axis): axis
+            for axis, names in plan.items()}
+
+        # Submit compilation of each method as soon as its axis is computed
+        compile_futures = dict()
+        for future in as_completed(axis_futures):
+            axis = axis_futures[future]
+            print("Axis %s computed" % axis)
+            for target_axis, method_name, expr in _to_compile(axis, plan[axis], future.result(), missing, split):
+                compile_futures[pool.submit(_compile_expr, expr, all_params, num_digits)] = (target_axis, method_name)
+
+        for future in as_completed(compile_futures):
+            axis, method_name = compile_futures[future]
+            compiled = future.result()
+            if cache is not None :
+                cache.put(axis, methods_dict[method_name], compiled)
+            lambdas[axis][method_name] = Lambda.from_compiled(compiled)
+
+    return result()
+
+
+def check_axis_sums(model:Model, num_digits, samples=CHECK_SAMPLES, seed=0, split_axis=None):
+    """
+    Check that, for each axis, impacts split by axis sum up to the total impacts, on random values of all params.
+    Each expression is rounded on its own, to the given number of digits : the sum of the split
+    may differ from the total by the rounding error of each of them, and no more.
+    :param num_digits: Number of digits of the rounding
+    :param samples: Number of random scenarios
+    :param split_axis: Axis the total is derived from (see _plan()), if any. It sums up to the total by construction :
+        it is not checked on its own, but through the other axes, checked against its sum
+    """
+
+    if not "total" in model.expressions :
+        return
+
+    axes = [axis for axis in model.expressions if not axis in ("total", split_axis)]
+    if len(axes) == 0 :
+        print("No axis to check against the total : it is the sum of axis '%s'" % split_axis)
+        return
+
+    params = list(model.params.values())
+    values = scale_samples(params, sampler("random", len(params), seed)(samples))
+    rtol = rounding_rtol(num_digits)
+
+    for axis in axes:
+        for impact, lambd in model.expressions[axis].items():
+            total = model.expressions["total"][impact].evaluate_batch(model.params, values, samples)
+            split = lambd.evaluate_batch(model.params, values, samples)
+            if not isinstance(split, dict) :
+                split = dict(total=split)
+
+            error = numpy.abs(sum(split.values()) - total)
+            scale = sum(numpy.abs(val) for val in split.values()) + numpy.abs(total)
+            if numpy.any(error > rtol * scale) :
+                raise Exception("Impact '%s' split by axis '%s' does not sum up to the total : relative error of %g" % (
+                    impact, axis, numpy.max(error / scale)))
+
+    print("Sums of axes %s checked against the total on %d scenarios" % (axes, samples))
+
+
 def export_lca(
         system,
         functional_units : Dict[str, Dict],
         methods_dict,
         axes=None,
-        num_digits=3):
+        num_digits=3,
+        jobs=1,
+        cache_dir=None,
+        optimize=True):
     """
     :param system: Root inventory
     :param functional_units : Dict of Dict{unit, quantity}
     :param methods_dict: dict of method_name => method tuple
-    :param axes: List of axes
+    :param axes: List of axes. None stands for the total : when other axes are given, it is derived from the split of the first one,
+        and checked against the sums of the other ones
     :param num_digits: Number of digits
+    :param jobs: Number of processes. If > 1, axes and methods are processed in parallel. The result is the same.
+    :param cache_dir: If set, the expression of each (axis, method) is cached in this folder, and only recomputed
+        when the method, the params or the databases change
+    :param optimize: If True, drop negligible terms, factor shared products and extract common sub expressions
+        into shared intermediates, written once in the model file (see lib.optimize)
     :return: an instance of "Model"
     """
 
@@ -55,39 +354,27 @@ def export_lca(
         axes = [None]
 
     # Transform all lca_algebraic parameters to exported ones
-    all_params = {param.name: paramDef_to_param(param) for param in _param_registry().all()}
+    with timer("Params"):
+        all_params = {param.name: paramDef_to_param(param) for param in _param_registry().all()}
 
-    impacts_by_axis = dict()
+    cache = ExportCache(cache_dir, system, all_params, num_digits) if cache_dir else None
 
-    for axis in axes :
-        print("Processing axis %s" % axis)
+    with timer("Axes"):
+        if jobs > 1 :
+            impacts_by_axis = _export_axes_parallel(system, methods_dict, axes, all_params, num_digits, jobs, cache)
+        else:
+            impacts_by_axis = _export_axes(system, methods_dict, axes, all_params, num_digits, cache)
 
-        lambdas = _preMultiLCAAlgebric(
-            system,
-            list(methods_dict.values()),
-            axis=axis)
-
-        if axis is None:
-            axis = "total"
-
-        # Simplify
-        for lambd, method_name  in zip(lambdas, methods_dict.keys()):
-
-            if isinstance(lambd.expr, SymDict):
-                lambd.expr = lambd.expr.dict
-            lambd.expr = round_expr(lambd.expr, num_digits=num_digits)
-
-        # Save
-        impacts_by_axis[axis] = {
-            method: Lambda(lambd.expr, all_params)
-            for method, lambd in zip(methods_dict.keys(), lambdas)}
+    if cache is not None :
+        print("Export cache : %d entries reused, %d computed" % (cache.hits, cache.misses))
 
     # Dict of functional units
-    functional_units = {
-        name: FunctionalUnit(
-            quantity=Lambda(fu["quantity"], all_params),
-            unit=fu["unit"])
-        for name, fu in functional_units.items()}
+    with timer("Functional units"):
+        functional_units = {
+            name: FunctionalUnit(
+                quantity=Lambda(fu["quantity"], all_params),
+                unit=fu["unit"])
+            for name, fu in functional_units.items()}
 
     # Build list of impacts
     impacts = {key: Impact(
@@ -95,11 +382,20 @@ def export_lca(
         unit = _method_unit(method)
     ) for key, method in methods_dict.items()}
 
-    return Model(
+    model = Model(
         params=all_params,
         functional_units=functional_units,
         expressions=impacts_by_axis,
         impacts=impacts)
 
+    # The total is derived from the first axis, if computed with others (see _plan())
+    split_axis = next((axis for axis in axes if axis is not None), None) if None in axes else None
+
+    with timer("Check axes"):
+        check_axis_sums(model, num_digits, split_axis=split_axis)
 
+    if optimize :
+        with timer("Optimize"):
+            model = optimize_model(model, num_digits)
 
+    return model
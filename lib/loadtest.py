@@ -0,0 +1,524 @@
+"""
+Load test of the web app and of its JSON API, by simulated concurrent users.
+
+App users speak the protocol of the Streamlit front end, on its websocket : each interaction (switch of impact or
+functional unit, move of a slider within the range of its param, change of an enum or bool param) sends the state
+of all widgets and waits for the end of the script run, as a browser would.
+API users call the handlers registered with setup_api_handler() : single and batch evaluations with random params,
+bounds, description of the model, health.
+Latencies are recorded per action. CPU and RSS of the server processes are sampled during the run.
+"""
+from typing import Dict
+from time import perf_counter, sleep
+from urllib.request import urlopen
+import threading
+import subprocess
+import asyncio
+import random
+import socket
+import json
+import sys
+import os
+import numpy
+import psutil
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+STREAM_PATH = "/_stcore/stream"
+HEALTH_PATH = "/_stcore/health"
+API_PREFIX = "/api"
+
+# Reported percentiles of latencies
+PERCENTILES = [50, 95, 99]
+
+# Delay between two samples of CPU and RSS, in seconds
+SAMPLE_INTERVAL = 1.0
+
+# Max time for the server to start, and for a single action, in seconds
+START_TIMEOUT = 60
+ACTION_TIMEOUT = 120
+
+# Relative frequency of actions of app users
+APP_ACTIONS = dict(
+    switch_impact=1,
+    switch_functional_unit=1,
+    move_slider=6,
+    change_enum=1,
+    toggle_bool=1)
+
+# Relative frequency of actions of API users
+API_ACTIONS = dict(
+    evaluate=7,
+    evaluate_batch=1,
+    bounds=1,
+    model=1,
+    health=1)
+
+# Number of scenarios of batch evaluations of API users
+API_BATCH_SIZE = 100
+
+# Labels of the settings widgets of the app
+IMPACT_LABEL = "Impact category"
+FUNCTIONAL_UNIT_LABEL = "Functional unit"
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port=None, env=None):
+    """
+    Start the app in a headless Streamlit server, and wait for it to answer
+    :param env: Additional environment variables of the server
+    :return: <Server process>, <url>
+    """
+
+    port = port or _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", "app.py",
+         "--server.headless", "true",
+         "--server.port", str(port),
+         "--browser.gatherUsageStats", "false"],
+        env=dict(os.environ, **(env or dict())),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+
+    url = "http://localhost:%d" % port
+    start = perf_counter()
+    while perf_counter() - start < START_TIMEOUT:
+        if process.poll() is not None :
+            raise Exception("Server exited with status %d" % process.returncode)
+        try:
+            with urlopen(url + HEALTH_PATH, timeout=1) as response:
+                if response.status == 200 :
+                    print("Server started on %s in %.1f s" % (url, perf_counter() - start))
+                    return process, url
+        except OSError:
+            pass
+        sleep(0.2)
+
+    process.kill()
+    raise Exception("Server did not start within %d s" % START_TIMEOUT)
+
+
+class Stats:
+    """Latencies and errors, by action"""
+
+    def __init__(self):
+        self.latencies = dict()
+        self.errors = dict()
+
+    def record(self, action, latency, error=None):
+        if error is not None :
+            self.errors.setdefault(action, []).append(error)
+        else:
+            self.latencies.setdefault(action, []).append(latency)
+
+    def report(self, duration):
+        """
+        :param duration: Duration of the run, in seconds
+        :return: Dict of action => {count, errors, throughput (per second), mean and percentiles of latencies (seconds)}
+        """
+
+        res = dict()
+        for action in sorted(set(self.latencies) | set(self.errors)):
+            latencies = numpy.array(self.latencies.get(action, []))
+            errors = self.errors.get(action, [])
+            res[action] = dict(
+                count=len(latencies),
+                errors=len(errors),
+                throughput=len(latencies) / duration,
+                mean=float(latencies.mean()) if len(latencies) else None,
+                **{"p%d" % p: float(numpy.percentile(latencies, p)) if len(latencies) else None for p in PERCENTILES})
+
+            if errors :
+                res[action]["first_error"] = errors[0]
+        return res
+
+
+class ResourceSampler:
+    """Samples CPU and RSS of a process and its children, in a background thread"""
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        self.root = psutil.Process(pid)
+        self.interval = interval
+        self.samples = dict()
+        self.names = dict()
+        self.processes = dict()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+
+    def _sample(self):
+        for process in [self.root] + self.root.children(recursive=True):
+            try:
+                if not process.pid in self.processes :
+                    # First call of cpu_percent() only starts the measure
+                    self.processes[process.pid] = process
+                    self.names[process.pid] = "server" if process.pid == self.root.pid else "worker %s" % process.name()
+                    process.cpu_percent()
+                    continue
+                self.samples.setdefault(process.pid, []).append((process.cpu_percent(), process.memory_info().rss))
+            except psutil.NoSuchProcess:
+                pass
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._sample()
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def report(self):
+        """:return: Dict of pid => {name, cpu_mean, cpu_max (percent of one core), rss_mean, rss_max (bytes)}"""
+
+        res = dict()
+        for pid, samples in self.samples.items():
+            cpu, rss = numpy.array(samples).T
+            res[pid] = dict(
+                name=self.names[pid],
+                cpu_mean=float(cpu.mean()),
+                cpu_max=float(cpu.max()),
+                rss_mean=float(rss.mean()),
+                rss_max=float(rss.max()))
+        return res
+
+
+class AppUser:
+    """Simulated user of the web app, through the websocket of Streamlit"""
+
+    def __init__(self, url, stats:Stats, rng:random.Random):
+        self.url = url.replace("http", "ws", 1) + STREAM_PATH
+        self.stats = stats
+        self.rng = rng
+        self.ws = None
+
+        # Widget id => (type, proto) of last run, and widget id => value
+        self.widgets = dict()
+        self.values = dict()
+
+    async def connect(self):
+        """Open a session : first run of the app"""
+        self.widgets = dict()
+        self.values = dict()
+        self.ws = await websocket_connect(self.url)
+        await self.rerun()
+
+    def close(self):
+        if self.ws is not None :
+            self.ws.close()
+            self.ws = None
+
+    def _widget_states(self):
+        states = []
+        for id, value in self.values.items():
+            widget_type, widget = self.widgets[id]
+            state = WidgetState(id=id)
+            if widget_type == "slider" :
+                state.double_array_value.data.extend([value])
+            elif widget_type == "selectbox" :
+                state.int_value = value
+            else:
+                state.bool_value = value
+            states.append(state)
+        return states
+
+    async def rerun(self):
+        """Send widget values and read messages until the end of the script run. Updates the widgets"""
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.widget_states.widgets.extend(self._widget_states())
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+
+        widgets = dict()
+        while True:
+            data = await self.ws.read_message()
+            if data is None :
+                raise Exception("Websocket closed")
+
+            forward_msg = ForwardMsg()
+            forward_msg.ParseFromString(data)
+            msg_type = forward_msg.WhichOneof("type")
+
+            if msg_type == "delta" and forward_msg.delta.WhichOneof("type") == "new_element" :
+                element = forward_msg.delta.new_element
+                element_type = element.WhichOneof("type")
+                if element_type in ("slider", "selectbox", "checkbox") :
+                    widget = getattr(element, element_type)
+                    widgets[widget.id] = (element_type, widget)
+                elif element_type == "exception" :
+                    raise Exception(element.exception.message)
+
+            elif msg_type == "script_finished" :
+                if forward_msg.script_finished != ForwardMsg.FINISHED_SUCCESSFULLY :
+                    raise Exception("Script run ended with status %d" % forward_msg.script_finished)
+                break
+
+        # Ids depend on the parameters of widgets : forget the values of widgets not displayed anymore
+        self.widgets = widgets
+        self.values = {id: value for id, value in self.values.items() if id in widgets}
+
+    def _pick(self, widget_type, filter=lambda widget: True):
+        candidates = [id for id, (type, widget) in self.widgets.items() if type == widget_type and filter(widget)]
+        return self.rng.choice(candidates) if candidates else None
+
+    def _change(self, action):
+        """Change the value of a random widget for an action. Returns False if no widget fits"""
+
+        settings = (IMPACT_LABEL, FUNCTIONAL_UNIT_LABEL)
+
+        if action == "switch_impact" :
+            id = self._pick("selectbox", lambda widget: widget.label == IMPACT_LABEL)
+        elif action == "switch_functional_unit" :
+            id = self._pick("selectbox", lambda widget: widget.label == FUNCTIONAL_UNIT_LABEL)
+        elif action == "change_enum" :
+            id = self._pick("selectbox", lambda widget: not widget.label in settings)
+        elif action == "toggle_bool" :
+            id = self._pick("checkbox")
+        else:
+            id = self._pick("slider")
+
+        if id is None :
+            return False
+
+        widget_type, widget = self.widgets[id]
+        if widget_type == "slider" :
+            steps = int(round((widget.max - widget.min) / widget.step)) if widget.step > 0 else 0
+            self.values[id] = widget.min + self.rng.randint(0, steps) * widget.step if steps > 0 else widget.min
+        elif widget_type == "selectbox" :
+            self.values[id] = self.rng.randrange(len(widget.options))
+        else:
+            self.values[id] = not self.values.get(id, widget.default)
+        return True
+
+    async def _timed(self, action, coroutine):
+        """Run and record latency of an action. On failure, the session is closed"""
+
+        start = perf_counter()
+        try:
+            await asyncio.wait_for(coroutine, ACTION_TIMEOUT)
+        except Exception as e:
+            self.stats.record("app/" + action, perf_counter() - start, error="%s : %s" % (type(e).__name__, e))
+            self.close()
+            return False
+        self.stats.record("app/" + action, perf_counter() - start)
+        return True
+
+    async def act(self):
+        """Run a random action, and record its latency. Opens a new session first if needed"""
+
+        if self.ws is None :
+            if not await self._timed("open_session", self.connect()):
+                return
+
+        action = self.rng.choices(list(APP_ACTIONS), weights=list(APP_ACTIONS.values()))[0]
+        if self._change(action):
+            await self._timed(action, self.rerun())
+
+
+class ApiUser:
+    """Simulated client of the JSON API"""
+
+    def __init__(self, url, stats:Stats, rng:random.Random, description:Dict):
+        """
+        :param description: Description of the model, as returned by GET /api/model
+        """
+        self.url = url + API_PREFIX
+        self.stats = stats
+        self.rng = rng
+        self.description = description
+        self.client = AsyncHTTPClient(force_instance=True)
+
+    def close(self):
+        self.client.close()
+
+    def _random_params(self, nb_params):
+        """Random values for some params, within their ranges"""
+
+        res = dict()
+        for name in self.rng.sample(list(self.description["params"]), nb_params):
+            param = self.description["params"][name]
+            if param["type"] == "enum" :
+                res[name] = self.rng.choice(param["values"])
+            elif param["type"] == "bool" :
+                res[name] = self.rng.choice([True, False])
+            else:
+                res[name] = self.rng.uniform(param["min"], param["max"])
+        return res
+
+    def _request(self, action):
+        """:return: <path>, <JSON body or None for GET>"""
+
+        if action == "model" :
+            return "/model", None
+        if action == "health" :
+            return "/health", None
+
+        body = dict(
+            impact=self.rng.choice(list(self.description["impacts"])),
+            functional_unit=self.rng.choice(list(self.description["functional_units"])))
+
+        if action == "bounds" :
+            return "/bounds", body
+        if action == "evaluate" :
+            body["params"] = self._random_params(self.rng.randint(1, 5))
+        else:
+            body["params"] = [self._random_params(self.rng.randint(1, 5)) for i in range(API_BATCH_SIZE)]
+
+        return "/evaluate", body
+
+    async def act(self):
+        """Run a random request, and record its latency"""
+
+        action = self.rng.choices(list(API_ACTIONS), weights=list(API_ACTIONS.values()))[0]
+        path, body = self._request(action)
+
+        start = perf_counter()
+        try:
+            await self.client.fetch(
+                self.url + path,
+                method="GET" if body is None else "POST",
+                body=None if body is None else json.dumps(body),
+                request_timeout=ACTION_TIMEOUT)
+        except HTTPClientError as e:
+            self.stats.record("api/" + action, perf_counter() - start, error="HTTP %d" % e.code)
+            return
+        except Exception as e:
+            self.stats.record("api/" + action, perf_counter() - start, error="%s : %s" % (type(e).__name__, e))
+            return
+        self.stats.record("api/" + action, perf_counter() - start)
+
+
+async def _model_description(url):
+    """GET /api/model, once the API is registered by the first run of the app"""
+
+    client = AsyncHTTPClient(force_instance=True)
+    try:
+        start = perf_counter()
+        while True:
+            try:
+                response = await client.fetch(url + API_PREFIX + "/model")
+                return json.loads(response.body)
+            except HTTPClientError:
+                if perf_counter() - start > START_TIMEOUT :
+                    raise
+                await asyncio.sleep(0.5)
+    finally:
+        client.close()
+
+
+async def _user_loop(user, end, think_time, rng:random.Random):
+    """Act until the end of the run, with random think times (exponential)"""
+    while perf_counter() < end :
+        await user.act()
+        if think_time > 0 :
+            await asyncio.sleep(rng.expovariate(1 / think_time))
+
+
+async def _run_users(url, app_users, api_users, duration, think_time, ramp_up, seed, stats:Stats):
+
+    # First session : loads the model and registers the API
+    first = AppUser(url, stats, random.Random(seed))
+    start = perf_counter()
+    await first.connect()
+    print("First app session in %.2f s" % (perf_counter() - start))
+    first.close()
+
+    description = await _model_description(url) if api_users > 0 else None
+
+    async def start_user(i, create):
+        rng = random.Random(seed + i + 1)
+        await asyncio.sleep(ramp_up * i / max(1, app_users + api_users))
+        user = create(rng)
+        try:
+            await _user_loop(user, end, think_time, rng)
+        finally:
+            user.close()
+
+    end = perf_counter() + ramp_up + duration
+    await asyncio.gather(
+        *[start_user(i, lambda rng: AppUser(url, stats, rng)) for i in range(app_users)],
+        *[start_user(app_users + i, lambda rng: ApiUser(url, stats, rng, description)) for i in range(api_users)])
+
+
+def run_load(url, app_users=10, api_users=10, duration=60.0, think_time=1.0, ramp_up=5.0, seed=0, server_pid=None):
+    """
+    Run simulated users against a running server
+    :param url: Base url of the server
+    :param app_users: Number of concurrent users of the web app
+    :param api_users: Number of concurrent clients of the JSON API
+    :param duration: Duration of the run once all users started, in seconds
+    :param think_time: Mean pause between two actions of a user, in seconds (exponential distribution). 0 for none
+    :param ramp_up: Users are started evenly during this time, in seconds
+    :param server_pid: Pid of the server, to sample CPU and RSS of its processes. Not sampled if None
+    :return: Dict with 'actions' : latencies by action (see Stats.report()), 'processes' : resources by pid, and 'duration'
+    """
+
+    stats = Stats()
+    sampler = ResourceSampler(server_pid) if server_pid is not None else None
+    load_generator = psutil.Process()
+    load_generator.cpu_percent()
+
+    if sampler is not None :
+        sampler.start()
+
+    start = perf_counter()
+    try:
+        asyncio.run(_run_users(url, app_users, api_users, duration, think_time, ramp_up, seed, stats))
+    finally:
+        if sampler is not None :
+            sampler.stop()
+    elapsed = perf_counter() - start
+
+    processes = sampler.report() if sampler is not None else dict()
+    processes[load_generator.pid] = dict(
+        name="load generator",
+        cpu_mean=load_generator.cpu_percent(),
+        cpu_max=None,
+        rss_mean=None,
+        rss_max=float(load_generator.memory_info().rss))
+
+    return dict(
+        app_users=app_users,
+        api_users=api_users,
+        duration=elapsed,
+        actions=stats.report(elapsed),
+        processes=processes)
+
+
+def print_report(report):
+
+    print("%d app users, %d API users, %.1f s" % (report["app_users"], report["api_users"], report["duration"]))
+    print()
+    print("%-32s %8s %8s %10s %10s %10s %10s" % ("Action", "Count", "Errors", "Per second", "p50 (ms)", "p95 (ms)", "p99 (ms)"))
+
+    for action, res in report["actions"].items():
+        print("%-32s %8d %8d %10.2f %10s %10s %10s" % (
+            action,
+            res["count"],
+            res["errors"],
+            res["throughput"],
+            *["%.1f" % (res["p%d" % p] * 1000) if res["p%d" % p] is not None else "-" for p in PERCENTILES]))
+
+    for action, res in report["actions"].items():
+        if res["errors"] :
+            print("%s : first error : %s" % (action, res["first_error"]))
+
+    print()
+    print("%-8s %-24s %10s %10s %12s %12s" % ("Pid", "Process", "CPU mean", "CPU max", "RSS mean", "RSS max"))
+    for pid, res in report["processes"].items():
+        print("%-8s %-24s %10s %10s %12s %12s" % (
+            pid,
+            res["name"],
+            *["%.0f %%" % res[key] if res[key] is not None else "-" for key in ["cpu_mean", "cpu_max"]],
+            *["%.1f MB" % (res[key] / 1024 / 1024) if res[key] is not None else "-" for key in ["rss_mean", "rss_max"]]))
@@ -0,0 +1,106 @@
+"""
+Memory used by the components of a model, measured by traversal of their objects.
+Objects shared by several components are counted once, in the first one.
+Modules, classes and numpy functions (globals of compiled functions) are not counted.
+Arrays mapped from the binary format are not counted either : only their header is.
+"""
+from types import FunctionType, CodeType, ModuleType, CellType
+import sys
+import numpy
+
+from lib.common import Model
+
+# Parts of a lambda, reported separately. The polynomial table comes last : its builder may reference the lambda itself
+LAMBDA_PARTS = dict(
+    expr=["expr", "reduced"],
+    source=["_source"],
+    function=["_lambd"],
+    meta=["symbols", "params", "keys", "expanded_params", "name"],
+    poly=["_poly", "_init_poly"])
+
+
+def deep_sizeof(obj, seen):
+    """
+    Size of an object and all objects it references, in bytes
+    :param seen: Set of ids of objects already counted. Updated
+    """
+
+    if obj is None or isinstance(obj, (type, ModuleType)) or id(obj) in seen :
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, (str, bytes, int, float, bool)) :
+        return size
+
+    if isinstance(obj, numpy.ndarray) :
+        # Views : count the array owning the data
+        return size + (deep_sizeof(obj.base, seen) if isinstance(obj.base, numpy.ndarray) else 0)
+
+    if isinstance(obj, dict) :
+        return size + sum(deep_sizeof(key, seen) + deep_sizeof(val, seen) for key, val in obj.items())
+
+    if isinstance(obj, (list, tuple, set, frozenset)) :
+        return size + sum(deep_sizeof(item, seen) for item in obj)
+
+    if isinstance(obj, FunctionType) :
+        # Globals are shared with numpy : only count the dict itself
+        size += 0 if id(obj.__globals__) in seen else sys.getsizeof(obj.__globals__)
+        seen.add(id(obj.__globals__))
+        return size + deep_sizeof(obj.__code__, seen) + deep_sizeof(obj.__closure__, seen) + deep_sizeof(obj.__defaults__, seen)
+
+    if isinstance(obj, CodeType) :
+        return size + sum(deep_sizeof(item, seen) for item in [obj.co_code, obj.co_consts, obj.co_names, obj.co_varnames])
+
+    if isinstance(obj, CellType) :
+        return size + deep_sizeof(obj.cell_contents, seen)
+
+    # Attributes of objects, in __dict__ or __slots__
+    if hasattr(obj, "__dict__") :
+        size += deep_sizeof(obj.__dict__, seen)
+    for cls in type(obj).__mro__ :
+        for name in getattr(cls, "__slots__", ()) :
+            if name not in ("__dict__", "__weakref__") and hasattr(obj, name) :
+                size += deep_sizeof(getattr(obj, name), seen)
+
+    return size
+
+
+def memory_report(model:Model):
+    """
+    Memory used by each component of the model
+    :return: Dict of component => bytes. Lambdas are split in parts (see LAMBDA_PARTS), as '<group>.<part>'
+    """
+
+    seen = set()
+    res = dict()
+
+    res["params"] = deep_sizeof(model.params, seen)
+
+    groups = dict(
+        expressions=[lambd for impacts in model.expressions.values() for lambd in impacts.values()],
+        functional_units=[functional_unit.quantity for functional_unit in model.functional_units.values()],
+        fused=list(model.fused.values()),
+        gradients=list(model.gradients.values()) + list(model.fu_gradients.values()))
+
+    for group, lambdas in groups.items():
+        for lambd in lambdas:
+            seen.add(id(lambd))
+        for part, attrs in LAMBDA_PARTS.items():
+            res["%s.%s" % (group, part)] = sum(
+                deep_sizeof(getattr(lambd, attr, None), seen)
+                for lambd in lambdas for attr in attrs)
+
+    res["tables"] = deep_sizeof(model.tables, seen)
+    res["dependencies"] = deep_sizeof((model.dependencies, model.fu_dependencies), seen)
+    res["result_cache"] = deep_sizeof(model.cache.data, seen)
+
+    return res
+
+
+def print_memory_report(report):
+    total = sum(report.values())
+    for component, size in report.items():
+        print("%-30s %10.1f KB %6.1f %%" % (component, size / 1024, size * 100 / total if total else 0))
+    print("%-30s %10.1f KB" % ("total", total / 1024))
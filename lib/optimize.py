@@ -0,0 +1,359 @@
+"""
+Optimization of the expressions of a model, before saving it :
+* Negligible terms : in each sum, the terms of smallest magnitude are dropped as long as, over the whole ranges of params,
+  their summed magnitude stays below a fraction of the rounding precision of the sum. Magnitudes are bounded by interval arithmetic (see lib.bounds).
+* Factoring : factors shared by several terms of a sum are factored out, greedily (multivariate Horner scheme) :
+  a*b*x + a*b*y + z => a*(b*(x + y)) + z
+* Common sub expressions, across all impacts and axes, are extracted into shared intermediates, written once in the model file.
+  They are inlined back when loading the model (see Model.intermediates), and computed once by each compiled function.
+
+Optimized expressions are checked against the original ones on random scenarios.
+"""
+from time import perf_counter
+from math import inf
+from typing import Dict, List
+import json
+import numpy
+import sympy
+from sympy import Add, Mul
+
+from lib.common import Model, ParamType, serialize_model
+from lib.bounds import interval, NotBounded
+from lib.sensitivity import sampler, scale_samples
+from lib.utils import timer
+
+# Prefix of the names of shared intermediates
+INTERMEDIATE_PREFIX = "_s"
+
+# Terms of a sum are dropped while their summed magnitude is below this share of the rounding precision of the sum
+NEGLIGIBLE_RATIO = 0.1
+
+# Number of random scenarios checking optimized expressions, and timing their evaluation
+CHECK_SAMPLES = 100
+
+
+def rounding_rtol(num_digits):
+    """Max relative error of a number rounded to num_digits significant digits"""
+    return 0.5 * 10 ** (1 - num_digits)
+
+
+def param_box(params:Dict):
+    """Box of expanded params covering their ranges : expanded enum and bool params vary within [0, 1]"""
+    box = dict()
+    for name, param in params.items():
+        if param.type == ParamType.FLOAT :
+            box[name] = (
+                float(param.min) if param.min is not None else -inf,
+                float(param.max) if param.max is not None else inf)
+        else:
+            box.update({expanded_name: (0.0, 1.0) for expanded_name in param.expand_names()})
+    return box
+
+
+def drop_negligible(exprs:List, box:Dict, rtol):
+    """
+    Drop negligible terms of sums, bottom up : the terms of smallest magnitude, as long as their summed magnitude
+    stays below rtol x the minimal magnitude of the sum over the box.
+    Terms bringing the only dependency of the sum on a param are kept.
+    :param exprs: List of expressions. Common sub expressions are processed once
+    :param box: Dict of expanded param name => interval (lo, hi)
+    :return: <List of expressions>, <number of dropped terms>
+    """
+
+    memo = dict()
+    intervals = dict()
+    nb_dropped = 0
+
+    def magnitude(expr):
+        lo, hi = interval(expr, box, intervals)
+        return max(abs(lo), abs(hi))
+
+    def drop_terms(expr):
+        nonlocal nb_dropped
+        try:
+            lo, hi = interval(expr, box, intervals)
+            terms = sorted(expr.args, key=magnitude)
+        except NotBounded:
+            return expr
+
+        budget = rtol * (lo if lo > 0 else -hi if hi < 0 else 0.0)
+
+        # Params of the terms following each one : a term is only dropped if its params remain in the sum,
+        # otherwise results would no longer depend on them
+        remaining_symbols = [set() for _ in terms]
+        for i in range(len(terms) - 2, -1, -1):
+            remaining_symbols[i] = remaining_symbols[i + 1] | terms[i + 1].free_symbols
+
+        dropped = set()
+        kept_symbols = set()
+        total = 0.0
+        for term, remaining in zip(terms, remaining_symbols):
+            if not term.free_symbols <= remaining | kept_symbols :
+                kept_symbols |= term.free_symbols
+                continue
+            total += magnitude(term)
+            if total > budget :
+                break
+            dropped.add(term)
+
+        nb_dropped += len(dropped)
+        return Add(*[term for term in expr.args if not term in dropped]) if dropped else expr
+
+    def drop(expr):
+        if expr in memo :
+            return memo[expr]
+
+        res = expr
+        if len(expr.args) > 0 :
+            args = [drop(arg) for arg in expr.args]
+            if args != list(expr.args) :
+                res = expr.func(*args)
+            if isinstance(res, Add) :
+                res = drop_terms(res)
+
+        memo[expr] = res
+        return res
+
+    res = [drop(expr) for expr in exprs]
+    return res, nb_dropped
+
+
+def _factor_terms(terms):
+    """Sum of terms, factoring out the factor shared by most of them, recursively"""
+
+    factors = [Mul.make_args(term) for term in terms]
+
+    counts = dict()
+    for term_factors in factors:
+        for factor in dict.fromkeys(term_factors):
+            if not factor.is_number :
+                counts[factor] = counts.get(factor, 0) + 1
+
+    best = max(counts, key=counts.get, default=None)
+    if best is None or counts[best] < 2 :
+        return Add(*terms)
+
+    shared, rest = [], []
+    for term, term_factors in zip(terms, factors):
+        if best in term_factors :
+            others = list(term_factors)
+            others.remove(best)
+            shared.append(Mul(*others))
+        else:
+            rest.append(term)
+
+    return Add(Mul(best, _factor_terms(shared)), _factor_terms(rest))
+
+
+def factor_sums(exprs:List):
+    """
+    Factor out factors shared by several terms of sums, bottom up
+    :param exprs: List of expressions. Common sub expressions are processed once
+    :return: List of expressions
+    """
+
+    memo = dict()
+
+    def factor(expr):
+        if expr in memo :
+            return memo[expr]
+
+        res = expr
+        if len(expr.args) > 0 :
+            args = [factor(arg) for arg in expr.args]
+            if isinstance(expr, Add) :
+                res = _factor_terms(args)
+            elif args != list(expr.args) :
+                res = expr.func(*args)
+
+        memo[expr] = res
+        return res
+
+    return [factor(expr) for expr in exprs]
+
+
+def extract_intermediates(exprs:List, exclude):
+    """
+    Extract common sub expressions of all expressions into shared intermediates
+    :param exclude: Symbols that cannot be used as names of intermediates (params)
+    :return: <Dict of name => expression of intermediate, in order of definition>, <list of reduced expressions>
+    """
+    symbols = sympy.numbered_symbols(INTERMEDIATE_PREFIX, exclude=exclude)
+    replacements, reduced = sympy.cse(exprs, symbols=symbols, order="none")
+    return {symbol.name: expr for symbol, expr in replacements}, reduced
+
+
+def _check_values(model:Model, samples, seed):
+    """
+    Scenarios checking optimized expressions : random values within ranges of params, then corners of their box,
+    where rounding errors add up : all params at min, all at max, and random combinations of min and max.
+    :return: Dict of expanded param name => array of values, of size 2 x samples + 2
+    """
+    params = list(model.params.values())
+    random = sampler("random", len(params), seed)(samples)
+    corners = numpy.random.default_rng(seed + 1).integers(0, 2, (samples, len(params))).astype(float)
+    uniform = numpy.concatenate([random, numpy.zeros((1, len(params))), numpy.ones((1, len(params))), corners])
+    values = scale_samples(params, uniform)
+    expanded = dict()
+    for param in params:
+        expanded.update(param.expand_array_values(values[param.name]))
+    return expanded
+
+
+def _evaluate_expr(expr, expanded_values, size):
+    """Values of an expression on random scenarios"""
+    symbols = sorted(expr.free_symbols, key=str)
+    func = sympy.lambdify(symbols, expr, "numpy")
+    return numpy.broadcast_to(numpy.asarray(func(*(expanded_values[str(symbol)] for symbol in symbols)), dtype=float), (size,))
+
+
+def _is_close(expected, actual, rtol):
+    """True if values are equal within a relative tolerance"""
+    error = numpy.abs(actual - expected)
+    return numpy.all(error <= rtol * numpy.maximum(numpy.abs(expected), numpy.abs(actual)))
+
+
+def _sub_exprs(model:Model):
+    """
+    All expressions of all impacts and axes
+    :return: List of (axis, impact, key), list of expressions
+    """
+    keys, exprs = [], []
+    for axis, impacts in model.expressions.items():
+        for impact, lambd in impacts.items():
+            for key, expr in zip(lambd.keys or [None], lambd._sub_exprs()):
+                keys.append((axis, impact, key))
+                exprs.append(sympy.sympify(expr))
+    return keys, exprs
+
+
+def _evaluation_time(model:Model, impact, expanded_values, size):
+    """Mean time of the evaluation of all axes of an impact, by their compiled functions, for a single scenario"""
+
+    lambdas = [impacts[impact] for impacts in model.expressions.values()]
+    columns = [[expanded_values[name] for name in lambd.expanded_params] for lambd in lambdas]
+    funcs = [lambd.lambd for lambd in lambdas]
+
+    start = perf_counter()
+    for i in range(size):
+        for func, lambd_columns in zip(funcs, columns):
+            func(*(column[i] for column in lambd_columns))
+    return (perf_counter() - start) / size
+
+
+def check_model(model:Model, optimized:Model, expanded_values, size, rtol):
+    """Check that all impacts and axes of the optimized model give the same results, within tolerance"""
+
+    for axis, impacts in model.expressions.items():
+        for impact, lambd in impacts.items():
+            expected = lambd.evaluate_columns([expanded_values[name] for name in lambd.expanded_params], size)
+            other = optimized.expressions[axis][impact]
+            actual = other.evaluate_columns([expanded_values[name] for name in other.expanded_params], size)
+            for key, exp_val, act_val in zip(lambd.keys or [None], expected, actual):
+                if not _is_close(exp_val, act_val, rtol) :
+                    raise Exception("Optimized expression of impact '%s', axis '%s'%s differs from the original one" % (
+                        impact, axis, ", key '%s'" % key if key is not None else ""))
+
+
+def optimize_model(model:Model, num_digits=3, samples=CHECK_SAMPLES, seed=0):
+    """
+    Optimize expressions of all impacts and axes : drop negligible terms, factor shared products, and extract common
+    sub expressions of all of them into shared intermediates. Functional units are kept as they are.
+    Prints operation counts, size in the model file and evaluation time of each impact, before and after.
+    :param num_digits: Number of digits of the rounding of expressions. Results stay equal within its precision
+    :param samples: Number of random scenarios, and of random corners of the box of params, checking results and timing evaluations
+    :return: Optimized model, as loaded from its serialized form
+    """
+
+    rtol = rounding_rtol(num_digits)
+    expanded_values = _check_values(model, samples, seed)
+    size = 2 * samples + 2
+    keys, exprs = _sub_exprs(model)
+
+    with timer("Drop negligible terms"):
+        dropped, nb_dropped = drop_negligible(exprs, param_box(model.params), NEGLIGIBLE_RATIO * rtol)
+
+        # Interval arithmetic bounds each sum on its own : check the whole expressions, and keep the original ones otherwise
+        nb_reverted = 0
+        for i, (expr, new_expr) in enumerate(zip(exprs, dropped)):
+            if new_expr is not expr and not _is_close(
+                    _evaluate_expr(expr, expanded_values, size),
+                    _evaluate_expr(new_expr, expanded_values, size), rtol) :
+                dropped[i] = expr
+                nb_reverted += 1
+        print("%d negligible terms dropped. %d expressions reverted" % (nb_dropped, nb_reverted))
+
+    with timer("Factor shared products"):
+        factored = factor_sums(dropped)
+
+    with timer("Extract common sub expressions"):
+        param_symbols = [sympy.Symbol(name) for name in expanded_values]
+        intermediates, reduced = extract_intermediates(factored, exclude=param_symbols)
+        print("%d shared intermediates" % len(intermediates))
+
+    # Serialized form : reduced expressions, with intermediates written once, before them
+    js = serialize_model(model)
+    for (axis, impact, key), expr in zip(keys, reduced):
+        lambd_js = js["expressions"][axis][impact]
+        if key is None :
+            lambd_js["expr"] = str(expr)
+        else:
+            lambd_js["expr"][key] = str(expr)
+    js.pop("intermediates", None)
+    js = dict(params=js.pop("params"), intermediates={name: str(expr) for name, expr in intermediates.items()}, **js)
+
+    with timer("Load optimized model"):
+        optimized = Model.from_json(js)
+
+    with timer("Check optimized model"):
+        check_model(model, optimized, expanded_values, size, rtol)
+
+    print_report(model, optimized, exprs, reduced, keys, intermediates, expanded_values, size)
+
+    return optimized
+
+
+def print_report(model, optimized, exprs, reduced, keys, intermediates, expanded_values, size):
+    """Print operation counts, size in model file and evaluation time of each impact, before and after optimization"""
+
+    intermediate_ops = {sympy.Symbol(name): sympy.count_ops(expr) for name, expr in intermediates.items()}
+    intermediate_symbols = {sympy.Symbol(name): expr.free_symbols for name, expr in intermediates.items()}
+
+    # Operations of an impact : its reduced expressions and all the intermediates they use
+    ops_before = dict()
+    ops_after = dict()
+    used = dict()
+    for (axis, impact, key), expr, reduced_expr in zip(keys, exprs, reduced):
+        ops_before[impact] = ops_before.get(impact, 0) + sympy.count_ops(expr)
+        ops_after[impact] = ops_after.get(impact, 0) + sympy.count_ops(reduced_expr)
+        todo = list(reduced_expr.free_symbols)
+        while todo :
+            symbol = todo.pop()
+            if symbol in intermediate_ops and not symbol in used.setdefault(impact, set()) :
+                used[impact].add(symbol)
+                todo.extend(intermediate_symbols[symbol])
+    for impact, symbols in used.items():
+        ops_after[impact] += sum(intermediate_ops[symbol] for symbol in symbols)
+
+    def size_of(model, impact):
+        return sum(len(json.dumps(serialize_model(impacts[impact]))) for impacts in model.expressions.values())
+
+    print("Impact : operations (including shared intermediates), size in model file (bytes), evaluation time of all axes (us) : before => after")
+    for impact in model.impacts:
+        print("%s : %d => %d ops, %d => %d bytes, %.1f => %.1f us" % (
+            impact,
+            ops_before[impact], ops_after[impact],
+            size_of(model, impact), size_of(optimized, impact),
+            _evaluation_time(model, impact, expanded_values, size) * 1e6,
+            _evaluation_time(optimized, impact, expanded_values, size) * 1e6))
+
+    print("Shared intermediates : %d, %d ops, %d bytes" % (
+        len(intermediates),
+        sum(sympy.count_ops(expr) for expr in intermediates.values()),
+        len(json.dumps({name: str(expr) for name, expr in intermediates.items()}))))
+
+    print("Total : %d => %d ops, model file %d => %d bytes" % (
+        sum(ops_before.values()),
+        sum(sympy.count_ops(expr) for expr in reduced) + sum(intermediate_ops.values()),
+        len(json.dumps(serialize_model(model), indent=4)),
+        len(json.dumps(serialize_model(optimized), indent=4))))
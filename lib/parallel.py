@@ -0,0 +1,216 @@
+"""
+Evaluation of the model on several cores, by a pool of worker processes.
+
+The model is loaded and compiled once, in the parent process, and inherited by the workers (fork after load),
+through the initializer of their pool. Where fork is not available, each worker loads the model file, from the compiled cache.
+Batches of scenarios are split in shards, evaluated by the workers, and merged in input order.
+A worker dying (killed, out of memory) breaks the pool : it is restarted and the pending shards are submitted again.
+"""
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from itertools import islice
+import multiprocessing
+import os
+import numpy
+
+from lib.common import Model, ModelError
+from lib.scenarios import evaluate_chunk
+
+# Number of times a shard is submitted again after the failure of a worker
+MAX_RETRIES = 2
+
+# Model of the worker process, set by the initializer of its pool. Never set in the parent process
+_model = None
+
+
+def _init_worker(model, filename):
+    """
+    Initializer of workers : set the model of the worker process
+    :param model: Model of the pool, inherited by fork (not pickled). None if fork is not available : the model file is loaded
+    """
+    global _model
+    if model is None :
+        model = Model.from_file(filename)
+        model.compile_all()
+    _model = model
+
+
+def _run(func, args):
+    """Run a task in a worker, on the model of the worker"""
+    return func(_model, *args)
+
+
+def _evaluate_batch_task(model:Model, impact, functional_unit, axis, values):
+    return model.evaluate_batch(impact, functional_unit, axis, values)[0]
+
+
+def _evaluate_chunk_task(model:Model, values, size, columns):
+    return evaluate_chunk(model, values, size, columns, validate=True)
+
+
+def _ping(model:Model):
+    return os.getpid()
+
+
+def _shards(values, size, shard_size):
+    """Split dict of param => array of values into shards"""
+    for start in range(0, size, shard_size):
+        yield {name: val[start:start + shard_size] for name, val in values.items()}
+
+
+def _merge(results):
+    """Concatenate results of shards : arrays, or dicts of arrays by axis key.
+    Axis key 'null' is removed by shards where it is zero : it is filled with zeros"""
+
+    if not isinstance(results[0], dict) :
+        return numpy.concatenate(results)
+
+    keys = list(dict.fromkeys(key for res in results for key in res))
+    sizes = [len(next(iter(res.values()))) for res in results]
+    merged = {
+        key: numpy.concatenate([res[key] if key in res else numpy.zeros(size) for res, size in zip(results, sizes)])
+        for key in keys}
+
+    # Filter out "null"=zero axis
+    return {key: val for key, val in merged.items() if not (key == "null" and not val.any())}
+
+
+class ParallelEvaluator:
+    """
+    Pool of worker processes evaluating a model. Use it as a context manager, or call close()
+    """
+
+    def __init__(self, model:Model, workers=None, filename=None, max_retries=MAX_RETRIES):
+        """
+        :param model: Loaded model. It is compiled before workers are forked
+        :param workers: Number of worker processes. Default : number of CPUs
+        :param filename: Model file, loaded by each worker if fork is not available
+        :param max_retries: Number of times a shard is submitted again after the failure of a worker
+        """
+        self.model = model
+        self.workers = workers or os.cpu_count()
+        self.filename = filename
+        self.max_retries = max_retries
+        self.fork = "fork" in multiprocessing.get_all_start_methods()
+
+        if not self.fork and filename is None :
+            raise ModelError("Fork is not available : the model file should be provided, to be loaded by workers")
+
+        # Compile everything once, before fork. The warm up thread should not be running during fork
+        model.compile_all()
+        if model.warmup_thread is not None :
+            model.warmup_thread.join()
+
+        self.pool = None
+        self._start()
+
+    def _start(self):
+
+        if self.fork :
+            context, initargs = multiprocessing.get_context("fork"), (self.model, None)
+        else:
+            context, initargs = multiprocessing.get_context("spawn"), (None, self.filename)
+
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker, initargs=initargs)
+
+        # Start workers now, instead of on first tasks
+        list(self.pool.map(_run, [_ping] * self.workers, [()] * self.workers))
+
+    def _restart(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self._start()
+
+    def imap(self, func, tasks, max_pending=None):
+        """
+        Run tasks in workers, yielding results in order of tasks. Tasks are consumed lazily.
+        :param func: Module level function (model, *args) => result
+        :param tasks: Iterable of tuples of args
+        :param max_pending: Max number of tasks submitted at once. Default : twice the number of workers
+        """
+
+        tasks = iter(tasks)
+        max_pending = max_pending or 2 * self.workers
+
+        # Submitted tasks, in order : [args, future, number of attempts]
+        window = deque()
+
+        def submit(args, attempts=0):
+            try:
+                future = self.pool.submit(_run, func, args)
+            except BrokenProcessPool as e:
+                # Handled when the task reaches the head of the window
+                future = Future()
+                future.set_exception(e)
+            window.append([args, future, attempts])
+
+        for args in islice(tasks, max_pending):
+            submit(args)
+
+        while window :
+
+            args, future, attempts = window[0]
+            try:
+                res = future.result()
+
+            except BrokenProcessPool:
+                if attempts >= self.max_retries :
+                    raise
+
+                # All pending tasks are lost : restart the pool and submit them again
+                print("Worker process died : restarting the pool and submitting %d pending tasks again" % len(window))
+                pending = [(args, attempts) for args, future, attempts in window]
+                window.clear()
+                self._restart()
+                for args, attempts in pending :
+                    submit(args, attempts + 1)
+                continue
+
+            window.popleft()
+            yield res
+
+            for args in islice(tasks, 1):
+                submit(args)
+
+    def map(self, func, tasks):
+        return list(self.imap(func, tasks))
+
+    def evaluate_batch(self, impact, functional_unit, axis="total", values=None, shard_size=None):
+        """
+        Same as Model.evaluate_batch(), with scenarios split in shards, evaluated by the workers
+        :param shard_size: Number of scenarios per shard. Default : split evenly between workers
+        """
+
+        model = self.model
+        model._get_lambda(impact, axis)
+        unit = model._unit(impact, functional_unit)
+
+        values, size = model.batch_values(values if values is not None else dict())
+
+        # Nothing to split : empty result
+        if size == 0 :
+            return model.evaluate_batch(impact, functional_unit, axis, values)
+
+        shard_size = shard_size or -(-size // self.workers)
+
+        results = self.map(
+            _evaluate_batch_task,
+            ((impact, functional_unit, axis, shard) for shard in _shards(values, size, shard_size)))
+
+        return _merge(results), unit
+
+    def evaluate_chunks(self, chunks, columns):
+        """
+        Evaluate chunks of scenarios in workers (see lib.scenarios.evaluate_chunk()), yielding results in order
+        :param chunks: Iterable of (dict of param => array of values, number of scenarios)
+        """
+        return self.imap(_evaluate_chunk_task, ((values, size, columns) for values, size in chunks))
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,266 @@
+"""
+Sparse polynomial engine.
+
+Exported expressions are sums of coefficients times products of (integer) powers of params.
+They are compiled into a table of monomials, shared by all expressions of a Lambda, and a sparse matrix of coefficients.
+Batch evaluation is then two vectorized operations : products of powers of params, and a sparse matrix multiplication.
+
+Polynomials are stored as dict of monomial => coefficient, a monomial being a sorted tuple of (variable name, exponent).
+Negative exponents are supported.
+"""
+from typing import Dict, List
+from collections import Counter
+import re
+import numpy
+from scipy.sparse import csr_matrix
+
+ONE = ()
+
+# Relative cost of a step of the prefix tree of monomials, compared to an operation of the compiled function
+STEP_COST = 2
+
+
+class NotPolynomial(Exception):
+    pass
+
+
+def poly_const(val):
+    return {ONE: float(val)} if val != 0 else dict()
+
+
+def poly_symbol(name):
+    return {((name, 1),): 1.0}
+
+
+def poly_add(*polys):
+    res = dict()
+    for poly in polys:
+        for monomial, coef in poly.items():
+            res[monomial] = res.get(monomial, 0.0) + coef
+    return {monomial: coef for monomial, coef in res.items() if coef != 0}
+
+
+def _mul_monomials(m1, m2):
+    exps = dict(m1)
+    for name, exp in m2:
+        exps[name] = exps.get(name, 0) + exp
+    return tuple(sorted((name, exp) for name, exp in exps.items() if exp != 0))
+
+
+def poly_mul(*polys):
+    res = {ONE: 1.0}
+    for poly in polys:
+        prod = dict()
+        for m1, c1 in res.items():
+            for m2, c2 in poly.items():
+                monomial = _mul_monomials(m1, m2)
+                prod[monomial] = prod.get(monomial, 0.0) + c1 * c2
+        res = prod
+    return {monomial: coef for monomial, coef in res.items() if coef != 0}
+
+
+def poly_pow(base, exp):
+    """Integer power of polynomial. Negative powers are only supported for single monomials"""
+
+    if float(exp) != int(exp) :
+        raise NotPolynomial("Non integer exponent : %s" % exp)
+    exp = int(exp)
+
+    if exp >= 0 :
+        return poly_mul(*([base] * exp))
+
+    if len(base) != 1 :
+        raise NotPolynomial("Negative power of a sum")
+
+    (monomial, coef), = base.items()
+    return {tuple((name, e * exp) for name, e in monomial): coef ** exp}
+
+
+def poly_exponent(poly):
+    """Value of a constant polynomial, used as exponent"""
+    if len(poly) == 0 :
+        return 0
+    if list(poly.keys()) != [ONE] :
+        raise NotPolynomial("Non constant exponent")
+    return poly[ONE]
+
+
+def from_sympy(expr):
+    """Transform sympy expression into polynomial. Raises NotPolynomial"""
+    from sympy import Add, Mul, Pow, Symbol, Basic
+
+    if not isinstance(expr, Basic):
+        return poly_const(expr)
+    if isinstance(expr, Symbol):
+        return poly_symbol(expr.name)
+    if expr.is_number :
+        try:
+            return poly_const(float(expr))
+        except TypeError:
+            raise NotPolynomial("Non real number : %s" % expr)
+    if isinstance(expr, Add):
+        return poly_add(*[from_sympy(arg) for arg in expr.args])
+    if isinstance(expr, Mul):
+        return poly_mul(*[from_sympy(arg) for arg in expr.args])
+    if isinstance(expr, Pow) and expr.exp.is_number :
+        return poly_pow(from_sympy(expr.base), float(expr.exp))
+
+    raise NotPolynomial("Unsupported expression : %s" % type(expr).__name__)
+
+
+def source_cost(source):
+    """Rough number of vector operations of a compiled function, from its source code"""
+    return len(re.findall(r"\*\*|[-+*/]", source))
+
+
+def try_polynomial(func, *args):
+    """Return polynomial built by func(*args), or None if not polynomial"""
+    try:
+        return func(*args)
+    except NotPolynomial:
+        return None
+
+
+class PolynomialTable:
+    """
+    Evaluates several polynomials of the same variables at once :
+    [outputs] = [monomials] x [coefs], with [monomials] being the products of powers of variables.
+    Outputs that are not polynomials are listed in 'fallback' : they should be computed by other means.
+    """
+
+    def __init__(self, variables:List[str], monomials:List, coefs:csr_matrix, outputs:List[int], nb_outputs:int):
+        """
+        :param variables: Names of variables
+        :param monomials: List of monomials, as tuples of (variable index, exponent)
+        :param coefs: Sparse matrix of coefficients : one row per monomial, one column per polynomial output
+        :param outputs: Index of each polynomial output, among all outputs
+        :param nb_outputs: Total number of outputs
+        """
+        self.variables = variables
+        self.monomials = monomials
+        self.coefs = coefs
+        self.outputs = outputs
+        self.nb_outputs = nb_outputs
+        self.fallback = [i for i in range(nb_outputs) if not i in set(outputs)]
+
+        # Monomials are computed as a prefix tree : each node is the product of its parent by one factor.
+        # Factors are sorted by frequency, so that common prefixes are computed once
+        freq = Counter(factor for monomial in monomials for factor in monomial)
+        nodes = {ONE: -1}
+        self.steps = []
+        monomial_nodes = []
+        for monomial in monomials:
+            prefix = ONE
+            for factor in sorted(monomial, key=lambda factor: (-freq[factor], factor)):
+                node = prefix + (factor,)
+                if not node in nodes :
+                    nodes[node] = len(self.steps)
+                    self.steps.append((nodes[prefix], factor[0], factor[1]))
+                prefix = node
+            monomial_nodes.append(nodes[prefix])
+
+        # Root node (constant monomial) is the last row
+        monomial_nodes = [node if node >= 0 else len(self.steps) for node in monomial_nodes]
+
+        # Coefficients by node, with one extra node (last one) for the constant monomial : one row per output
+        coefs = coefs.tocoo()
+        self.node_coefs = csr_matrix(
+            (coefs.data, (coefs.col, numpy.array(monomial_nodes, dtype=int)[coefs.row])),
+            shape=(len(outputs), len(self.steps) + 1))
+
+    @classmethod
+    def from_polys(cls, polys:List[Dict], variables:List[str]):
+        """
+        :param polys: List of polynomials, one per output. None for outputs that are not polynomials
+        :param variables: Names of variables, in the order they are passed to evaluate()
+        """
+        var_index = {name: i for i, name in enumerate(variables)}
+        monomials = dict()
+        rows, cols, data = [], [], []
+        outputs = []
+
+        for i, poly in enumerate(polys):
+            if poly is None :
+                continue
+            for monomial, coef in poly.items():
+                key = tuple((var_index[name], exp) for name, exp in monomial)
+                rows.append(monomials.setdefault(key, len(monomials)))
+                cols.append(len(outputs))
+                data.append(coef)
+            outputs.append(i)
+
+        coefs = csr_matrix((data, (rows, cols)), shape=(len(monomials), len(outputs)))
+
+        return cls(variables, list(monomials.keys()), coefs, outputs, len(polys))
+
+    @classmethod
+    def concat(cls, tables:List["PolynomialTable"]):
+        """Single table computing the outputs of several tables, sharing their monomials.
+        All the outputs of the tables should be polynomial"""
+
+        variables = list(dict.fromkeys(var for table in tables for var in table.variables))
+        polys = []
+        for table in tables:
+            if len(table.fallback) > 0 :
+                raise NotPolynomial("Table has non polynomial outputs")
+            polys.extend(table.polys())
+
+        return cls.from_polys(polys, variables)
+
+    def polys(self):
+        """List of polynomials of each output (None for fallback ones)"""
+        res = [None] * self.nb_outputs
+        coefs = self.coefs.tocsc()
+        for j, output in enumerate(self.outputs):
+            col = coefs.getcol(j)
+            res[output] = {
+                tuple((self.variables[var], exp) for var, exp in self.monomials[row]): coef
+                for row, coef in zip(col.indices, col.data)}
+        return res
+
+    def cost(self):
+        """Estimated cost of evaluate(), comparable to source_cost() : a step of the prefix tree (product written in a new row)
+        costs about twice an operation of the compiled function, and each coefficient costs one multiply-add"""
+        return STEP_COST * len(self.steps) + self.coefs.nnz
+
+    def evaluate(self, columns, size):
+        """
+        :param columns: Values of each variable : scalars or arrays of length 'size'
+        :return: 2D array of values : one row per scenario, one column per polynomial output
+        """
+
+        # One row per node of the prefix tree. Last row is the constant monomial
+        nodes = numpy.empty((len(self.steps) + 1, size))
+        nodes[-1] = 1.0
+
+        powers = dict()
+        for i, (parent, var, exp) in enumerate(self.steps):
+            if exp == 1 :
+                x = columns[var]
+            else:
+                if not (var, exp) in powers :
+                    powers[(var, exp)] = numpy.asarray(columns[var], dtype=float) ** exp
+                x = powers[(var, exp)]
+            numpy.multiply(nodes[parent], x, out=nodes[i])
+
+        return (self.node_coefs @ nodes).T
+
+    def __compiled__(self):
+        """Plain data stored in compiled cache"""
+        coefs = self.coefs
+        return dict(
+            variables=self.variables,
+            monomials=self.monomials,
+            coefs=dict(data=coefs.data, indices=coefs.indices, indptr=coefs.indptr, shape=coefs.shape),
+            outputs=self.outputs,
+            nb_outputs=self.nb_outputs)
+
+    @classmethod
+    def from_compiled(cls, data):
+        coefs = data["coefs"]
+        return cls(
+            data["variables"],
+            data["monomials"],
+            csr_matrix((coefs["data"], coefs["indices"], coefs["indptr"]), shape=coefs["shape"]),
+            data["outputs"],
+            data["nb_outputs"])
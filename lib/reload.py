@@ -0,0 +1,172 @@
+"""
+Hot reload of the model, without downtime.
+
+The model file is watched (or a reload is requested through the admin API) : the new model is loaded and compiled
+in a background thread while the current one keeps serving, then swapped in a single assignment.
+Users of the holder read `holder.state` once per request / run : in-flight evaluations finish on the model they started with,
+and always see it with its own version.
+Caches tied to a model (results, fused lambdas, specializations) are dropped with it.
+"""
+from dataclasses import dataclass
+from time import perf_counter, sleep, time
+import hashlib
+import threading
+import os
+
+from lib.common import Model
+from lib.utils import metrics
+
+# Delay between two checks of the model file, in seconds
+POLL_INTERVAL = 2.0
+
+
+def model_version(filename):
+    """Version of a model file : short hash of its content"""
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def _file_stat(filename):
+    """(mtime, size) of a file, or None if missing"""
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+@dataclass(frozen=True)
+class ModelState:
+    """Current model of a holder, with its version. Immutable : replaced as a whole on reload"""
+    model: Model
+    version: str
+    load_time: float
+    loaded_at: float
+
+
+class ModelHolder:
+    """
+    Current model of a server, reloaded in background when its file changes.
+    """
+
+    def __init__(self, filename, runtime=False, warmup=True, on_swap=None):
+        """
+        Load the first model. It is compiled on first use, or in background if warmup is True.
+        :param runtime: If True, free symbolic trees once compiled (see Model.set_runtime())
+        :param on_swap: Optional function called with the new state (ModelState), in the reload thread, once a new model is swapped in.
+            Used to drop caches of the previous model held outside of it
+        """
+        self.filename = filename
+        self.runtime = runtime
+        self.on_swap = on_swap
+
+        # Protects reload state. Reading self.state needs no lock
+        self.lock = threading.Lock()
+        self.reload_thread = None
+        self.watch_thread = None
+        self.error = None
+
+        self.stat = _file_stat(filename)
+        version = model_version(filename)
+        start = perf_counter()
+        model = Model.from_file(filename, warmup=warmup, runtime=runtime)
+        self._swap(model, version, perf_counter() - start)
+
+    @property
+    def model(self):
+        return self.state.model
+
+    @property
+    def version(self):
+        return self.state.version
+
+    def _swap(self, model, version, load_time):
+        # Single assignment : readers of self.state see either the old or the new model with its version, never a mix
+        self.state = ModelState(model, version, load_time, time())
+        self.error = None
+        print("Model %s version %s loaded in %.2f s" % (self.filename, version, load_time))
+
+    def reload(self, force=False):
+        """
+        Load the model file in a background thread, and swap it once compiled.
+        :param force: If False, the model is not reloaded if its version did not change
+        :return: True if a reload was started, False if one is already running or the version is unchanged
+        """
+
+        with self.lock:
+
+            if self.reload_thread is not None and self.reload_thread.is_alive() :
+                return False
+
+            self.stat = _file_stat(self.filename)
+            version = model_version(self.filename)
+            if version == self.version and not force :
+                return False
+
+            self.reload_thread = threading.Thread(target=self._reload, args=(version,), name="model-reload", daemon=True)
+            self.reload_thread.start()
+            return True
+
+    def _reload(self, version):
+        """Run in the reload thread. On failure, the current model keeps serving"""
+
+        print("Reloading model %s : version %s => %s" % (self.filename, self.version, version))
+        start = perf_counter()
+
+        try:
+            # Compiled by the warm up thread, which also saves the compiled cache if needed
+            model = Model.from_file(self.filename, warmup=True, runtime=self.runtime)
+            model.warmup_thread.join()
+            model.compile_all()
+        except Exception as e:
+            print("Failed to reload model %s version %s : %s. Keeping version %s" % (self.filename, version, e, self.version))
+            self.error = "%s : %s" % (type(e).__name__, e)
+            metrics.count("model_reloads_total", status="error")
+            return
+
+        load_time = perf_counter() - start
+        self._swap(model, version, load_time)
+        metrics.count("model_reloads_total", status="ok")
+        metrics.observe("model_reload_seconds", load_time)
+
+        if self.on_swap is not None :
+            try:
+                self.on_swap(self.state)
+            except Exception as e:
+                print("Failed to notify swap of model %s : %s" % (self.filename, e))
+
+    def watch(self, interval=POLL_INTERVAL):
+        """
+        Start a (daemon) thread watching the model file, reloading the model when it changes.
+        The file is reloaded once unchanged for a whole interval, so that it is not read while being written.
+        """
+
+        if self.watch_thread is not None :
+            return
+
+        def run():
+            last_stat = self.stat
+            while True:
+                sleep(interval)
+                stat = _file_stat(self.filename)
+                if stat is not None and stat == last_stat and stat != self.stat :
+                    try:
+                        self.reload()
+                    except Exception as e:
+                        print("Failed to check model %s : %s" % (self.filename, e))
+                        self.stat = stat
+                last_stat = stat
+
+        self.watch_thread = threading.Thread(target=run, name="model-watch", daemon=True)
+        self.watch_thread.start()
+
+    def status(self):
+        """Version and load time of the current model, and state of reload"""
+        state = self.state
+        return dict(
+            filename=self.filename,
+            version=state.version,
+            load_time=state.load_time,
+            loaded_at=state.loaded_at,
+            reloading=self.reload_thread is not None and self.reload_thread.is_alive(),
+            error=self.error)
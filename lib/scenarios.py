@@ -0,0 +1,295 @@
+"""
+Evaluation of large sets of scenarios, read from CSV / Parquet files or generated as grids,
+streamed by chunks to CSV / Parquet files : the memory does not depend on the number of scenarios.
+"""
+from typing import Dict, List
+from itertools import product, tee, islice
+from math import prod
+from time import perf_counter
+import json
+import numpy
+import pyarrow
+import pyarrow.csv
+import pyarrow.parquet
+
+from lib.common import Model, ModelError, ParamType
+from lib.sensitivity import sampler, scale_samples, SAMPLING_METHODS
+
+FORMATS = ["parquet", "csv"]
+
+# Default number of scenarios evaluated at once
+CHUNK_SIZE = 10000
+
+# Min delay between two progress reports, in seconds
+PROGRESS_INTERVAL = 2.0
+
+
+def file_format(filename):
+    """Format of a file, from its extension"""
+    for format in FORMATS:
+        if filename.lower().endswith("." + format):
+            return format
+    raise ModelError("Unknown format of '%s'. Expected one of the extensions %s" % (filename, FORMATS))
+
+
+def read_scenarios(model:Model, filename, chunk_size=CHUNK_SIZE):
+    """
+    Read scenarios from a CSV or Parquet file, by chunks. Columns named after params are param values,
+    others are passed through to the results (ids of scenarios for instance). Missing params take their default values.
+    :return: <Number of scenarios, or None if unknown (CSV)>, <Generator of chunks : (dict of column => array, number of scenarios)>
+    """
+
+    if file_format(filename) == "parquet" :
+        file = pyarrow.parquet.ParquetFile(filename)
+        return file.metadata.num_rows, _batch_values(model, file.iter_batches(batch_size=chunk_size), chunk_size)
+
+    # Enum values are read as strings, even if they look like numbers
+    convert_options = pyarrow.csv.ConvertOptions(column_types={
+        param.name: pyarrow.string() for param in model.params.values() if param.type == ParamType.ENUM})
+
+    return None, _batch_values(model, pyarrow.csv.open_csv(filename, convert_options=convert_options), chunk_size)
+
+
+def _batch_values(model:Model, batches, chunk_size):
+    """Transform record batches into chunks : (dict of column => numpy array, number of rows), of at most chunk_size rows"""
+
+    for batch in batches:
+        for start in range(0, batch.num_rows, chunk_size):
+            chunk = batch.slice(start, chunk_size)
+            values = dict()
+            for name, column in zip(chunk.schema.names, chunk.columns):
+                if pyarrow.types.is_dictionary(column.type):
+                    column = column.cast(column.type.value_type)
+                values[name] = column.to_numpy(zero_copy_only=False)
+                if name in model.params and model.params[name].type != ParamType.ENUM :
+                    values[name] = values[name].astype(float)
+            yield values, chunk.num_rows
+
+
+def grid_scenarios(
+        model:Model,
+        grid_params:List[str]=None,
+        sampled_params:List[str]=None,
+        samples=0,
+        method="random",
+        seed=0,
+        chunk_size=CHUNK_SIZE):
+    """
+    Full factorial grid over enum and bool params, crossed with samples of float params over their ranges (uniform).
+    Each sample of float params is evaluated for all combinations of the grid. Other params take their default values.
+    :param grid_params: Enum and bool params of the grid. All by default
+    :param sampled_params: Float params to sample. All by default
+    :param samples: Number of samples of float params. If 0, they take their default values
+    :param method: Sampling method. See lib.sensitivity.SAMPLING_METHODS
+    :return: <Number of scenarios>, <Generator of chunks : (dict of param name => array, number of scenarios)>.
+        Without grid nor sampled params, chunks have no column
+    """
+
+    if grid_params is None :
+        grid_params = [param.name for param in model.params.values() if param.type != ParamType.FLOAT]
+    if sampled_params is None :
+        sampled_params = [param.name for param in model.params.values() if param.type == ParamType.FLOAT] if samples > 0 else []
+
+    for name in grid_params + sampled_params:
+        if not name in model.params :
+            raise ModelError("Unknown param '%s'" % name)
+
+    for name in grid_params :
+        if model.params[name].type == ParamType.FLOAT :
+            raise ModelError("Param '%s' of the grid should be an enum or a bool. Float params are sampled" % name)
+
+    grid_values = [
+        model.params[name].values if model.params[name].type == ParamType.ENUM else [0.0, 1.0]
+        for name in grid_params]
+    nb_combinations = prod(len(values) for values in grid_values)
+
+    nb_samples = max(samples, 1)
+    sampled = [model.params[name] for name in sampled_params]
+
+    def generate():
+
+        sample = sampler(method, len(sampled), seed) if samples > 0 else None
+
+        # Scenarios in order : (sample index, combination), each sample with all combinations of the grid.
+        # Combinations are enumerated lazily : a chunk never holds more than chunk_size scenarios
+        scenarios = ((index, combination) for index in range(nb_samples) for combination in product(*grid_values))
+
+        # Uniform samples drawn so far and still used, starting at sample index 'first'
+        drawn = numpy.empty((0, len(sampled)))
+        first = 0
+
+        while True:
+            chunk = list(islice(scenarios, chunk_size))
+            if not chunk :
+                return
+
+            indices = numpy.array([index for index, _ in chunk])
+            values = {
+                name: numpy.array(column)
+                for name, column in zip(grid_params, zip(*(combination for _, combination in chunk)))}
+
+            if sample is not None :
+                # Draw the samples of this chunk, and drop the ones of previous chunks
+                end = indices[-1] + 1
+                if end > first + len(drawn) :
+                    drawn = numpy.concatenate([drawn, sample(end - first - len(drawn))])
+                drawn = drawn[indices[0] - first:]
+                first = indices[0]
+                values.update(scale_samples(sampled, drawn[indices - first]))
+
+            yield values, len(chunk)
+
+    return nb_samples * nb_combinations, generate()
+
+
+def result_columns(model:Model, impacts:List[str]=None, functional_units:List[str]=None, axes:List[str]=None):
+    """
+    Columns of results
+    :return: Dict of column name => (impact, functional unit, axis, axis key). Axis key is None for 'total'.
+        Column names are '<impact>/<functional unit>/<axis>[/<axis key>]'
+    """
+
+    res = dict()
+    for impact in impacts or model.impacts:
+        for functional_unit in functional_units or model.functional_units:
+            for axis in axes or model.expressions:
+                lambd = model._get_lambda(impact, axis)
+                model._unit(impact, functional_unit)
+                for key in lambd.keys or [None]:
+                    name = "/".join([impact, functional_unit, axis] + ([key] if key is not None else []))
+                    res[name] = (impact, functional_unit, axis, key)
+    return res
+
+
+def evaluate_chunk(model:Model, values:Dict, size, columns:Dict, validate=False):
+    """
+    Evaluate a chunk of scenarios : each expression and functional unit is evaluated once.
+    :param values: Dict of param name => array of values. Missing params take their default values
+    :param size: Number of scenarios
+    :param columns: Result columns, as returned by result_columns()
+    :param validate: If True, validate param values first
+    :return: Dict of column name => array of values
+    """
+
+    if validate :
+        model.validate_params(values)
+
+    fu_vals = dict()
+    impacts = dict()
+    res = dict()
+    for name, (impact, functional_unit, axis, key) in columns.items():
+
+        if not functional_unit in fu_vals :
+            fu_vals[functional_unit] = model.functional_units[functional_unit].quantity.evaluate_batch(model.params, values, size)
+
+        if not (impact, axis) in impacts :
+            impacts[(impact, axis)] = model.expressions[axis][impact].evaluate_batch(model.params, values, size)
+
+        val = impacts[(impact, axis)]
+        res[name] = (val if key is None else val[key]) / fu_vals[functional_unit]
+
+    return res
+
+
+class ResultWriter:
+    """Writes chunks of results to a CSV or Parquet file, with the schema of the first chunk"""
+
+    def __init__(self, filename, units:Dict=None):
+        """
+        :param units: Dict of column => unit, saved in the metadata of Parquet files
+        """
+        self.filename = filename
+        self.format = file_format(filename)
+        self.metadata = {"units": json.dumps(units)} if units else None
+        self.writer = None
+        self.schema = None
+
+    def write(self, columns:Dict):
+
+        table = pyarrow.table(columns)
+
+        if self.writer is None :
+            if self.format == "parquet" :
+                table = table.replace_schema_metadata(self.metadata)
+                self.writer = pyarrow.parquet.ParquetWriter(self.filename, table.schema)
+            else:
+                self.writer = pyarrow.csv.CSVWriter(self.filename, table.schema)
+            self.schema = table.schema
+
+        self.writer.write_table(table.cast(self.schema))
+
+    def close(self):
+        if self.writer is not None :
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def evaluate_scenarios(
+        model:Model,
+        scenarios,
+        output,
+        impacts:List[str]=None,
+        functional_units:List[str]=None,
+        axes:List[str]=None,
+        total=None,
+        include_params=True,
+        evaluator=None):
+    """
+    Evaluate chunks of scenarios and stream results to a file.
+    :param scenarios: Iterable of chunks : (dict of column => array, number of scenarios).
+        Columns not being params are copied to the results
+    :param output: Output file (.csv or .parquet)
+    :param impacts: Impacts to evaluate. All by default
+    :param functional_units: Functional units. All by default
+    :param axes: Axes. All by default
+    :param total: Number of scenarios, if known : used for progress report
+    :param include_params: If True, param values are copied to the results, before the results
+    :param evaluator: Optional lib.parallel.ParallelEvaluator, evaluating chunks in worker processes
+    :return: Number of scenarios evaluated
+    """
+
+    columns = result_columns(model, impacts, functional_units, axes)
+    units = {name: model._unit(impact, functional_unit) for name, (impact, functional_unit, _, _) in columns.items()}
+
+    start = last_report = perf_counter()
+    count = 0
+
+    def report():
+        elapsed = perf_counter() - start
+        print("%d%s scenarios evaluated in %.1f s (%.0f scenarios/s)" % (
+            count,
+            " / %d" % total if total is not None else "",
+            elapsed,
+            count / elapsed if elapsed > 0 else 0))
+
+    # Inputs are kept until their results are written
+    scenarios, inputs = tee(scenarios)
+    chunks = (
+        ({name: val for name, val in values.items() if name in model.params}, size)
+        for values, size in scenarios)
+
+    if evaluator is None :
+        results = (evaluate_chunk(model, params, size, columns, validate=True) for params, size in chunks)
+    else:
+        results = evaluator.evaluate_chunks(chunks, columns)
+
+    with ResultWriter(output, units) as writer :
+
+        for (values, size), chunk_results in zip(inputs, results):
+
+            res = {name: val for name, val in values.items() if include_params or not name in model.params}
+            res.update(chunk_results)
+            writer.write(res)
+
+            count += size
+            if perf_counter() - last_report > PROGRESS_INTERVAL :
+                report()
+                last_report = perf_counter()
+
+    report()
+    return count
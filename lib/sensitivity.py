@@ -0,0 +1,296 @@
+from typing import Dict, List
+import numpy
+from scipy.stats import qmc
+
+from lib.common import Model, Param, ParamType
+
+SAMPLING_METHODS = ["sobol", "lhs", "random"]
+
+DEFAULT_PERCENTILES = [5, 50, 95]
+
+
+def sampler(method, dim, seed):
+    """Return a function generating n uniform samples in [0, 1[^dim"""
+
+    if method == "sobol" :
+        engine = qmc.Sobol(d=dim, scramble=True, seed=seed)
+    elif method == "lhs" :
+        engine = qmc.LatinHypercube(d=dim, seed=seed)
+    elif method == "random" :
+        rng = numpy.random.default_rng(seed)
+        return lambda n : rng.random((n, dim))
+    else:
+        raise Exception("Wrong sampling method '%s'. Expected one of %s" % (method, SAMPLING_METHODS))
+
+    return engine.random
+
+
+def scale_samples(params:List[Param], samples):
+    """
+    Transform uniform samples into param values, within their ranges.
+    :param params: List of params, one per column of samples
+    :param samples: 2D array of uniform samples in [0, 1[
+    :return: Dict of param name => array of values. Enum values are given as indices
+    """
+    res = dict()
+    for i, param in enumerate(params):
+        u = samples[:, i]
+        if param.type == ParamType.FLOAT :
+            res[param.name] = param.min + u * (param.max - param.min)
+        elif param.type == ParamType.BOOLEAN :
+            res[param.name] = (u >= 0.5).astype(float)
+        else:
+            nb_values = len(param.values)
+            res[param.name] = numpy.minimum(numpy.floor(u * nb_values), nb_values - 1)
+    return res
+
+
+def varying_params(model:Model, groups:List[str]=None, fixed_values:Dict=None):
+    """List of params to sample : all params of the selected groups (all by default), except the fixed ones"""
+    fixed_values = fixed_values or dict()
+    return [
+        param for param in model.params.values()
+        if (groups is None or param.group in groups) and not param.name in fixed_values]
+
+
+class _Outputs:
+    """Evaluates the total impact of every impact / functional unit, sharing the evaluation of each expression"""
+
+    def __init__(self, model:Model, impacts=None, functional_units=None):
+        self.model = model
+        self.impacts = impacts or list(model.impacts.keys())
+        self.functional_units = functional_units or list(model.functional_units.keys())
+        self.keys = [(impact, fu) for impact in self.impacts for fu in self.functional_units]
+
+        # Single polynomial table for all impacts, if they are all polynomial
+        self.table = model.polynomial_table(self.impacts)
+
+    def _impacts(self, values, size):
+        """Dict of impact => array of total values"""
+
+        model = self.model
+        if self.table is None :
+            return {
+                impact: model.expressions["total"][impact].evaluate_batch(model.params, values, size)
+                for impact in self.impacts}
+
+        expanded_values = dict()
+        for param in model.params.values():
+            val = values[param.name] if param.name in values else param.default
+            expanded_values.update(param.expand_array_values(val))
+
+        res = self.table.evaluate([expanded_values[name] for name in self.table.variables], size)
+        return {impact: res[:, i] for i, impact in enumerate(self.impacts)}
+
+    def evaluate(self, values, size):
+        """Return 2D array of outputs : one row per scenario, one column per (impact, functional unit)"""
+
+        model = self.model
+        fu_vals = {
+            fu: model.functional_units[fu].quantity.evaluate_batch(model.params, values, size)
+            for fu in self.functional_units}
+
+        impacts = self._impacts(values, size)
+
+        res = numpy.empty((size, len(self.keys)))
+        i = 0
+        for impact in self.impacts:
+            for fu in self.functional_units :
+                res[:, i] = impacts[impact] / fu_vals[fu]
+                i += 1
+        return res
+
+
+class _Reservoir:
+    """Uniform reservoir sampling of output rows, used to compute percentiles with bounded memory"""
+
+    def __init__(self, size, nb_cols, seed):
+        self.data = numpy.empty((size, nb_cols))
+        self.size = size
+        self.count = 0
+        self.rng = numpy.random.default_rng(seed)
+
+    def add(self, rows):
+
+        # Fill the reservoir first
+        nb_fill = min(len(rows), self.size - self.count)
+        if nb_fill > 0 :
+            self.data[self.count:self.count + nb_fill] = rows[:nb_fill]
+
+        # Then replace random elements : row number t is kept with probability size / (t+1)
+        rest = rows[nb_fill:]
+        if len(rest) > 0 :
+            t = numpy.arange(self.count + nb_fill, self.count + len(rows))
+            j = (self.rng.random(len(rest)) * (t + 1)).astype(int)
+            keep = j < self.size
+            self.data[j[keep]] = rest[keep]
+
+        self.count += len(rows)
+
+    def values(self):
+        return self.data[:min(self.count, self.size)]
+
+
+class _Moments:
+    """Streaming mean / variance, shifted for numerical stability"""
+
+    def __init__(self):
+        self.n = 0
+        self.shift = None
+        self.sum = 0.0
+        self.sum2 = 0.0
+
+    def add(self, vals):
+        if self.shift is None :
+            self.shift = vals.mean(axis=0)
+        centered = vals - self.shift
+        self.n += len(vals)
+        self.sum += centered.sum(axis=0)
+        self.sum2 += (centered ** 2).sum(axis=0)
+
+    def mean(self):
+        return self.shift + self.sum / self.n
+
+    def var(self):
+        return (self.sum2 - self.sum ** 2 / self.n) / (self.n - 1)
+
+
+def _chunks(n, chunk_size):
+    for start in range(0, n, chunk_size):
+        yield min(chunk_size, n - start)
+
+
+def _summary(outputs, moments, reservoir, percentiles):
+    """Dict of impact => functional unit => {mean, std, percentiles}"""
+
+    mean = moments.mean()
+    std = numpy.sqrt(moments.var())
+    pct = numpy.percentile(reservoir.values(), percentiles, axis=0)
+
+    res = dict()
+    for i, (impact, fu) in enumerate(outputs.keys) :
+        res.setdefault(impact, dict())[fu] = dict(
+            mean=float(mean[i]),
+            std=float(std[i]),
+            percentiles={p: float(pct[j, i]) for j, p in enumerate(percentiles)})
+    return res
+
+
+def uncertainty(
+        model:Model,
+        n=4096,
+        impacts:List[str]=None,
+        functional_units:List[str]=None,
+        groups:List[str]=None,
+        fixed_values:Dict=None,
+        method="sobol",
+        seed=0,
+        chunk_size=4096,
+        percentiles=DEFAULT_PERCENTILES,
+        max_reservoir=100000):
+    """
+    Monte Carlo propagation of the uncertainty of params over their ranges (uniform distributions), on total impacts.
+
+    :param n: Number of samples
+    :param impacts: List of impacts (all by default)
+    :param functional_units: List of functional units (all by default)
+    :param groups: Only vary params of these groups (all by default). Others take their default value
+    :param fixed_values: Dict of param values, not sampled
+    :param method: Sampling method : "sobol", "lhs" or "random"
+    :param seed: Seed of random generator
+    :param chunk_size: Number of samples evaluated at once. Bounds the memory usage
+    :param percentiles: List of percentiles to compute
+    :param max_reservoir: Max number of samples kept to compute the percentiles
+    :return: Dict of impact => functional unit => {mean, std, percentiles => {percentile => value}}
+    """
+
+    fixed_values = fixed_values or dict()
+    params = varying_params(model, groups, fixed_values)
+    outputs = _Outputs(model, impacts, functional_units)
+
+    sample = sampler(method, len(params), seed)
+    moments = _Moments()
+    reservoir = _Reservoir(min(n, max_reservoir), len(outputs.keys), seed)
+
+    for size in _chunks(n, chunk_size):
+        values = dict(fixed_values, **scale_samples(params, sample(size)))
+        res = outputs.evaluate(values, size)
+        moments.add(res)
+        reservoir.add(res)
+
+    return _summary(outputs, moments, reservoir, percentiles)
+
+
+def sobol_indices(
+        model:Model,
+        n=1024,
+        impacts:List[str]=None,
+        functional_units:List[str]=None,
+        groups:List[str]=None,
+        fixed_values:Dict=None,
+        method="sobol",
+        seed=0,
+        chunk_size=1024,
+        percentiles=DEFAULT_PERCENTILES,
+        max_reservoir=100000):
+    """
+    Global sensitivity analysis : computes first order and total Sobol indices of each param on total impacts.
+
+    Uses the Saltelli scheme : two independent sample matrices A and B of n samples,
+    and for each param i, the matrix AB_i (A with column i taken from B). This requires n x (nb_params + 2) evaluations.
+    First order indices use the estimator of Saltelli (2010), total indices the one of Jansen (1999).
+    Samples are processed by chunks, with streaming accumulators, so that the memory does not depend on n.
+
+    :param n: Number of base samples
+    :return: Dict of impact => functional unit => {mean, std, percentiles, S1, ST}, S1 and ST being dicts of param => index
+    """
+
+    fixed_values = fixed_values or dict()
+    params = varying_params(model, groups, fixed_values)
+    outputs = _Outputs(model, impacts, functional_units)
+    nb_params = len(params)
+    nb_outputs = len(outputs.keys)
+
+    # Sample A and B from the same sequence of dimension 2 x nb_params
+    sample = sampler(method, 2 * nb_params, seed)
+    moments = _Moments()
+    reservoir = _Reservoir(min(2 * n, max_reservoir), nb_outputs, seed)
+
+    sum_first = numpy.zeros((nb_params, nb_outputs))
+    sum_total = numpy.zeros((nb_params, nb_outputs))
+
+    for size in _chunks(n, chunk_size):
+
+        samples = sample(size)
+        values_a = dict(fixed_values, **scale_samples(params, samples[:, :nb_params]))
+        values_b = dict(fixed_values, **scale_samples(params, samples[:, nb_params:]))
+
+        f_a = outputs.evaluate(values_a, size)
+        f_b = outputs.evaluate(values_b, size)
+
+        for f in (f_a, f_b):
+            moments.add(f)
+            reservoir.add(f)
+
+        for i, param in enumerate(params):
+            values_ab = dict(values_a)
+            values_ab[param.name] = values_b[param.name]
+            f_ab = outputs.evaluate(values_ab, size)
+
+            sum_first[i] += (f_b * (f_ab - f_a)).sum(axis=0)
+            sum_total[i] += ((f_a - f_ab) ** 2).sum(axis=0)
+
+    var = moments.var()
+
+    # Constant outputs have no variance : indices are zero
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        first = numpy.nan_to_num(sum_first / n / var)
+        total = numpy.nan_to_num(sum_total / (2 * n) / var)
+
+    res = _summary(outputs, moments, reservoir, percentiles)
+
+    for j, (impact, fu) in enumerate(outputs.keys):
+        res[impact][fu]["S1"] = {param.name: float(first[i, j]) for i, param in enumerate(params)}
+        res[impact][fu]["ST"] = {param.name: float(total[i, j]) for i, param in enumerate(params)}
+
+    return res
@@ -6,6 +6,9 @@ from pydantic.dataclasses import dataclass
 import json
 
 OUTFILE = "data/model.json"
+BINFILE = "data/model.bin"
+EXPORT_CACHE_DIR = "data/.export_cache"
+BENCHMARK_FILE = "data/benchmarks.json"
 SETTINGS_FILE = "settings.yaml"
 
 @dataclass
@@ -1,8 +1,154 @@
 from time import perf_counter
 from contextlib import contextmanager
+from bisect import bisect_left
+import threading
+import os
+
+# Upper bounds of latency histograms, in seconds
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Prefix of exported metrics
+METRICS_PREFIX = "lca_"
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels_key(labels):
+    """Labels as a sorted tuple of (name, value). Values are strings, None being the empty string (same as missing label)"""
+    return tuple(sorted((key, "" if val is None else str(val)) for key, val in labels.items()))
+
+
+def _escape_label(val):
+    """Value of label in Prometheus text format : backslash, double quote and line feed are escaped"""
+    return str(val).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """
+    Registry of counters and histograms, indexed by name and labels.
+    When disabled, recording functions return immediately.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters = dict()
+        self.histograms = dict()
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled :
+            return
+        key = (name, _labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled :
+            return
+        key = (name, _labels_key(labels))
+        with self.lock:
+            if not key in self.histograms :
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def to_prometheus(self, extra_counters=None, gauges=None):
+        """
+        Export metrics in Prometheus text format
+        :param extra_counters: Optional list of (name, labels dict, value), computed outside of the registry
+        :param gauges: Optional list of (name, labels dict, value) of gauges, computed outside of the registry
+        """
+
+        def labels_str(labels, extra=None):
+            labels = list(labels) + (extra or [])
+            if len(labels) == 0 :
+                return ""
+            return "{%s}" % ",".join('%s="%s"' % (key, _escape_label(val)) for key, val in labels)
+
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+
+        counters += [((name, _labels_key(labels)), value) for name, labels, value in (extra_counters or [])]
+        gauges = [((name, _labels_key(labels)), value) for name, labels, value in (gauges or [])]
+
+        typed = set()
+        for metric_type, values in [("counter", counters), ("gauge", gauges)]:
+            for (name, labels), value in values:
+                name = METRICS_PREFIX + name
+                if not name in typed :
+                    lines.append("# TYPE %s %s" % (name, metric_type))
+                    typed.add(name)
+                lines.append("%s%s %s" % (name, labels_str(labels), value))
+
+        for (name, labels), histogram in histograms:
+            name = METRICS_PREFIX + name
+            if not name in typed :
+                lines.append("# TYPE %s histogram" % name)
+                typed.add(name)
+            cumulated = 0
+            for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+                cumulated += count
+                lines.append("%s_bucket%s %d" % (name, labels_str(labels, [("le", bound)]), cumulated))
+            lines.append("%s_sum%s %s" % (name, labels_str(labels), histogram.sum))
+            lines.append("%s_count%s %d" % (name, labels_str(labels), histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+
+# Global registry. Enabled with environment variable METRICS=1
+metrics = Metrics(enabled=os.environ.get("METRICS", "0") not in ("", "0"))
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+    def __exit__(self, type, value, traceback):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        metrics.observe(self.name + "_seconds", perf_counter() - self.start, **self.labels)
+
+
+def span(name, **labels):
+    """Context manager recording the duration of a block in histogram <name>_seconds. No op when metrics are disabled"""
+    if not metrics.enabled :
+        return _NULL_SPAN
+    return _Span(name, labels)
 
 
 class timer:
+    """Print duration of a block. Also recorded in histogram timer_seconds, with label "block", when metrics are enabled"""
 
     def __init__(self, name=""):
         self.name = name
@@ -14,4 +160,5 @@ class timer:
     def __exit__(self, type, value, traceback):
         self.time = perf_counter() - self.time
         self.readout = f'[{self.name}] Time: {self.time:.3f} seconds'
-        print(self.readout)
\ No newline at end of file
+        print(self.readout)
+        metrics.observe("timer_seconds", self.time, block=self.name)
@@ -0,0 +1,132 @@
+"""
+JSON API : answers of /api/evaluate, /api/bounds, /api/model and /api/health, and errors returned on invalid requests
+"""
+import json
+import numpy
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from lib import api
+from lib.reload import ModelHolder
+from lib.settings import OUTFILE
+
+
+class ApiTest(AsyncHTTPTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.holder = ModelHolder(OUTFILE, warmup=False)
+        model = cls.holder.model
+        cls.impact = next(iter(model.impacts))
+        cls.functional_unit = next(iter(model.functional_units))
+        cls.param = next(param for param in model.params.values() if param.type == "float" and param.min < param.max)
+
+    def get_app(self):
+        # XSRF cookies are enabled on the whole app by Streamlit : the API should not require them
+        kwargs = dict(holder=self.holder)
+        return Application([
+            ("/api/health", api.HealthHandler, kwargs),
+            ("/api/model", api.ModelHandler, kwargs),
+            ("/api/evaluate", api.EvaluateHandler, kwargs),
+            ("/api/bounds", api.BoundsHandler, kwargs)],
+            xsrf_cookies=True)
+
+    def get(self, path):
+        response = self.fetch(path, raise_error=False)
+        return response.code, json.loads(response.body)
+
+    def post(self, path, body):
+        response = self.fetch(path, method="POST", body=body if isinstance(body, str) else json.dumps(body), raise_error=False)
+        return response.code, json.loads(response.body)
+
+    def request(self, **kwargs):
+        return dict(dict(impact=self.impact, functional_unit=self.functional_unit), **kwargs)
+
+    def test_evaluate(self):
+        model = self.holder.model
+        params = {self.param.name: self.param.max}
+
+        code, res = self.post("/api/evaluate", self.request(params=params))
+        self.assertEqual(code, 200)
+        expected, unit = model.evaluate_all(self.impact, self.functional_unit, **params)
+        self.assertEqual(res["unit"], unit)
+        self.assertAlmostEqual(res["values"]["total"], expected["total"], delta=1e-9 * abs(expected["total"]))
+
+        # Batch of scenarios
+        code, res = self.post("/api/evaluate", self.request(params=[params, dict()]))
+        self.assertEqual(code, 200)
+        self.assertEqual(len(res["values"]), 2)
+        self.assertAlmostEqual(res["values"][0], expected["total"], delta=1e-9 * abs(expected["total"]))
+
+    def test_bad_params(self):
+        for params in [
+                {"unknown_param": 1},
+                {self.param.name: self.param.max + 1},
+                {self.param.name: [1, 2]},
+                {self.param.name: {"a": 1}},
+                [{self.param.name: [1, 2]}],
+                [1, 2],
+                [],
+                "params"]:
+            code, res = self.post("/api/evaluate", self.request(params=params))
+            self.assertEqual(code, 400, params)
+            self.assertIn("error", res)
+
+        for body in ["{", "[]", json.dumps(dict(impact=self.impact))]:
+            code, res = self.post("/api/evaluate", body)
+            self.assertEqual(code, 400, body)
+
+    def test_unknown_impact_or_functional_unit(self):
+        for path in ["/api/evaluate", "/api/bounds"]:
+            for request in [
+                    self.request(impact="unknown_impact"),
+                    self.request(functional_unit="unknown_functional_unit"),
+                    self.request(impact="unknown_impact", axis="total"),
+                    self.request(axis="unknown_axis")]:
+                code, res = self.post(path, request)
+                self.assertEqual(code, 400, (path, request))
+                self.assertIn("error", res)
+
+    def test_backpressure(self):
+        api.BaseHandler.pending = api.API_MAX_PENDING
+        try:
+            response = self.fetch("/api/evaluate", method="POST", body=json.dumps(self.request()), raise_error=False)
+        finally:
+            api.BaseHandler.pending = 0
+
+        self.assertEqual(response.code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+        # Accepted again once pending evaluations are done
+        code, res = self.post("/api/evaluate", self.request())
+        self.assertEqual(code, 200)
+
+    def test_model(self):
+        model = self.holder.model
+        code, res = self.get("/api/model")
+        self.assertEqual(code, 200)
+        self.assertEqual(set(res["params"]), set(model.params))
+        self.assertEqual(set(res["impacts"]), set(model.impacts))
+        self.assertEqual(set(res["functional_units"]), set(model.functional_units))
+        self.assertEqual(set(res["axes"]), set(model.expressions))
+        self.assertIsNone(res["axes"]["total"])
+
+    def test_health(self):
+        code, res = self.get("/api/health")
+        self.assertEqual(code, 200)
+        self.assertEqual(res["status"], "ok")
+        self.assertEqual(res["pending"], 0)
+        self.assertEqual(res["max_pending"], api.API_MAX_PENDING)
+        self.assertEqual(res["model"]["version"], self.holder.version)
+
+
+def test_to_json():
+    # Non finite values are null, including numpy ones : JSON has no Infinity nor NaN
+    res = api._to_json(dict(
+        a=numpy.float64("inf"),
+        b=numpy.array([1.0, numpy.nan]),
+        c=[numpy.float32(2.5), -numpy.inf],
+        d=numpy.int64(3)))
+
+    assert res == dict(a=None, b=[1.0, None], c=[2.5, None], d=3)
+    json.dumps(res, allow_nan=False)
@@ -0,0 +1,59 @@
+"""
+Batch evaluation of N scenarios at once, against single evaluation of each of them
+"""
+import numpy
+import pytest
+
+from lib.common import Model, ModelError
+from lib.settings import OUTFILE
+from tests.utils import random_scenarios, batch_values, assert_close, impacts_axes
+
+
+@pytest.fixture(scope="module")
+def model():
+    return Model.from_file(OUTFILE)
+
+
+@pytest.fixture(scope="module")
+def scenarios(model):
+    return random_scenarios(model)
+
+
+def test_evaluate_batch(model, scenarios):
+    values = batch_values(scenarios)
+    for functional_unit in model.functional_units:
+        for impact, axis in impacts_axes(model):
+            batch, unit = model.evaluate_batch(impact, functional_unit, axis, values)
+            for i, scenario in enumerate(scenarios):
+                expected, expected_unit = model.evaluate(impact, functional_unit, axis, **scenario)
+                actual = {key: val[i] for key, val in batch.items()} if isinstance(batch, dict) else batch[i]
+                assert_close(expected, actual)
+                assert unit == expected_unit
+
+
+def test_default_values(model, scenarios):
+    impact = next(iter(model.impacts))
+
+    # Missing params take their default values : a single scenario without any param
+    batch, _ = model.evaluate_batch(impact, "system", "total", dict())
+    assert len(batch) == 1
+    assert_close(model.evaluate(impact, "system")[0], batch[0])
+
+    # Scenarios of a few params only
+    names = [name for name, param in model.params.items() if param.type == "float"][:3]
+    values = {name: batch_values(scenarios)[name] for name in names}
+    batch, _ = model.evaluate_batch(impact, "system", "total", values)
+    for i, scenario in enumerate(scenarios):
+        assert_close(model.evaluate(impact, "system", **{name: scenario[name] for name in names})[0], batch[i])
+
+
+def test_invalid_values(model):
+    impact = next(iter(model.impacts))
+    name = next(name for name, param in model.params.items() if param.type == "float")
+
+    with pytest.raises(ModelError):
+        model.evaluate_batch(impact, "system", "total", {"unknown_param": numpy.zeros(3)})
+    with pytest.raises(ModelError):
+        model.evaluate_batch(impact, "system", "total", {name: numpy.zeros(3), "mix_pertes": numpy.array(["mixfrancais"] * 2)})
+    with pytest.raises(ModelError):
+        model.evaluate_batch(impact, "system", "total", numpy.zeros((3, 2)))
@@ -0,0 +1,74 @@
+"""
+Binary format of the model, against the JSON model : evaluation, and conversion back to JSON
+"""
+import pytest
+
+from lib.common import Model, Param
+from lib.binary import save_binary, load_binary, binary_to_json
+from lib.settings import OUTFILE
+from tests.utils import random_scenarios, batch_values, assert_close
+
+
+@pytest.fixture(scope="module")
+def model():
+    return Model.from_file(OUTFILE)
+
+
+@pytest.fixture(scope="module")
+def scenarios(model):
+    return random_scenarios(model)
+
+
+@pytest.fixture(scope="module")
+def filename(model, tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp("binary") / "model.bin")
+    save_binary(model, filename)
+    return filename
+
+
+def test_binary(model, scenarios, filename):
+    binary = load_binary(filename)
+
+    for functional_unit in model.functional_units:
+        for impact in model.impacts:
+            for scenario in scenarios:
+                assert_close(
+                    model.evaluate_all(impact, functional_unit, **scenario)[0],
+                    binary.evaluate_all(impact, functional_unit, **scenario)[0])
+
+
+def test_batch(model, scenarios, filename):
+    binary = load_binary(filename)
+    values = batch_values(scenarios)
+    impact = next(iter(model.impacts))
+
+    for axis in model.expressions:
+        assert_close(
+            model.evaluate_batch(impact, "system", axis, values)[0],
+            binary.evaluate_batch(impact, "system", axis, values)[0])
+
+
+def test_to_json(model, scenarios, filename, tmp_path):
+    json_file = str(tmp_path / "model.json")
+    binary_to_json(filename, json_file)
+    converted = Model.from_file(json_file, cache=False)
+
+    # Same params, and same values
+    assert list(converted.params) == list(model.params)
+    for name, param in model.params.items():
+        for field in Param.__slots__:
+            assert getattr(converted.params[name], field, None) == getattr(param, field, None), (name, field)
+
+    impact = next(iter(model.impacts))
+    for scenario in scenarios:
+        assert_close(
+            model.evaluate_all(impact, "system", **scenario)[0],
+            converted.evaluate_all(impact, "system", **scenario)[0])
+
+
+def test_not_binary(tmp_path):
+    filename = str(tmp_path / "model.bin")
+    with open(filename, "wb") as f:
+        f.write(b"NOTMODEL" + bytes(64))
+    with pytest.raises(Exception, match="not a binary model file"):
+        load_binary(filename)
@@ -0,0 +1,58 @@
+"""
+Guaranteed bounds of impacts, against evaluation on random scenarios and on corners of the box of params
+"""
+import pytest
+
+from lib.common import Model, ModelError
+from lib.settings import OUTFILE
+from tests.utils import RTOL, random_scenarios, assert_close, impacts_axes, small_model
+
+
+@pytest.fixture(scope="module")
+def model():
+    return Model.from_file(OUTFILE)
+
+
+@pytest.fixture(scope="module")
+def scenarios(model):
+    return random_scenarios(model)
+
+
+def test_bounds(model, scenarios):
+    for functional_unit in model.functional_units:
+        for impact, axis in impacts_axes(model):
+            bounds, _ = model.bounds(impact, functional_unit, axis)
+            for scenario in scenarios:
+                val, _ = model.evaluate(impact, functional_unit, axis, **scenario)
+                vals = val if isinstance(val, dict) else {None: val}
+                intervals = bounds if isinstance(val, dict) else {None: bounds}
+                for key, val in vals.items():
+                    lower, upper = intervals[key]
+                    margin = RTOL * max(abs(lower), abs(upper))
+                    assert lower - margin <= val <= upper + margin, (impact, axis, key)
+
+
+def test_bounds_all(model):
+    impact = next(iter(model.impacts))
+    bounds, unit = model.bounds_all(impact, "system")
+    assert list(bounds) == list(model.expressions)
+    for axis in model.expressions:
+        assert bounds[axis] == model.bounds(impact, "system", axis)[0]
+    assert unit == model.bounds(impact, "system")[1]
+
+    with pytest.raises(ModelError):
+        model.bounds_all("unknown_impact", "system")
+    with pytest.raises(ModelError):
+        model.bounds(impact, "system", unknown_param=1.0)
+
+
+def test_monotonic():
+    # Monotonic in b and c, then in a : bounds are exact, up to the rounding margin
+    model = small_model(dict(impact="a*b - c + 1/a"), dict(a=(1, 3), b=(0, 2), c=(0, 1)))
+    lower, upper = model.bounds("impact", "system")[0]
+    assert_close((-2 / 3, 19 / 3), (lower, upper), rtol=1e-8)
+    assert lower <= -2 / 3 and upper >= 19 / 3
+
+    # Fixed params
+    lower, upper = model.bounds("impact", "system", a=2)[0]
+    assert_close((-0.5, 4.5), (lower, upper), rtol=1e-8)
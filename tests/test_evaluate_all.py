@@ -0,0 +1,50 @@
+"""
+Fused evaluation of the total and all axes of an impact, against evaluation of each axis
+"""
+import pytest
+
+from lib.common import Model, ModelError
+from lib.settings import OUTFILE
+from tests.utils import random_scenarios, assert_close
+
+
+@pytest.fixture(scope="module")
+def model():
+    return Model.from_file(OUTFILE)
+
+
+@pytest.fixture(scope="module")
+def scenarios(model):
+    return random_scenarios(model)
+
+
+def test_evaluate_all(model, scenarios):
+    for functional_unit in model.functional_units:
+        for impact in model.impacts:
+            for scenario in scenarios:
+                fused, unit = model.evaluate_all(impact, functional_unit, **scenario)
+                assert list(fused) == list(model.expressions)
+                for axis in model.expressions:
+                    expected, expected_unit = model.evaluate(impact, functional_unit, axis, **scenario)
+                    assert_close(expected, fused[axis])
+                    assert unit == expected_unit
+
+
+def test_evaluate_all_impacts(model, scenarios):
+    for scenario in scenarios[:5]:
+        res = model.evaluate_all_impacts("system", **scenario)
+        assert list(res) == list(model.impacts)
+        for impact, (vals, unit) in res.items():
+            expected, expected_unit = model.evaluate_all(impact, "system", **scenario)
+            assert_close(expected, vals)
+            assert unit == expected_unit
+
+
+def test_errors(model):
+    impact = next(iter(model.impacts))
+    with pytest.raises(ModelError):
+        model.evaluate_all("unknown_impact", "system")
+    with pytest.raises(ModelError):
+        model.evaluate_all(impact, "unknown_functional_unit")
+    with pytest.raises(ModelError):
+        model.evaluate_all_impacts("unknown_functional_unit")
@@ -0,0 +1,80 @@
+"""
+Gradients of impacts, against finite differences, and elasticities
+"""
+import numpy
+import pytest
+
+from lib.common import Model, ParamType
+from lib.settings import OUTFILE
+from tests.utils import random_scenarios, batch_values, assert_close, small_model
+
+# Relative step of finite differences, and their tolerance
+STEP = 1e-6
+FD_RTOL = 1e-5
+
+
+@pytest.fixture(scope="module")
+def model():
+    return Model.from_file(OUTFILE)
+
+
+def _finite_differences(model, impact, functional_unit, axis, scenario):
+    """Central differences for each float param, computed by a single batch of 2 scenarios per param"""
+
+    names = [name for name, param in model.params.items() if param.type == ParamType.FLOAT]
+    steps = {name: STEP * max(abs(scenario[name]), model.params[name].max - model.params[name].min, 1.0) for name in names}
+
+    scenarios = []
+    for name in names:
+        for sign in [1, -1]:
+            scenarios.append(dict(scenario, **{name: scenario[name] + sign * steps[name]}))
+
+    batch, _ = model.evaluate_batch(impact, functional_unit, axis, batch_values(scenarios))
+    batches = batch if isinstance(batch, dict) else {None: batch}
+
+    return {
+        key: {name: (vals[2 * i] - vals[2 * i + 1]) / (2 * steps[name]) for i, name in enumerate(names)}
+        for key, vals in batches.items()}
+
+
+def test_gradient(model):
+    impact = next(iter(model.impacts))
+    for scenario in random_scenarios(model, samples=2):
+        for axis in model.expressions:
+            grad, unit = model.gradient(impact, "system", axis, **scenario)
+            assert unit == model.evaluate(impact, "system", axis, **scenario)[1]
+
+            grads = grad if model.expressions[axis][impact].keys is not None else {None: grad}
+            expected = _finite_differences(model, impact, "system", axis, scenario)
+            for key, vals in expected.items():
+                # Params without effect are not present
+                scale = max(abs(val) for val in vals.values()) or 1.0
+                for name, val in vals.items():
+                    numpy.testing.assert_allclose(grads.get(key, dict()).get(name, 0.0), val, rtol=FD_RTOL, atol=FD_RTOL * scale, err_msg=str((axis, key, name)))
+
+
+def test_functional_unit():
+    # Impact a*b divided by functional unit c : d/da = b/c, d/db = a/c, d/dc = -a*b/c²
+    model = Model.from_json(dict(
+        params={
+            name: dict(name=name, type="float", default=1.0, min=1.0, max=3.0, unit=None)
+            for name in ["a", "b", "c", "d"]},
+        expressions=dict(total=dict(impact=dict(expr="a*b"))),
+        functional_units=dict(system=dict(quantity=dict(expr="c"), unit=None)),
+        impacts=dict(impact=dict(name="impact", unit="kg"))))
+
+    grad, _ = model.gradient("impact", "system", a=2, b=3, c=2)
+    assert_close(dict(a=1.5, b=1.0, c=-1.5), grad)
+    assert not "d" in grad
+
+    # Relative changes : 1 for a and b, -1 for c
+    elasticities = model.elasticities("impact", "system", a=2, b=3, c=2)
+    assert_close(dict(a=1.0, b=1.0, c=-1.0), elasticities)
+
+
+def test_elasticities():
+    # Elasticity of a**3 + b : 3 * a**3 / (a**3 + b) for a, b / (a**3 + b) for b. Sorted by decreasing absolute value
+    model = small_model(dict(impact="a**3 + b"), dict(a=(1, 3), b=(1, 3)))
+    elasticities = model.elasticities("impact", "system", a=1, b=2)
+    assert list(elasticities) == ["a", "b"]
+    assert_close(dict(a=1.0, b=2 / 3), elasticities)
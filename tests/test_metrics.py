@@ -0,0 +1,28 @@
+"""
+Metrics in Prometheus text format
+"""
+from lib.utils import Metrics
+
+
+def test_to_prometheus():
+    metrics = Metrics(enabled=True)
+    metrics.count("requests_total", handler="EvaluateHandler", status=200)
+    metrics.count("requests_total", handler="EvaluateHandler", status="200")
+    metrics.observe("request_seconds", 0.003, handler=None)
+
+    lines = metrics.to_prometheus(gauges=[("model_info", dict(version="abc"), 1)]).splitlines()
+
+    # Label values are strings : 200 and "200" are the same counter. None is a missing label
+    assert 'lca_requests_total{handler="EvaluateHandler",status="200"} 2' in lines
+    assert 'lca_request_seconds_bucket{handler="",le="0.005"} 1' in lines
+    assert 'lca_request_seconds_count{handler=""} 1' in lines
+    assert "# TYPE lca_model_info gauge" in lines
+    assert 'lca_model_info{version="abc"} 1' in lines
+
+
+def test_label_escaping():
+    metrics = Metrics(enabled=True)
+    metrics.count("files_total", path='C:\\models\\"new"\nmodel.json')
+
+    # Backslash, double quote and line feed are escaped : a single line per sample
+    assert 'lca_files_total{path="C:\\\\models\\\\\\"new\\"\\nmodel.json"} 1' in metrics.to_prometheus().splitlines()
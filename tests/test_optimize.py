@@ -0,0 +1,59 @@
+"""
+Optimization of expressions : negligible terms, factoring and shared intermediates, against the original model
+"""
+import sympy
+
+from lib.common import Model
+from lib.optimize import optimize_model, drop_negligible, factor_sums, extract_intermediates, param_box, rounding_rtol
+from tests.utils import SAMPLES, random_scenarios, assert_close, small_model
+
+
+def test_optimized_model(tmp_path):
+    # c only appears in a negligible term : it should be kept. d is also in a large term : its small term can be dropped.
+    # log(x + y) is shared by both impacts
+    model = small_model(
+        dict(
+            a="1000*x*y*log(x + y) + 20*x*y*z + 0.0001*c + 0.00001*z + 3.5*x*d + 0.00001*d",
+            b="500*y*log(x + y) + 3*y*z + 7*x"),
+        dict(x=(1, 2), y=(1, 3), z=(0, 1), c=(0, 1), d=(1, 2)))
+
+    exprs = [sympy.sympify(model.expressions["total"][impact].expr) for impact in model.impacts]
+    dropped, nb_dropped = drop_negligible(exprs, param_box(model.params), 0.1 * rounding_rtol(3))
+    assert nb_dropped == 2
+    assert sympy.Symbol("c") in dropped[0].free_symbols
+
+    optimized = optimize_model(model, num_digits=3, samples=SAMPLES)
+    assert optimized.intermediates
+
+    # Intermediates are kept in the model file
+    filename = str(tmp_path / "model.json")
+    optimized.to_file(filename)
+    loaded = Model.from_file(filename, cache=False)
+    assert loaded.intermediates == optimized.intermediates
+
+    for impact in model.impacts:
+        assert optimized.expressions["total"][impact].params == model.expressions["total"][impact].params
+        for scenario in random_scenarios(model):
+            expected = model.evaluate(impact, "system", **scenario)[0]
+            assert_close(expected, optimized.evaluate(impact, "system", **scenario)[0], rounding_rtol(3))
+            assert_close(expected, loaded.evaluate(impact, "system", **scenario)[0], rounding_rtol(3))
+
+
+def test_factor_sums():
+    a, b, x, y, z = sympy.symbols("a b x y z")
+    expr = a*b*x + a*b*y + z
+    factored, = factor_sums([expr])
+    assert sympy.count_ops(factored) < sympy.count_ops(expr)
+    assert sympy.expand(factored - expr) == 0
+
+
+def test_extract_intermediates():
+    # Names of intermediates never clash with params named like them
+    x, y, s0 = sympy.symbols("x y _s0")
+    exprs = [sympy.log(x + y) * s0, sympy.log(x + y) + x]
+    intermediates, reduced = extract_intermediates(exprs, exclude=[x, y, s0])
+    assert len(intermediates) == 1
+    assert not "_s0" in intermediates
+    name, = intermediates
+    substitutions = {sympy.Symbol(name): intermediates[name]}
+    assert [expr.subs(substitutions) for expr in reduced] == exprs
@@ -0,0 +1,121 @@
+"""
+Evaluation by worker processes, against serial evaluation, and recovery of the pool when a worker dies
+"""
+from concurrent.futures.process import BrokenProcessPool
+import os
+import numpy
+import pytest
+
+from lib.common import Model
+from lib.parallel import ParallelEvaluator
+from lib.scenarios import evaluate_chunk, result_columns
+from lib.settings import OUTFILE
+
+# Number of scenarios of batches
+SIZE = 1000
+
+
+@pytest.fixture(scope="module")
+def model():
+    return Model.from_file(OUTFILE)
+
+
+@pytest.fixture(scope="module")
+def evaluator(model):
+    with ParallelEvaluator(model, 2) as evaluator:
+        yield evaluator
+
+
+def _values(model, size):
+    rng = numpy.random.default_rng(0)
+    values = {
+        param.name: param.min + rng.random(size) * (param.max - param.min)
+        for param in model.params.values() if param.type == "float"}
+    for param in model.params.values():
+        if param.type == "enum" :
+            values[param.name] = numpy.array(param.values)[rng.integers(0, len(param.values), size)]
+    return values
+
+
+def _die_once(model, marker, i):
+    """Kill the worker on the task removing the marker file : all pending tasks are lost"""
+    if i == 3 and os.path.exists(marker):
+        os.remove(marker)
+        os._exit(1)
+    return i * 10
+
+
+def _die(model, i):
+    os._exit(1)
+
+
+def _fail(model, i):
+    raise ValueError("Failure of task %d" % i)
+
+
+def test_evaluate_batch(model, evaluator):
+    values = _values(model, SIZE)
+
+    # Shards of uneven sizes : results are merged in input order
+    for axis in model.expressions:
+        for impact in model.impacts:
+            expected, unit = model.evaluate_batch(impact, "system", axis, values)
+            actual, actual_unit = evaluator.evaluate_batch(impact, "system", axis, values, shard_size=300)
+            assert actual_unit == unit
+            if isinstance(expected, dict) :
+                assert actual.keys() == expected.keys()
+                for key in expected:
+                    numpy.testing.assert_array_equal(actual[key], expected[key])
+            else:
+                numpy.testing.assert_array_equal(actual, expected)
+
+
+def test_empty_batch(model, evaluator):
+    values = {name: val[:0] for name, val in _values(model, 1).items()}
+    for axis in model.expressions:
+        impact = next(iter(model.impacts))
+        expected, _ = model.evaluate_batch(impact, "system", axis, values)
+        actual, _ = evaluator.evaluate_batch(impact, "system", axis, values)
+        if isinstance(expected, dict) :
+            assert actual.keys() == expected.keys()
+            assert all(len(val) == 0 for val in actual.values())
+        else:
+            assert len(actual) == 0
+
+
+def test_evaluate_chunks(model, evaluator):
+    values = _values(model, SIZE)
+    columns = result_columns(model)
+    chunks = [({name: val[start:start + 400] for name, val in values.items()}, min(400, SIZE - start)) for start in range(0, SIZE, 400)]
+
+    for (chunk, size), actual in zip(chunks, evaluator.evaluate_chunks(chunks, columns)):
+        expected = evaluate_chunk(model, chunk, size, columns)
+        assert actual.keys() == expected.keys()
+        for name in expected:
+            numpy.testing.assert_array_equal(actual[name], expected[name])
+
+
+def test_worker_death(model, tmp_path):
+    marker = str(tmp_path / "marker")
+    open(marker, "w").close()
+
+    with ParallelEvaluator(model, 2) as evaluator:
+        pool = evaluator.pool
+
+        # The pool is restarted, and pending tasks submitted again : all results, in order
+        assert evaluator.map(_die_once, [(marker, i) for i in range(10)]) == [i * 10 for i in range(10)]
+        assert evaluator.pool is not pool
+        assert not os.path.exists(marker)
+
+        # Still usable
+        assert evaluator.map(_die_once, [(marker, i) for i in range(4)]) == [0, 10, 20, 30]
+
+        # Errors of tasks are raised, without retry
+        with pytest.raises(ValueError):
+            evaluator.map(_fail, [(i,) for i in range(3)])
+
+
+def test_max_retries(model):
+    with ParallelEvaluator(model, 1, max_retries=1) as evaluator:
+        with pytest.raises(BrokenProcessPool):
+            evaluator.map(_die, [(0,)])
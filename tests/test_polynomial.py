@@ -0,0 +1,86 @@
+"""
+Polynomial tables, against compiled lambdas of the model and against sympy
+"""
+import numpy
+import pytest
+import sympy
+
+from lib.common import Model
+from lib.polynomial import PolynomialTable, NotPolynomial, from_sympy, try_polynomial
+from lib.settings import OUTFILE
+from tests.utils import random_scenarios, batch_values, assert_close, impacts_axes
+
+
+@pytest.fixture(scope="module")
+def model():
+    return Model.from_file(OUTFILE)
+
+
+@pytest.fixture(scope="module")
+def scenarios(model):
+    return random_scenarios(model)
+
+
+def _expanded_columns(model, names, values):
+    expanded = dict()
+    for param in model.params.values():
+        expanded.update(param.expand_array_values(values[param.name]))
+    return [expanded[name] for name in names]
+
+
+def test_polynomial_tables(model, scenarios):
+    values = batch_values(scenarios)
+    size = len(scenarios)
+
+    # Polynomial table of each lambda, used in batch evaluation when it is faster
+    for impact, axis in impacts_axes(model):
+        lambd = model.expressions[axis][impact]
+        poly = lambd.poly
+        if poly is None or len(poly.fallback) > 0 :
+            continue
+        expected = lambd.lambd(*_expanded_columns(model, lambd.expanded_params, values))
+        actual = poly.evaluate(_expanded_columns(model, poly.variables, values), size)
+        for i, val in enumerate(expected if lambd.keys is not None else [expected]):
+            assert_close(numpy.broadcast_to(val, (size,)), actual[:, i])
+
+    # Single table of all impacts, used in uncertainty and sensitivity analysis
+    impacts = list(model.impacts)
+    table = model.polynomial_table(impacts)
+    if table is not None :
+        actual = table.evaluate(_expanded_columns(model, table.variables, values), size)
+        for i, impact in enumerate(impacts):
+            lambd = model.expressions["total"][impact]
+            expected = lambd.lambd(*_expanded_columns(model, lambd.expanded_params, values))
+            assert_close(numpy.broadcast_to(expected, (size,)), actual[:, i])
+
+
+def test_from_sympy():
+    a, b = sympy.symbols("a b")
+    exprs = [a * (b + 1) ** 2 - 2 / a, sympy.Float(3.5), 2 * a * b ** -2, sympy.exp(a), (a + b) ** -1, a ** b]
+    polys = [try_polynomial(from_sympy, expr) for expr in exprs]
+
+    # Non integer exponents, functions and negative powers of sums are not polynomials
+    assert polys[3:] == [None, None, None]
+    assert polys[1] == {(): 3.5}
+    assert polys[2] == {(("a", 1), ("b", -2)): 2.0}
+    with pytest.raises(NotPolynomial):
+        from_sympy(sympy.exp(a))
+
+    # Non polynomial outputs are left to fallback
+    variables = ["b", "a"]
+    table = PolynomialTable.from_polys(polys, variables)
+    assert table.fallback == [3, 4, 5]
+
+    rng = numpy.random.default_rng(0)
+    columns = [rng.random(10) + 0.5, rng.random(10) + 0.5]
+    actual = table.evaluate(columns, 10)
+    for i, expr in enumerate(exprs[:3]):
+        expected = sympy.lambdify(variables, expr)(*columns)
+        assert_close(numpy.broadcast_to(expected, (10,)), actual[:, i])
+
+    # Polynomials are kept by the compiled form, and by concatenation of tables
+    assert PolynomialTable.from_compiled(table.__compiled__()).polys() == table.polys()
+    with pytest.raises(NotPolynomial):
+        PolynomialTable.concat([table])
+    concat = PolynomialTable.concat([PolynomialTable.from_polys(polys[:2], variables), PolynomialTable.from_polys(polys[2:3], ["a", "b"])])
+    assert_close(actual[:, :3], concat.evaluate([columns[variables.index(name)] for name in concat.variables], 10))
@@ -0,0 +1,135 @@
+"""
+Hot reload of the model : swap of a new version while the current one is read, and admin API
+"""
+import json
+import threading
+import time
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from lib import api
+from lib.reload import ModelHolder, model_version
+from lib.settings import OUTFILE
+
+
+def _write_model(filename, factor):
+    """Small model : impact = factor * (a + b), with the factor in the unit of the impact, to identify its version"""
+    with open(filename, "w") as f:
+        json.dump(dict(
+            params={name: dict(name=name, type="float", default=1.0, min=0.0, max=2.0, unit=None) for name in ["a", "b"]},
+            expressions=dict(total=dict(impact=dict(expr="%d*(a + b)" % factor))),
+            functional_units=dict(system=dict(quantity=dict(expr="1"), unit=None)),
+            impacts=dict(impact=dict(name="impact", unit="kg x%d" % factor))), f)
+
+
+def _factor(state):
+    return int(state.model.impacts["impact"].unit.split("x")[1])
+
+
+def test_swap_during_reads(tmp_path):
+    filename = str(tmp_path / "model.json")
+    _write_model(filename, 1)
+
+    swapped = []
+    holder = ModelHolder(filename, warmup=False, on_swap=swapped.append)
+    versions = {holder.version: 1}
+
+    # Readers evaluate on the state read once : model and version always match
+    stop = threading.Event()
+    errors = []
+    seen = set()
+
+    def read():
+        while not stop.is_set():
+            state = holder.state
+            factor = _factor(state)
+            val, _ = state.model.evaluate("impact", "system", a=1.0, b=2.0)
+            if versions.get(state.version) != factor or val != 3.0 * factor :
+                errors.append((state.version, factor, val))
+            seen.add(factor)
+
+    readers = [threading.Thread(target=read) for i in range(4)]
+    for reader in readers:
+        reader.start()
+
+    try:
+        # Unchanged file : no reload
+        assert not holder.reload()
+
+        for factor in [2, 3]:
+            _write_model(filename, factor)
+            versions[model_version(filename)] = factor
+            assert holder.reload()
+            holder.reload_thread.join()
+            assert _factor(holder.state) == factor
+
+            # Readers switch to the new version
+            deadline = time.time() + 10
+            while not factor in seen and time.time() < deadline:
+                time.sleep(0.01)
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+    assert not errors
+    assert seen == {1, 2, 3}
+    assert [_factor(state) for state in swapped] == [2, 3]
+    assert holder.status()["error"] is None
+
+
+def test_failed_reload(tmp_path):
+    filename = str(tmp_path / "model.json")
+    _write_model(filename, 1)
+    holder = ModelHolder(filename, warmup=False)
+    state = holder.state
+
+    # Broken file : the current model keeps serving
+    with open(filename, "w") as f:
+        f.write("{broken")
+    assert holder.reload()
+    holder.reload_thread.join()
+
+    assert holder.state is state
+    assert holder.status()["error"] is not None
+    assert holder.model.evaluate("impact", "system")[0] == 2.0
+
+
+class AdminTest(AsyncHTTPTestCase):
+
+    TOKEN = "secret"
+
+    def setUp(self):
+        self.holder = ModelHolder(OUTFILE, warmup=False)
+        self.token = api.ADMIN_TOKEN
+        api.ADMIN_TOKEN = self.TOKEN
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        api.ADMIN_TOKEN = self.token
+
+    def get_app(self):
+        return Application([("/api/admin/reload", api.ReloadHandler, dict(holder=self.holder))])
+
+    def fetch_status(self, token=None):
+        headers = {"Authorization": "Bearer %s" % token} if token is not None else dict()
+        return self.fetch("/api/admin/reload", headers=headers, raise_error=False)
+
+    def test_token(self):
+        self.assertEqual(self.fetch_status().code, 401)
+        self.assertEqual(self.fetch_status("wrong").code, 401)
+        self.assertEqual(self.fetch_status(self.TOKEN + "x").code, 401)
+
+        response = self.fetch_status(self.TOKEN)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)["version"], self.holder.version)
+
+        # Unchanged file : no reload
+        response = self.fetch("/api/admin/reload", method="POST", body="", headers={"Authorization": "Bearer %s" % self.TOKEN})
+        self.assertEqual(response.code, 200)
+        self.assertFalse(json.loads(response.body)["started"])
+
+    def test_disabled(self):
+        api.ADMIN_TOKEN = None
+        self.assertEqual(self.fetch_status(self.TOKEN).code, 403)
@@ -0,0 +1,71 @@
+"""
+LRU cache of results of the model : hits, misses, evictions, and canonical keys of param values
+"""
+from lib.common import LRUCache
+from tests.utils import small_model
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+
+    # 'a' is used last : 'b' is evicted
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats() == dict(size=2, maxsize=2, hits=2, misses=1, evictions=1)
+
+    cache.clear()
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_disabled_cache():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert cache.stats() == dict(size=0, maxsize=0, hits=0, misses=1, evictions=0)
+
+
+def test_evaluate():
+    model = small_model(dict(impact="a*b + 1"), dict(a=(1, 3), b=(0, 2)))
+    model.cache = LRUCache(2)
+
+    assert model.evaluate("impact", "system", a=2, b=1)[0] == 3.0
+    assert model.cache.stats()["misses"] == 1
+
+    # Same canonical values : integers or floats, default values explicit or not
+    assert model.evaluate("impact", "system", a=2.0, b=1.0)[0] == 3.0
+    assert model.evaluate("impact", "system")[0] == model.evaluate("impact", "system", a=1.0, b=0.0)[0]
+    assert model.cache.stats() == dict(size=2, maxsize=2, hits=2, misses=2, evictions=0)
+
+    # Least recently used values are evicted
+    model.evaluate("impact", "system", a=3, b=2)
+    model.evaluate("impact", "system", a=2, b=1)
+    assert model.cache.stats() == dict(size=2, maxsize=2, hits=2, misses=4, evictions=2)
+
+
+def test_evaluate_all():
+    model = small_model(dict(impact="a*b + 1"), dict(a=(1, 3), b=(0, 2)))
+
+    # Results of all axes are cached apart from results of a single axis, and copied : callers can not alter them
+    res, _ = model.evaluate_all("impact", "system", a=2, b=1)
+    res["total"] = -1.0
+    assert model.evaluate_all("impact", "system", a=2, b=1)[0]["total"] == 3.0
+    assert model.evaluate("impact", "system", a=2, b=1)[0] == 3.0
+    assert model.cache.stats()["hits"] == 1
+    assert model.cache.stats()["misses"] == 2
+
+    model.clear_cache()
+    model.evaluate_all("impact", "system", a=2, b=1)
+    assert model.cache.stats()["misses"] == 3
+
+
+def test_new_model():
+    # A reloaded model starts with an empty cache
+    exprs, params = dict(impact="a*b + 1"), dict(a=(1, 3), b=(0, 2))
+    model = small_model(exprs, params)
+    model.evaluate("impact", "system")
+    assert small_model(exprs, params).cache.stats()["size"] == 0
@@ -0,0 +1,112 @@
+"""
+Scenarios streamed by chunks : grids, files of scenarios, and results written to CSV / Parquet files
+"""
+import numpy
+import pyarrow
+import pyarrow.csv
+import pyarrow.parquet
+import pytest
+
+from lib.common import Model
+from lib.scenarios import grid_scenarios, read_scenarios, evaluate_scenarios, result_columns
+from lib.settings import OUTFILE
+
+# Relative tolerance of batch evaluation against single evaluation
+RTOL = 1e-9
+
+
+@pytest.fixture(scope="module")
+def model():
+    return Model.from_file(OUTFILE)
+
+
+def _concat(chunks):
+    """Concatenate chunks of scenarios : <dict of column => array>, <list of chunk sizes>"""
+    chunks = list(chunks)
+    sizes = [size for _, size in chunks]
+    for values, size in chunks:
+        assert all(len(column) == size for column in values.values())
+    return {name: numpy.concatenate([values[name] for values, _ in chunks]) for name in chunks[0][0]}, sizes
+
+
+def _check_results(model, table, columns, scenarios, size):
+    """Compare rows of results to single evaluation of their scenarios"""
+
+    assert table.num_rows == size
+    for i in range(size):
+        scenario = {name: val[i].item() for name, val in scenarios.items() if name in model.params}
+        for name, (impact, functional_unit, axis, key) in columns.items():
+            expected, _ = model.evaluate(impact, functional_unit, axis, **scenario)
+            expected = expected if key is None else expected.get(key, 0.0)
+            assert table.column(name)[i].as_py() == pytest.approx(expected, rel=RTOL, abs=RTOL * abs(expected))
+
+
+def test_grid_chunks(model):
+    total, chunks = grid_scenarios(model, samples=5, chunk_size=7)
+    values, sizes = _concat(chunks)
+
+    # Full grid of enum and bool params, for each sample of float params
+    assert total == 5 * 3 * 2 * 2 == sum(sizes)
+    assert max(sizes) == 7
+
+    # Same scenarios, whatever the size of chunks
+    _, chunks = grid_scenarios(model, samples=5, chunk_size=1000)
+    all_values, sizes = _concat(chunks)
+    assert sizes == [total]
+    assert values.keys() == all_values.keys()
+    for name in values:
+        numpy.testing.assert_array_equal(values[name], all_values[name])
+
+    for name, param in model.params.items():
+        if param.type == "float" and param.min < param.max :
+            assert ((values[name] >= param.min) & (values[name] <= param.max)).all()
+            assert len(numpy.unique(values[name])) == 5
+
+
+def test_empty_grid(model, tmp_path):
+    # No grid nor sampled params : a single scenario of default values, without any param column
+    total, chunks = grid_scenarios(model, grid_params=[], samples=0)
+    assert total == 1
+
+    output = str(tmp_path / "results.csv")
+    assert evaluate_scenarios(model, chunks, output, impacts=[next(iter(model.impacts))]) == 1
+
+    columns = result_columns(model, impacts=[next(iter(model.impacts))])
+    _check_results(model, pyarrow.csv.read_csv(output), columns, dict(), 1)
+
+
+@pytest.mark.parametrize("format", ["csv", "parquet"])
+def test_stream_results(model, tmp_path, format):
+    total, chunks = grid_scenarios(model, samples=2, chunk_size=5)
+    scenarios, _ = _concat(grid_scenarios(model, samples=2, chunk_size=5)[1])
+
+    output = str(tmp_path / ("results." + format))
+    assert evaluate_scenarios(model, chunks, output, total=total) == total
+
+    table = pyarrow.parquet.read_table(output) if format == "parquet" else pyarrow.csv.read_csv(output)
+    columns = result_columns(model)
+    assert table.column_names == list(scenarios) + list(columns)
+    _check_results(model, table, columns, scenarios, total)
+
+
+def test_read_scenarios(model, tmp_path):
+    # Scenarios with an id column, passed through to the results
+    _, chunks = grid_scenarios(model, samples=3)
+    scenarios, _ = _concat(chunks)
+    size = len(next(iter(scenarios.values())))
+    inputs = dict(id=numpy.arange(size), **scenarios)
+
+    filename = str(tmp_path / "scenarios.parquet")
+    pyarrow.parquet.write_table(pyarrow.table(inputs), filename)
+
+    total, chunks = read_scenarios(model, filename, chunk_size=4)
+    assert total == size
+
+    output = str(tmp_path / "results.parquet")
+    impacts = [next(iter(model.impacts))]
+    assert evaluate_scenarios(model, chunks, output, impacts=impacts, include_params=False) == size
+
+    table = pyarrow.parquet.read_table(output)
+    assert table.column("id").to_pylist() == list(range(size))
+    assert not set(model.params) & set(table.column_names)
+    _check_results(model, table, result_columns(model, impacts=impacts), scenarios, size)
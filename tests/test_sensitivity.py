@@ -0,0 +1,49 @@
+"""
+Uncertainty propagation and Sobol indices, on models with known moments and indices
+"""
+import pytest
+
+from lib.sensitivity import sobol_indices, uncertainty
+from tests.utils import small_model
+
+
+@pytest.fixture(scope="module")
+def model():
+    # Linear model : variance of 2*a is 4/12, the one of b is 1/12
+    return small_model(dict(impact="2*a + b"), dict(a=(0, 1), b=(0, 1)))
+
+
+def test_uncertainty(model):
+    res = uncertainty(model, n=8192)["impact"]["system"]
+    assert res["mean"] == pytest.approx(1.5, rel=0.01)
+    assert res["std"] == pytest.approx((5 / 12) ** 0.5, rel=0.01)
+    assert res["percentiles"][50] == pytest.approx(1.5, rel=0.02)
+    assert res["percentiles"][5] < res["percentiles"][50] < res["percentiles"][95]
+
+    # Same samples, whatever the size of chunks
+    chunked = uncertainty(model, n=8192, chunk_size=1024)["impact"]["system"]
+    assert chunked["mean"] == pytest.approx(res["mean"], rel=1e-9)
+    assert chunked["std"] == pytest.approx(res["std"], rel=1e-9)
+
+    # Fixed params are not sampled
+    res = uncertainty(model, n=8192, fixed_values=dict(b=0.0))["impact"]["system"]
+    assert res["mean"] == pytest.approx(1.0, rel=0.01)
+    assert res["std"] == pytest.approx((4 / 12) ** 0.5, rel=0.01)
+
+
+def test_sobol_indices(model):
+    res = sobol_indices(model, n=4096)["impact"]["system"]
+    for indices in [res["S1"], res["ST"]]:
+        assert indices["a"] == pytest.approx(0.8, abs=0.03)
+        assert indices["b"] == pytest.approx(0.2, abs=0.03)
+    assert res["mean"] == pytest.approx(1.5, rel=0.01)
+
+
+def test_sobol_interactions():
+    # Product : the total index of each param includes the interaction, not the first order one
+    model = small_model(dict(impact="a * b"), dict(a=(0, 1), b=(0, 1)))
+
+    res = sobol_indices(model, n=8192)["impact"]["system"]
+    for name in ["a", "b"]:
+        assert res["S1"][name] == pytest.approx(3 / 7, abs=0.03)
+        assert res["ST"][name] == pytest.approx(4 / 7, abs=0.03)
@@ -0,0 +1,72 @@
+"""
+Stateful evaluation session, against Model.evaluate_all(), and count of expressions recomputed on each change of params
+"""
+import pytest
+
+from lib.common import Model, LRUCache, EvaluationSession
+from lib.settings import OUTFILE
+from tests.utils import random_scenarios, assert_close
+
+
+@pytest.fixture(scope="module")
+def model():
+    return Model.from_file(OUTFILE)
+
+
+@pytest.fixture(scope="module")
+def scenarios(model):
+    return random_scenarios(model)
+
+
+def test_evaluation_session(model, scenarios):
+    session = EvaluationSession(model)
+    for functional_unit in model.functional_units:
+        for impact in model.impacts:
+            # Consecutive scenarios : the session only evaluates expressions depending on changed params
+            for scenario in scenarios:
+                assert_close(
+                    model.evaluate_all(impact, functional_unit, **scenario)[0],
+                    session.evaluate(impact, functional_unit, **scenario)[0])
+
+
+def test_recomputed_expressions():
+    # Axis 'total' depends on a and b, axis 'part' on a only, functional unit on c
+    params = dict(a=(1, 3), b=(0, 2), c=(1, 2))
+    model = Model.from_json(dict(
+        params={
+            name: dict(name=name, type="float", default=lower, min=lower, max=upper, unit=None)
+            for name, (lower, upper) in params.items()},
+        expressions=dict(
+            total=dict(impact=dict(expr="a + b")),
+            part=dict(impact=dict(expr="2*a"))),
+        functional_units=dict(system=dict(quantity=dict(expr="c"), unit=None)),
+        impacts=dict(impact=dict(name="impact", unit="kg"))))
+
+    # No cache of results : only the session saves computations
+    model.cache = LRUCache(0)
+    session = EvaluationSession(model)
+
+    def evaluate(**values):
+        res, _ = session.evaluate("impact", "system", **values)
+        assert_close(model.evaluate_all("impact", "system", **values)[0], res)
+        return res
+
+    # Functional unit, then both axes at once by the fused lambda
+    assert evaluate(a=2, b=1, c=2) == dict(total=1.5, part=2.0)
+    assert session.nb_computed == 2
+
+    # Nothing changed
+    evaluate(a=2, b=1, c=2)
+    assert session.nb_computed == 2
+
+    # Axis 'total' only
+    assert evaluate(a=2, b=2, c=2) == dict(total=2.0, part=2.0)
+    assert session.nb_computed == 3
+
+    # Functional unit only
+    assert evaluate(a=2, b=2, c=1) == dict(total=4.0, part=4.0)
+    assert session.nb_computed == 4
+
+    # Both axes
+    assert evaluate(a=3, b=2, c=1) == dict(total=5.0, part=6.0)
+    assert session.nb_computed == 5
@@ -0,0 +1,59 @@
+"""
+Partial evaluation of the model with some params fixed, against evaluation of the full model
+"""
+import pytest
+
+from lib.common import Model, ParamType, ModelError
+from lib.settings import OUTFILE
+from tests.utils import random_scenarios, assert_close, small_model
+
+
+@pytest.fixture(scope="module")
+def model():
+    return Model.from_file(OUTFILE)
+
+
+@pytest.fixture(scope="module")
+def scenarios(model):
+    return random_scenarios(model)
+
+
+def test_specialize(model, scenarios):
+    fixed = dict()
+    for param in model.params.values():
+        if param.type == ParamType.ENUM :
+            fixed[param.name] = param.values[-1]
+        elif param.type == ParamType.FLOAT and len(fixed) < 4 :
+            fixed[param.name] = param.max
+
+    specialized = model.specialize(fixed)
+    assert specialized.fixed_params == fixed
+    assert not set(fixed) & set(specialized.params)
+
+    for functional_unit in model.functional_units:
+        for impact in model.impacts:
+            for scenario in scenarios:
+                others = {name: val for name, val in scenario.items() if not name in fixed}
+                assert_close(
+                    model.evaluate_all(impact, functional_unit, **dict(scenario, **fixed))[0],
+                    specialized.evaluate_all(impact, functional_unit, **others)[0])
+
+
+def test_small_model():
+    model = small_model(dict(impact="a*b + c"), dict(a=(1, 3), b=(0, 2), c=(0, 1)))
+
+    # Constant parts are folded
+    specialized = model.specialize(dict(a=2, b=1.5))
+    assert list(specialized.params) == ["c"]
+    assert specialized.evaluate("impact", "system", c=0.5)[0] == 3.5
+    assert str(specialized.expressions["total"]["impact"].expr).replace(" ", "") in ["c+3.0", "3.0+c"]
+
+    # Specialized models are cached by canonical fixed values
+    assert model.specialize(dict(b=1.5, a=2.0)) is specialized
+
+    # Fixed params accumulate
+    assert specialized.specialize(dict(c=1)).fixed_params == dict(a=2, b=1.5, c=1)
+    assert specialized.specialize(dict(c=1)).evaluate("impact", "system")[0] == 4.0
+
+    with pytest.raises(ModelError):
+        model.specialize(dict(unknown=1.0))
@@ -0,0 +1,73 @@
+"""
+Helpers of tests : scenarios covering the box of params, comparison of results, small models
+"""
+import numpy
+
+from lib.common import Model, ParamType
+from lib.sensitivity import scale_samples
+
+# Number of random scenarios, and of random corners
+SAMPLES = 20
+
+# Relative tolerance of paths computing the same expressions in another order
+RTOL = 1e-9
+
+
+def random_scenarios(model, samples=SAMPLES, seed=0):
+    """
+    List of scenarios (dict of param => value) : random ones, then corners of the box of params
+    (all params at min, all at max, and random combinations of min and max)
+    """
+
+    params = list(model.params.values())
+    rng = numpy.random.default_rng(seed)
+    uniform = numpy.concatenate([
+        rng.random((samples, len(params))),
+        numpy.zeros((1, len(params))),
+        numpy.ones((1, len(params))),
+        rng.integers(0, 2, (samples, len(params)))])
+    values = scale_samples(params, uniform)
+
+    res = []
+    for i in range(len(uniform)):
+        scenario = dict()
+        for param in params:
+            val = values[param.name][i]
+            scenario[param.name] = param.values[int(val)] if param.type == ParamType.ENUM else float(val)
+        res.append(scenario)
+    return res
+
+
+def batch_values(scenarios):
+    """Dict of param => array of values"""
+    return {name: numpy.array([scenario[name] for scenario in scenarios]) for name in scenarios[0]}
+
+
+def assert_close(expected, actual, rtol=RTOL):
+    """Values, or dicts of axis key => value. Missing keys are zero (axis key 'null' is removed when zero)"""
+
+    if isinstance(expected, dict) or isinstance(actual, dict) :
+        for key in set(expected) | set(actual):
+            assert_close(expected.get(key, 0.0), actual.get(key, 0.0), rtol)
+        return
+
+    numpy.testing.assert_allclose(actual, expected, rtol=rtol, atol=rtol * numpy.max(numpy.abs(expected), initial=0.0))
+
+
+def impacts_axes(model):
+    return [(impact, axis) for impact in model.impacts for axis in model.expressions]
+
+
+def small_model(exprs, params):
+    """
+    Model with float params and a single axis 'total'
+    :param exprs: Dict of impact => expression
+    :param params: Dict of param => (min, max)
+    """
+    return Model.from_json(dict(
+        params={
+            name: dict(name=name, type="float", default=lower, min=lower, max=upper, unit=None)
+            for name, (lower, upper) in params.items()},
+        expressions=dict(total={impact: dict(expr=expr) for impact, expr in exprs.items()}),
+        functional_units=dict(system=dict(quantity=dict(expr="1"), unit=None)),
+        impacts={impact: dict(name=impact, unit="kg") for impact in exprs}))